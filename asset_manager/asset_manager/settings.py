@@ -43,11 +43,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'assets.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'assets.journal.JournalActorMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -68,6 +70,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'assets.scope.tenant_scope',
             ],
         },
     },
@@ -146,11 +149,129 @@ AUTHENTICATION_BACKENDS = [
 
 # Ensure these middleware are present in MIDDLEWARE
 MIDDLEWARE = [
+    'assets.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'assets.journal.JournalActorMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
+
+# Dashboard pagination
+ASSET_LIST_PAGE_SIZE = int(os.environ.get('ASSET_LIST_PAGE_SIZE', 50))
+ASSET_LIST_MAX_PAGE_SIZE = 500
+
+# Seconds the dashboard's asset rows and filter dropdowns stay in the
+# fragment cache; writes invalidate them earlier (see assets.fragments)
+DASHBOARD_FRAGMENT_CACHE_TIMEOUT = 3600
+
+# JSON API pagination (see assets.api)
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+
+# Upper bound on the number of ranked results a dashboard search returns
+ASSET_SEARCH_LIMIT = 500
+
+# Cache
+# Local memory by default. Point DJANGO_CACHE_BACKEND/DJANGO_CACHE_LOCATION at
+# a shared backend (e.g. django.core.cache.backends.redis.RedisCache or
+# django.core.cache.backends.filebased.FileBasedCache) when running more than
+# one process, so that invalidations reach every worker.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'asset-manager'),
+    }
+}
+
+# Seconds a user's role and customer assignments stay cached. Changes drop
+# the entries at once only in a shared cache: with the per-process default the
+# LOCAL timeout applies, which bounds how long another worker, or a
+# `sync_directory` run, can leave a removed customer visible. Deployments with
+# more than one process need a shared backend to keep the longer timeout.
+TENANT_SCOPE_CACHE_TIMEOUT = 3600
+TENANT_SCOPE_LOCAL_CACHE_TIMEOUT = 5
+
+# Seconds a process keeps a customer's compiled group rules (see
+# assets.grouping) when the cache is per-process, so rule edits made by other
+# processes are picked up; with a shared cache they are kept until a rule
+# changes.
+GROUP_MATCHER_LOCAL_TIMEOUT = 5
+
+# Seconds per-customer patch compliance totals stay cached (see
+# assets.compliance); the LOCAL timeout applies with a per-process cache,
+# which never sees the invalidations of imports and edits in other processes.
+PATCH_COMPLIANCE_CACHE_TIMEOUT = 3600
+PATCH_COMPLIANCE_LOCAL_CACHE_TIMEOUT = 5
+
+# User management list page size
+USER_LIST_PAGE_SIZE = 100
+
+# Reachability polling (`manage.py poll_assets`, see assets.poller). An asset
+# counts as seen when a TCP connect to any of the ports succeeds; assets can
+# override the ports with "poll_ports" in their configuration (a list, or
+# "22 443" from the asset form).
+ASSET_POLL_PORTS = [22, 80, 443, 3389]
+ASSET_POLL_CONCURRENCY = int(os.environ.get('ASSET_POLL_CONCURRENCY', 500))
+ASSET_POLL_TIMEOUT = float(os.environ.get('ASSET_POLL_TIMEOUT', 3))
+
+# Days of check history kept per resolution (see assets.history)
+CHECK_HISTORY_RETENTION_DAYS = {'raw': 2, '5m': 30, '1h': 400}
+
+# Log ingestion (see assets.ingest): events written per bulk_create, and lines
+# buffered between the listeners and the writer. A full buffer blocks TCP and
+# file readers and drops (and counts) UDP datagrams.
+LOG_INGEST_BATCH_SIZE = 1000
+LOG_INGEST_QUEUE_SIZE = 50000
+# Attempts at writing a batch the database rejects, with a doubling delay,
+# before it is logged and counted as failed
+LOG_INGEST_WRITE_ATTEMPTS = 5
+
+# Change journal (see assets.journal): entries queued for the background
+# writer and written per bulk_create. A full queue makes the committing thread
+# write its entries itself. JOURNAL_ASYNC = False always writes them there.
+JOURNAL_ASYNC = True
+JOURNAL_QUEUE_SIZE = 10000
+JOURNAL_BATCH_SIZE = 500
+JOURNAL_FLUSH_INTERVAL = 0.5
+# Age in days past which `manage.py compact_journal` folds entries into snapshots
+JOURNAL_COMPACT_AFTER_DAYS = 90
+
+# Inventory snapshots (`manage.py snapshot_inventory`, see assets.snapshots):
+# where the files go, and days they are kept before the command prunes them
+INVENTORY_SNAPSHOT_DIR = BASE_DIR / 'snapshots'
+INVENTORY_SNAPSHOT_RETENTION_DAYS = 400
+
+# Request instrumentation (see assets.instrumentation): the share of requests
+# measured, and addresses that may read /metrics without logging in (admins
+# always can). None by default: behind a reverse proxy every request comes
+# from loopback, so the scraper's address has to be listed explicitly.
+INSTRUMENTATION_SAMPLE_RATE = float(os.environ.get('INSTRUMENTATION_SAMPLE_RATE', 1.0))
+METRICS_ALLOWED_IPS = [ip for ip in os.environ.get('METRICS_ALLOWED_IPS', '').split(',') if ip]
+
+# Git export target (see assets.git_export). The remote can be a GitHub URL or,
+# for testing, the path of a local bare repository.
+GIT_EXPORT_REMOTE = os.environ.get('GIT_EXPORT_REMOTE', '')
+GIT_EXPORT_BRANCH = os.environ.get('GIT_EXPORT_BRANCH', 'main')
+GIT_EXPORT_STATE_DIR = BASE_DIR / 'git_export'
+GIT_EXPORT_AUTHOR = 'Asset Manager <asset-manager@localhost>'
+
+# Directory sources for `manage.py sync_directory <source>` (see
+# assets.directory). Options other than 'provider' and 'role' are passed to the
+# provider; tokens are OAuth access tokens with read access to users.
+DIRECTORY_SOURCES = {
+    'entra': {
+        'provider': 'entra',
+        'base_url': os.environ.get('ENTRA_GRAPH_URL', 'https://graph.microsoft.com'),
+        'token': os.environ.get('ENTRA_ACCESS_TOKEN', ''),
+    },
+    'google': {
+        'provider': 'google',
+        'base_url': os.environ.get('GOOGLE_DIRECTORY_URL', 'https://admin.googleapis.com'),
+        'token': os.environ.get('GOOGLE_ACCESS_TOKEN', ''),
+        'customer': os.environ.get('GOOGLE_CUSTOMER_ID', 'my_customer'),
+    },
+}
@@ -0,0 +1,235 @@
+"""
+Read-only JSON API for assets and customers, scoped like the HTML views.
+
+Lists are paginated with cursors (assets.pagination.KeysetPaginator) and
+read with ``.values()`` of just the requested ``?fields=``. Responses carry
+a strong ETag and a Last-Modified built from the rows' ``updated_at`` (and,
+for assets, ``last_checked``, which polls move without touching
+``updated_at``). Those are read before anything else, so a client that
+sends them back gets a 304 for one narrow query. A list page's ETag also
+covers its cursors, so a page that gained a neighbour is not a 304; lists
+send no Last-Modified, since no row's timestamp covers that.
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, quote_etag
+from django.views.generic import View
+
+from .config_index import filter_by_config, parse_config_filters
+from .models import Asset, Customer
+from .pagination import InvalidCursor, KeysetPaginator
+from .scope import TenantScopeMixin
+from .search import filter_assets
+
+ASSET_FIELDS = [
+    'id', 'customer', 'name', 'asset_type', 'ip_address', 'status', 'business_criticality',
+    'monitoring_status', 'last_checked', 'last_seen', 'patch_cycle', 'last_patched', 'patch_due_at',
+    'configuration', 'updated_at',
+]
+
+CUSTOMER_FIELDS = ['id', 'display_name', 'legal_name', 'contact_person', 'created_at', 'updated_at']
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def make_etag(*parts):
+    return quote_etag(hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest())
+
+
+class ApiView(LoginRequiredMixin, TenantScopeMixin, View):
+    model = None
+    # Restricts rows to the user's customers (see TenantScope.restrict)
+    scope_field = 'customer'
+    fields = []
+    # Columns the ETag and Last-Modified are built from
+    validator_fields = ['updated_at']
+    sort_options = ['id']
+
+    def handle_no_permission(self):
+        return JsonResponse({'error': 'Authentication required'}, status=403)
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except ApiError as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
+
+    def get_queryset(self):
+        return self.scope.restrict(self.model.objects.all(), field=self.scope_field)
+
+    def get_fields(self):
+        value = self.request.GET.get('fields', '').strip()
+        if not value:
+            return self.fields
+        fields = [field.strip() for field in value.split(',') if field.strip()]
+        unknown = [field for field in fields if field not in self.fields]
+        if unknown:
+            raise ApiError(f'Unknown fields: {", ".join(unknown)}; choose from {", ".join(self.fields)}')
+        return list(dict.fromkeys(fields))
+
+    def last_modified(self, row):
+        return max(row[field] for field in self.validator_fields if row[field] is not None)
+
+    def respond(self, rows_key, last_modified, build):
+        """
+        A 304 if the request's validators match ``rows_key``, or else the
+        JSON that ``build`` returns, with the ETag and Last-Modified set.
+        """
+        etag = make_etag(self.request.path, sorted(self.request.GET.lists()), rows_key)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        response = get_conditional_response(self.request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = JsonResponse(build())
+        response.headers['ETag'] = etag
+        if timestamp is not None:
+            response.headers['Last-Modified'] = http_date(timestamp)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+class ApiListView(ApiView):
+    def filter_queryset(self, queryset):
+        return queryset
+
+    def get_page_size(self):
+        page_size = getattr(settings, 'API_PAGE_SIZE', 100)
+        max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 1000)
+        try:
+            page_size = int(self.request.GET.get('page_size', page_size))
+        except ValueError:
+            raise ApiError('page_size must be a number')
+        return max(1, min(page_size, max_page_size))
+
+    def get_sort(self):
+        sort = self.request.GET.get('sort', self.sort_options[0])
+        if sort not in self.sort_options:
+            raise ApiError(f'sort must be one of {", ".join(self.sort_options)}')
+        return sort
+
+    def page_url(self, cursor):
+        if cursor is None:
+            return None
+        query = self.request.GET.copy()
+        query['cursor'] = cursor
+        return f'{self.request.path}?{query.urlencode()}'
+
+    def get(self, request):
+        fields = self.get_fields()
+        sort = self.get_sort()
+        queryset = self.filter_queryset(self.get_queryset())
+        # The page is found with just its validators; a matching client
+        # costs that one narrow query, anyone else one more for the fields
+        columns = list(dict.fromkeys(['pk', sort.lstrip('-'), *self.validator_fields]))
+        paginator = KeysetPaginator(queryset.values(*columns), sort, self.get_page_size())
+        try:
+            page = paginator.page(request.GET.get('cursor'))
+        except InvalidCursor:
+            raise ApiError('Invalid cursor')
+        keys = (
+            [tuple(row[field] for field in ['pk', *self.validator_fields]) for row in page],
+            page.next_cursor, page.previous_cursor,
+        )
+
+        def build():
+            pks = [row['pk'] for row in page]
+            rows = {row['pk']: row for row in queryset.order_by().filter(pk__in=pks).values('pk', *fields)}
+            return {
+                'results': [{field: rows[pk][field] for field in fields} for pk in pks if pk in rows],
+                'next': self.page_url(page.next_cursor),
+                'previous': self.page_url(page.previous_cursor),
+            }
+
+        return self.respond(keys, None, build)
+
+
+class ApiDetailView(ApiView):
+    def get(self, request, pk):
+        queryset = self.get_queryset().filter(pk=pk)
+        # Validators first: a matching client costs one narrow query
+        validators = queryset.values(*self.validator_fields).first()
+        if validators is None:
+            raise ApiError('Not found', status=404)
+        fields = self.get_fields()
+
+        def build():
+            row = queryset.values(*fields).first()
+            if row is None:  # Deleted in between
+                raise ApiError('Not found', status=404)
+            return row
+
+        return self.respond(tuple(validators.values()), self.last_modified(validators), build)
+
+
+class AssetQuerysetMixin:
+    """
+    Assets in the user's scope, with lists narrowed by the dashboard's filters:
+    ``customer``, ``asset_type``, ``criticality``, ``status``
+    (active/inactive), ``search`` and ``config.<key>=<value>``, plus
+    ``updated_since`` (ISO 8601) for clients that sync changes.
+    """
+    model = Asset
+    fields = ASSET_FIELDS
+    validator_fields = ['updated_at', 'last_checked']
+    sort_options = ['id', 'name', '-name', 'updated_at', '-updated_at', '-last_checked']
+
+    def filter_queryset(self, queryset):
+        params = self.request.GET
+        try:
+            if params.get('customer'):
+                queryset = queryset.filter(customer_id=int(params['customer']))
+        except ValueError:
+            raise ApiError('customer must be a customer ID')
+        if params.get('asset_type'):
+            queryset = queryset.filter(asset_type=params['asset_type'])
+        if params.get('criticality'):
+            queryset = queryset.filter(business_criticality=params['criticality'])
+        if params.get('status'):
+            queryset = queryset.filter(status__in=[params['status'] == 'active'])
+        if params.get('updated_since'):
+            try:
+                since = parse_datetime(params['updated_since'])
+            except ValueError:
+                since = None
+            if since is None or since.tzinfo is None:
+                raise ApiError('updated_since must be an ISO 8601 datetime with a timezone')
+            queryset = queryset.filter(updated_at__gt=since)
+        queryset = filter_by_config(queryset, parse_config_filters(params))
+        search = params.get('search', '').strip()
+        if search:
+            queryset = filter_assets(queryset, search)
+        return queryset
+
+
+class AssetListApiView(AssetQuerysetMixin, ApiListView):
+    pass
+
+
+class AssetDetailApiView(AssetQuerysetMixin, ApiDetailView):
+    pass
+
+
+class CustomerQuerysetMixin:
+    model = Customer
+    fields = CUSTOMER_FIELDS
+    sort_options = ['display_name', 'id', 'updated_at', '-updated_at']
+
+    def get_queryset(self):
+        # Listed like the customer pages: all of them for admins and managers
+        return self.scope.visible_customers()
+
+
+class CustomerListApiView(CustomerQuerysetMixin, ApiListView):
+    pass
+
+
+class CustomerDetailApiView(CustomerQuerysetMixin, ApiDetailView):
+    pass
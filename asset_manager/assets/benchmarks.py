@@ -0,0 +1,799 @@
+"""
+Benchmarks for the bulk code paths.
+
+Each benchmark is a function registered with ``@benchmark`` that seeds the
+data it needs and returns a dict of measurements. ``manage.py run_benchmarks``
+runs them against a throwaway database created the same way as the test
+database, so real data is never touched.
+"""
+import json
+import logging
+import math
+import random
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+from django.db.models.functions import Mod
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .compliance import compute_compliance, customer_compliance
+from .config_index import rebuild_config_index
+from .directory import DirectorySync, EntraDirectory
+from .git_export import GitExporter
+from .grouping import MATCH_FIELDS, Membership, get_matcher, rebuild_memberships
+from . import history
+from .ingest import AssetResolver, Ingestor, TCPSource
+from . import instrumentation, journal, snapshots
+from .ip import ip_key
+from .ipindex import IPIndex
+from .models import Asset, AssetGroup, CheckChunk, Customer, GroupRule, JournalEntry, LogEvent, UserRole, patch_due
+from .poller import Poller, raise_open_file_limit
+from .stats import STATS_FIELDS, asset_totals, customer_totals, rebuild_stats
+from .testing import FakeDirectoryServer, entra_recording
+
+BENCHMARKS = {}
+
+ASSET_TYPES = [value for value, _ in Asset.ASSET_TYPES]
+CRITICALITIES = [value for value, _ in Asset.CRITICALITY_CHOICES]
+PATCH_CYCLES = [value for value, _ in Asset.PATCH_CYCLE_CHOICES]
+LOCATIONS = ['HQ', 'DC1', 'DC2', 'Branch', 'Cloud']
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def run_benchmark(name, **options):
+    """
+    Run benchmark ``name``. The journal is written by the saving thread: on
+    the in-memory SQLite database the benchmarks use, the background writer
+    would lock out the benchmark's own writes (the journal benchmark turns
+    it back on for its measurement).
+    """
+    with override_settings(JOURNAL_ASYNC=False):
+        return BENCHMARKS[name](**options)
+
+
+class Timer:
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = round(time.perf_counter() - self.started, 4)
+
+
+def seed_customers(count, prefix='bench'):
+    users = User.objects.bulk_create(
+        [User(username=f'{prefix}-owner-{i}') for i in range(count)], batch_size=1000,
+    )
+    return Customer.objects.bulk_create(
+        [Customer(user=user, display_name=f'Customer {i}', legal_name=f'Company {i}')
+         for i, user in enumerate(users)],
+        batch_size=1000,
+    )
+
+
+def seed_assets(customers, count, seed=0, batch_size=5000, ipv6=0.0):
+    """
+    Bulk-create ``count`` varied assets spread over ``customers``; a share
+    ``ipv6`` of them get an IPv6 address instead of 10.x.y.z.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    batch = []
+    for i in range(count):
+        if ipv6 and rng.random() < ipv6:
+            ip_address = f'fd00:{i >> 16:x}::{i & 0xffff:x}'
+        else:
+            ip_address = f'10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}'
+        patch_cycle = rng.choice(PATCH_CYCLES)
+        last_patched = None if rng.random() < 0.05 else now - timedelta(days=rng.randrange(200))
+        batch.append(Asset(
+            customer=customers[i % len(customers)],
+            name=f'asset-{i:07d}',
+            asset_type=rng.choice(ASSET_TYPES),
+            ip_address=ip_address,
+            ip_key=ip_key(ip_address),
+            status=rng.random() > 0.1,
+            business_criticality=rng.choice(CRITICALITIES),
+            patch_cycle=patch_cycle,
+            last_patched=last_patched,
+            patch_due_at=patch_due(last_patched, patch_cycle),
+            configuration={
+                'location': rng.choice(LOCATIONS),
+                'backup': rng.choice(['daily', 'weekly', 'none']),
+            },
+        ))
+        if len(batch) >= batch_size:
+            Asset.objects.bulk_create(batch)
+            batch = []
+    Asset.objects.bulk_create(batch)
+
+
+def seed_users(customers, count, seed=0, prefix='bench', password=None):
+    """
+    Bulk-create ``count`` users with roles: a few admins, some managers
+    assigned to up to 20 customers each, and users assigned to 1-3. Created
+    with bulk_create, so the provisioning receivers do not run.
+    """
+    rng = random.Random(seed)
+    # One hash for everyone: hashing is deliberately slow
+    password = make_password(password)
+    users = User.objects.bulk_create(
+        [User(username=f'{prefix}-user-{i}', password=password) for i in range(count)], batch_size=1000,
+    )
+    roles = []
+    for user in users:
+        draw = rng.random()
+        roles.append(UserRole(user=user, role='admin' if draw < 0.02 else 'manager' if draw < 0.15 else 'user'))
+    roles = UserRole.objects.bulk_create(roles, batch_size=1000)
+    through = UserRole.customers.through
+    assignments = []
+    for role in roles:
+        if role.role == 'admin':
+            continue
+        assigned = rng.sample(customers, min(len(customers), rng.randint(5, 20) if role.role == 'manager' else rng.randint(1, 3)))
+        assignments.extend(through(userrole_id=role.pk, customer_id=customer.pk) for customer in assigned)
+    through.objects.bulk_create(assignments, batch_size=5000)
+    return users
+
+
+def seed_dataset(customers, assets, users, seed=0, prefix='bench', password=None):
+    """
+    A complete dataset: customers, assets (some with IPv6 addresses), users
+    with roles, and the derived tables (statistics, configuration index and
+    group memberships) that bulk creation bypasses.
+    """
+    customer_objects = seed_customers(customers, prefix=prefix)
+    seed_assets(customer_objects, assets, seed=seed, ipv6=0.05)
+    seed_users(customer_objects, users, seed=seed, prefix=prefix, password=password)
+    rebuild_stats()
+    rebuild_config_index()
+    rebuild_memberships()
+    return customer_objects
+
+
+@benchmark('git_export')
+def git_export_benchmark(assets=100000, customers=100, **options):
+    seed_assets(seed_customers(customers), assets)
+    results = {'assets': assets, 'customers': customers}
+    with tempfile.TemporaryDirectory() as tmp:
+        remote = Path(tmp) / 'remote.git'
+        subprocess.run(['git', 'init', '--quiet', '--bare', str(remote)], check=True)
+        exporter = GitExporter(remote, Path(tmp) / 'state')
+
+        with Timer() as timer:
+            exporter.export()
+        results['initial_export_seconds'] = timer.seconds
+
+        with Timer() as timer:
+            result = exporter.export()
+        results['no_change_export_seconds'] = timer.seconds
+        results['no_change_commit'] = result.commit
+
+        Asset.objects.filter(pk=Asset.objects.order_by('pk').values('pk')[:1]).update(patch_cycle=7)
+        with Timer() as timer:
+            result = exporter.export()
+        results['one_change_export_seconds'] = timer.seconds
+        results['one_change_written'] = result.written
+    return results
+
+
+@benchmark('directory_sync')
+def directory_sync_benchmark(identities=50000, **options):
+    results = {'identities': identities}
+    with FakeDirectoryServer(entra_recording(identities)) as server:
+        sync = DirectorySync('benchmark', EntraDirectory(server.base_url, token='benchmark'))
+        with Timer() as timer:
+            result = sync.run()
+        results['initial_sync_seconds'] = timer.seconds
+        results['created'] = result.created
+
+        with Timer() as timer:
+            result = sync.run(full=True)
+        results['no_change_full_sync_seconds'] = timer.seconds
+        results['unchanged'] = result.unchanged
+    return results
+
+
+def seed_group_rules(customers, rules_per_customer, seed=0):
+    """
+    Tagging-style groups of one to three rules (e.g. servers named web-* in
+    DC1) until each customer has ``rules_per_customer`` rules.
+    """
+    rng = random.Random(seed)
+    kinds = [
+        ('all', lambda: [('asset_type', rng.choice(ASSET_TYPES)), ('name', f'asset-00{rng.randrange(100):02d}*')]),
+        ('all', lambda: [('business_criticality', rng.choice(CRITICALITIES)),
+                         ('ip_network', f'10.{rng.randrange(2)}.{rng.randrange(256)}.0/24')]),
+        ('all', lambda: [('configuration', f'location={rng.choice(LOCATIONS)}'), ('asset_type', rng.choice(ASSET_TYPES)),
+                         ('ip_network', f'10.{rng.randrange(2)}.{rng.randrange(0, 256, 16)}.0/20')]),
+        ('any', lambda: [('name', f'*-{rng.randrange(10000):04d}'), ('ip_network', f'10.1.{rng.randrange(256)}.0/24')]),
+        ('all', lambda: [('ip_network', f'10.{rng.randrange(2)}.{rng.randrange(0, 256, 16)}.0/20')]),
+        ('all', lambda: [('name', f'asset-000{rng.randrange(1000):03d}?')]),
+    ]
+    for customer in customers:
+        rules = []
+        while len(rules) < rules_per_customer:
+            match, make_rules = rng.choice(kinds)
+            group = AssetGroup.objects.create(customer=customer, name=f'group-{len(rules)}', match=match)
+            rules += [GroupRule(group=group, field=field, value=value) for field, value in make_rules()]
+        GroupRule.objects.bulk_create(rules[:rules_per_customer])
+
+
+@benchmark('asset_groups')
+def asset_groups_benchmark(assets=100000, customers=10, rules=500, **options):
+    customers = seed_customers(customers)
+    seed_assets(customers, assets)
+    seed_group_rules(customers, rules)
+    results = {'assets': assets, 'customers': len(customers), 'rules_per_customer': rules}
+
+    with Timer() as timer:
+        matchers = {customer.pk: get_matcher(customer.pk) for customer in customers}
+    results['compile_seconds'] = timer.seconds
+
+    rows = list(Asset.objects.values_list('customer_id', *MATCH_FIELDS))
+    with Timer() as timer:
+        for customer_id, *fields in rows:
+            matchers[customer_id].groups_for(*fields)
+    results['evaluate_seconds'] = timer.seconds
+
+    with Timer() as timer:
+        rebuild_memberships()
+    results['initial_rebuild_seconds'] = timer.seconds
+    results['memberships'] = Membership.objects.count()
+
+    with Timer() as timer:
+        rebuild_memberships()
+    results['no_change_rebuild_seconds'] = timer.seconds
+    return results
+
+
+@benchmark('patch_compliance')
+def patch_compliance_benchmark(assets=1000000, customers=200, **options):
+    seed_assets(seed_customers(customers), assets)
+    results = {'assets': assets, 'customers': customers}
+
+    with Timer() as timer:
+        compute_compliance(timezone.now())
+    results['compute_seconds'] = timer.seconds
+
+    cache.clear()
+    customer_compliance()
+    with Timer() as timer:
+        customer_compliance()
+    results['cached_seconds'] = timer.seconds
+    return results
+
+
+@benchmark('customer_stats')
+def customer_stats_benchmark(assets=1000000, customers=200, **options):
+    seed_assets(seed_customers(customers), assets)
+    results = {'assets': assets, 'customers': customers}
+
+    with Timer() as timer:
+        rebuild_stats()
+    results['rebuild_seconds'] = timer.seconds
+
+    with Timer() as timer:
+        list(Asset.objects.values(*STATS_FIELDS).annotate(count=Count('pk')).order_by())
+    results['count_assets_seconds'] = timer.seconds
+
+    with Timer() as timer:
+        asset_totals()
+    results['dashboard_totals_seconds'] = timer.seconds
+
+    with Timer() as timer:
+        customer_totals()
+    results['customer_totals_seconds'] = timer.seconds
+
+    asset = Asset.objects.order_by('pk').first()
+    with Timer() as timer:
+        for asset_type in ['network', 'storage', 'server'] * 100:
+            asset.asset_type = asset_type
+            asset.save(update_fields=['asset_type'])
+    results['update_with_stats_ms'] = round(timer.seconds / 300 * 1000, 3)
+    results['corrected_after_updates'] = rebuild_stats()
+    return results
+
+
+def accept_forever(listener):
+    while True:
+        try:
+            connection, _ = listener.accept()
+        except OSError:
+            return  # Closed
+        connection.close()
+
+
+@benchmark('poll_assets')
+def poll_assets_benchmark(assets=50000, concurrency=500, **options):
+    seed_assets(seed_customers(10), assets)
+    listener = socket.create_server(('127.0.0.1', 0), backlog=4096)
+    closed = socket.create_server(('127.0.0.1', 0))
+    closed_port = closed.getsockname()[1]
+    closed.close()
+    threading.Thread(target=accept_forever, args=(listener,), daemon=True).start()
+
+    # Every other asset listens; the rest refuse
+    Asset.objects.update(ip_address='127.0.0.1')
+    Asset.objects.alias(odd=Mod('pk', 2)).filter(odd=1).update(
+        configuration={'poll_ports': [listener.getsockname()[1]]},
+    )
+    poller = Poller(ports=[closed_port], concurrency=concurrency, timeout=5)
+    raise_open_file_limit(concurrency + 100)
+    try:
+        result = poller.run()
+    finally:
+        listener.close()
+    return {
+        'assets': assets,
+        'concurrency': concurrency,
+        'sweep_seconds': round(result.seconds, 2),
+        'assets_per_second': round(result.checked / result.seconds),
+        'reachable': result.seen,
+        'unreachable': result.unreachable,
+    }
+
+
+@benchmark('check_history')
+def check_history_benchmark(assets=50000, history_assets=100, days=2, interval=60, **options):
+    """
+    Appending one sweep of ``assets`` checks, then two days of checks every
+    ``interval`` seconds for ``history_assets`` assets, rolled up and queried
+    at each tier.
+    """
+    seed_assets(seed_customers(10), assets)
+    pks = list(Asset.objects.order_by('pk').values_list('pk', flat=True))
+    rng = random.Random(0)
+    now = timezone.now()
+    results = {'assets': assets, 'history_assets': history_assets, 'days': days, 'interval': interval}
+
+    with Timer() as timer:
+        history.record_checks([(pk, now, rng.uniform(1, 50)) for pk in pks])
+    results['sweep_append_seconds'] = timer.seconds
+    CheckChunk.objects.all().delete()
+
+    start = now - timedelta(days=days)
+    with Timer() as timer:
+        for step in range(days * 86400 // interval):
+            checked_at = start + timedelta(seconds=step * interval)
+            history.record_checks([
+                (pk, checked_at, None if rng.random() < 0.02 else rng.uniform(1, 50)) for pk in pks[:history_assets]
+            ])
+    results['history_append_seconds'] = timer.seconds
+    with Timer() as timer:
+        history.rollup(now)
+    results['rollup_seconds'] = timer.seconds
+    results['chunks'] = CheckChunk.objects.count()
+
+    for label, hours in [('6h', 6), ('24h', 24), ('48h', 48)]:
+        with Timer() as timer:
+            for pk in pks[:history_assets]:
+                resolution, points = history.history(pk, now - timedelta(hours=hours), now, now)
+        results[f'query_{label}_ms'] = round(timer.seconds / history_assets * 1000, 3)
+        results[f'query_{label}_points'] = len(points)
+        results[f'query_{label}_resolution'] = history.TIER_NAMES[resolution]
+    return results
+
+
+def log_lines(addresses, count, seed=0):
+    """``(source ip, line)`` pairs, a mix of RFC 3164, RFC 5424 and NDJSON."""
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        address = rng.choice(addresses)
+        kind = i % 3
+        if kind == 0:
+            line = f'<{rng.randrange(192)}>Oct 11 22:14:{i % 60:02d} {address} sshd[{i}]: Accepted publickey for user{i % 50}'
+        elif kind == 1:
+            line = (f'<{rng.randrange(192)}>1 2026-10-11T22:14:15.{i % 1000:03d}Z {address} app {i} - - '
+                    f'request {i} took {rng.randrange(500)}ms')
+        else:
+            line = json.dumps({'msg': f'job {i} finished', 'level': rng.choice(['info', 'warn', 'error']),
+                               'time': 1760220855 + i, 'duration': rng.random()})
+        lines.append((address, line))
+    return lines
+
+
+@benchmark('log_ingest')
+def log_ingest_benchmark(assets=50000, lines=200000, **options):
+    """
+    Lines per second through the parser, the address index and bulk_create,
+    first handed over directly and then over a local TCP connection.
+    """
+    seed_assets(seed_customers(10), assets)
+    resolver = AssetResolver()
+    with Timer() as timer:
+        resolver.refresh(force=True)
+    results = {'assets': assets, 'lines': lines, 'index_load_seconds': timer.seconds}
+    addresses = list(Asset.objects.values_list('ip_address', flat=True))
+    items = log_lines(addresses, lines)
+
+    ingestor = Ingestor(resolver=resolver)
+    with Timer() as timer:
+        for address, line in items:
+            ingestor.stats.received += 1
+            ingestor.handle(address, line, timezone.now())
+        ingestor.flush()
+    results['direct_lines_per_second'] = round(lines / timer.seconds)
+    results['written'] = ingestor.stats.written
+    LogEvent.objects.all().delete()
+
+    # Over TCP every line comes from 127.0.0.1, so make that an asset
+    asset = Asset.objects.order_by('pk').first()
+    asset.ip_address = '127.0.0.1'
+    asset.save()
+    ingestor = Ingestor(resolver=AssetResolver())
+    source = TCPSource(ingestor, '127.0.0.1', 0)
+    source.start()
+    payload = ''.join(f'{line}\n' for _, line in items).encode()
+    stop = threading.Event()
+
+    def send():
+        with socket.create_connection(source.address) as sender:
+            sender.sendall(payload)
+        while ingestor.stats.received < lines:
+            time.sleep(0.01)
+        stop.set()
+
+    try:
+        with Timer() as timer:
+            threading.Thread(target=send, daemon=True).start()
+            ingestor.run(stop)
+    finally:
+        source.close()
+    results['tcp_lines_per_second'] = round(lines / timer.seconds)
+    results['tcp_written'] = ingestor.stats.written
+    return results
+
+
+@benchmark('ip_index')
+def ip_index_benchmark(assets=1000000, customers=200, lookups=20000, **options):
+    """Building the IP index of ``assets`` addresses, and lookups against it and the database."""
+    seed_assets(seed_customers(customers), assets)
+    customer_ids = list(Customer.objects.values_list('pk', flat=True))
+    with Timer() as timer:
+        index = IPIndex.load()
+    results = {'assets': assets, 'customers': customers, 'build_seconds': timer.seconds}
+    results['array_megabytes'] = round(sum(
+        len(array) * array.itemsize
+        for table in [index.all, *index.by_customer.values()]
+        for family in (table.v4, table.v6)
+        for array in (family.keys, family.assets, family.customers or [])
+        if hasattr(array, 'itemsize')
+    ) / 2 ** 20, 1)
+
+    rng = random.Random(0)
+    addresses = [f'10.{rng.randrange(16)}.{rng.randrange(256)}.{rng.randrange(256)}' for _ in range(lookups)]
+    scopes = [rng.sample(customer_ids, 3) for _ in range(lookups)]
+    for label, lookup in [
+        ('exact', lambda address, scope: index.lookup(address)),
+        ('exact_scoped', lambda address, scope: index.lookup(address, scope)),
+        ('network_24', lambda address, scope: index.in_network(f'{address.rsplit(".", 1)[0]}.0/24')),
+        ('network_24_scoped', lambda address, scope: index.in_network(f'{address.rsplit(".", 1)[0]}.0/24', scope)),
+        ('longest_prefix', lambda address, scope: index.longest_prefix(address, limit=100)),
+    ]:
+        with Timer() as timer:
+            for address, scope in zip(addresses, scopes):
+                lookup(address, scope)
+        results[f'{label}_us'] = round(timer.seconds / lookups * 1e6, 2)
+
+    # The same exact lookup through the ip_key index
+    with Timer() as timer:
+        for address in addresses[:1000]:
+            list(Asset.objects.filter(ip_key=ip_key(address)).values_list('pk', 'customer_id'))
+    results['database_exact_us'] = round(timer.seconds / 1000 * 1e6, 2)
+    return results
+
+
+@benchmark('api')
+def api_benchmark(assets=100000, customers=100, requests=200, **options):
+    """
+    Requests per second of the JSON API through the full middleware stack,
+    as a customer's user: pages of 100 assets with every field and with
+    ``?fields=id,name``, walking cursors to the end of a customer, a
+    revalidation answered with 304, and single assets.
+    """
+    seed_assets(seed_customers(customers), assets)
+    customer = Customer.objects.order_by('pk').first()
+    # bulk_create skips the provisioning receivers
+    user, = User.objects.bulk_create([User(username='bench-api')])
+    UserRole.objects.create(user=user, role='user').customers.add(customer)
+    client = Client()
+    client.force_login(user)
+    url = reverse('api-asset-list')
+    results = {'assets': assets, 'customers': customers, 'requests': requests}
+
+    def rate(make_request, count=requests):
+        with Timer() as timer:
+            for _ in range(count):
+                make_request()
+        return round(count / timer.seconds, 1)
+
+    with override_settings(ALLOWED_HOSTS=['testserver']):
+        results['page_full_per_second'] = rate(lambda: client.get(url, {'page_size': 100}))
+        results['page_sparse_per_second'] = rate(lambda: client.get(url, {'page_size': 100, 'fields': 'id,name'}))
+        etag = client.get(url, {'page_size': 100})['ETag']
+        results['page_304_per_second'] = rate(lambda: client.get(url, {'page_size': 100}, headers={'if-none-match': etag}))
+
+        pages = 0
+        with Timer() as timer:
+            next_url = f'{url}?page_size=100&sort=name'
+            while next_url:
+                next_url = client.get(next_url).json()['next']
+                pages += 1
+        results['cursor_walk_pages'] = pages
+        results['cursor_walk_ms_per_page'] = round(timer.seconds / pages * 1000, 2)
+
+        asset_ids = list(Asset.objects.filter(customer=customer).values_list('pk', flat=True)[:requests])
+        details = iter(asset_ids * 2)
+        results['detail_per_second'] = rate(
+            lambda: client.get(reverse('api-asset-detail', args=[next(details)])), len(asset_ids),
+        )
+        detail_url = reverse('api-asset-detail', args=[asset_ids[0]])
+        etag = client.get(detail_url)['ETag']
+        results['detail_304_per_second'] = rate(lambda: client.get(detail_url, headers={'if-none-match': etag}))
+    return results
+
+
+@benchmark('journal')
+def journal_benchmark(assets=20000, customers=20, saves=5000, **options):
+    """
+    Asset saves with the change journal written by the saving thread and
+    queued for the background writer, the writer's one batch of all the
+    queued entries, and compacting the resulting entries.
+    """
+    seed_assets(seed_customers(customers), assets)
+    user, = User.objects.bulk_create([User(username='bench-journal')])
+    results = {'assets': assets, 'saves': saves}
+    rng = random.Random(0)
+
+    def save_assets(count):
+        batch = list(Asset.objects.order_by('?')[:count])
+        with Timer() as timer, journal.acting_as(user):
+            for i, asset in enumerate(batch):
+                asset.business_criticality = rng.choice(CRITICALITIES)
+                asset.configuration = {**asset.configuration, 'revision': str(i)}
+                asset.save()
+        return round(timer.seconds / count * 1e6, 1)
+
+    with override_settings(JOURNAL_ASYNC=False):
+        results['save_sync_us'] = save_assets(saves)
+
+    # The throwaway database is in-memory SQLite, whose connections lock each
+    # other out instead of waiting, so the writer is sized to take every
+    # entry as one batch and only write once the saves are done
+    journal._writer = journal.JournalWriter(batch_size=saves, queue_size=saves, flush_interval=3600)
+    try:
+        with override_settings(JOURNAL_ASYNC=True):
+            results['save_async_us'] = save_assets(saves)
+            with Timer() as timer:
+                journal.flush()
+            results['writer_batch_seconds'] = timer.seconds
+    finally:
+        journal._writer = None
+    results['entries'] = JournalEntry.objects.count()
+
+    with Timer() as timer:
+        compacted, removed = journal.compact(timezone.now())
+    results.update(compacted=compacted, removed=removed, compact_seconds=timer.seconds)
+    return results
+
+
+@benchmark('inventory_snapshots')
+def inventory_snapshots_benchmark(assets=1000000, changes=10000, **options):
+    """
+    Writing a snapshot of one customer with ``assets`` assets, reading it
+    back, and diffing it against a second one after ``changes`` updates, a
+    few deletes and a few new assets.
+    """
+    customer, = seed_customers(1)
+    seed_assets([customer], assets)
+    results = {'assets': assets, 'changes': changes}
+    with tempfile.TemporaryDirectory() as tmp, override_settings(INVENTORY_SNAPSHOT_DIR=Path(tmp)):
+        with Timer() as timer:
+            first = snapshots.take_snapshot(customer.pk, timezone.now() - timedelta(days=1))
+        results['write_seconds'] = timer.seconds
+        results['file_megabytes'] = round(first.size / 1e6, 1)
+        results['bytes_per_asset'] = round(first.size / assets, 1)
+
+        rng = random.Random(1)
+        ids = list(Asset.objects.values_list('pk', flat=True))
+        updated = [Asset(pk=pk, business_criticality=rng.choice(CRITICALITIES)) for pk in rng.sample(ids, changes)]
+        Asset.objects.bulk_update(updated, ['business_criticality'], batch_size=1000)
+        Asset.objects.filter(pk__in=rng.sample(ids, 100)).delete()
+        Asset.objects.bulk_create([
+            Asset(customer=customer, name=f'added-{i}', asset_type='server', ip_address=f'10.255.0.{i}',
+                  ip_key=ip_key(f'10.255.0.{i}'))
+            for i in range(100)
+        ])
+        second = snapshots.take_snapshot(customer.pk)
+
+        with Timer() as timer:
+            with snapshots.open_snapshot(first) as data:
+                for row in range(0, assets, max(1, assets // 10000)):
+                    data.row(row)
+        results['read_10k_rows_seconds'] = timer.seconds
+        with snapshots.open_snapshot(first) as old, snapshots.open_snapshot(second) as new:
+            with Timer() as timer:
+                diff = snapshots.diff_snapshots(old, new)
+            results['diff_seconds'] = timer.seconds
+            results['diff'] = {'added': len(diff.added), 'removed': len(diff.removed), 'changed': len(diff.changed)}
+            with Timer() as timer:
+                snapshots.diff_snapshots(new, new)
+            results['diff_unchanged_seconds'] = timer.seconds
+    return results
+
+
+@benchmark('instrumentation')
+def instrumentation_benchmark(assets=10000, customers=10, requests=300, **options):
+    """
+    Cost of InstrumentationMiddleware: dashboard requests without it, with it
+    measuring every request and with it sampling none, plus the cost of
+    rendering /metrics.
+    """
+    seed_assets(seed_customers(customers), assets)
+    user, = User.objects.bulk_create([User(username='bench-instrumentation')])
+    UserRole.objects.create(user=user, role='admin')
+    url = reverse('dashboard')
+    results = {'assets': assets, 'requests': requests}
+    without = [name for name in settings.MIDDLEWARE if name != 'assets.instrumentation.InstrumentationMiddleware']
+
+    def request_us(**overrides):
+        with override_settings(ALLOWED_HOSTS=['testserver'], **overrides):
+            # A new client loads the middleware with these settings
+            client = Client()
+            client.force_login(user)
+            client.get(url)
+            with Timer() as timer:
+                for _ in range(requests):
+                    client.get(url)
+        return round(timer.seconds / requests * 1e6, 1)
+
+    results['without_us'] = request_us(MIDDLEWARE=without)
+    results['sampled_us'] = request_us(INSTRUMENTATION_SAMPLE_RATE=1.0)
+    results['unsampled_us'] = request_us(INSTRUMENTATION_SAMPLE_RATE=0.0)
+    results['overhead_us'] = round(results['sampled_us'] - results['without_us'], 1)
+    stats = instrumentation.registry.snapshot()['dashboard']
+    results['queries_per_request'] = round(stats.histograms['queries'].mean, 1)
+    with Timer() as timer:
+        for _ in range(100):
+            instrumentation.prometheus_text(instrumentation.registry.snapshot())
+    results['metrics_render_us'] = round(timer.seconds / 100 * 1e6, 1)
+    return results
+
+
+# Query strings requested besides the bare URL, by URL name
+URL_VARIANTS = {
+    'dashboard': [
+        {'search': 'asset-00001'},
+        {'search': '10.0.1'},
+        {'asset_type': 'server', 'criticality': 'high', 'sort': 'name'},
+        {'patch': 'overdue'},
+    ],
+    'asset-history': [{'hours': 168}],
+    'customer-export': [{'format': 'csv'}],
+    'api-asset-list': [
+        {'page_size': 1000},
+        {'fields': 'id,name', 'config.location': 'HQ'},
+        {'search': 'asset-00001'},
+    ],
+}
+
+# Answered before the views run, so there is nothing of ours to measure
+SKIPPED_URLS = {'root'}
+
+
+def percentile(values, q):
+    """Nearest-rank ``q`` percentile of ``values``."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def url_cases(objects):
+    """
+    ``(label, path, params)`` for each named URL of assets.urls and its
+    URL_VARIANTS; ``<pk>`` comes from ``objects`` by the name's prefix
+    ('asset' for asset-detail, 'api-customer' for api-customer-detail...).
+    """
+    from .urls import urlpatterns
+    for pattern in urlpatterns:
+        name = pattern.name
+        if name is None or name in SKIPPED_URLS:
+            continue
+        args = [objects[name.rsplit('-', 1)[0]]] if 'pk' in pattern.pattern.converters else []
+        path = reverse(name, args=args)
+        yield name, path, {}
+        for params in URL_VARIANTS.get(name, []):
+            yield f'{name}?{"&".join(f"{key}={value}" for key, value in params.items())}', path, params
+
+
+def measure_url(client, path, params, requests):
+    """
+    Latency percentiles (ms) and queries of GETs of ``path``, after one to
+    warm up; just the status if that one fails.
+    """
+    response = client.get(path, params)
+    if response.status_code >= 500:
+        return {'status': response.status_code}
+    latencies = []
+    queries = []
+    for _ in range(requests):
+        timer = instrumentation.QueryTimer()
+        with connection.execute_wrapper(timer):
+            started = time.perf_counter()
+            response = client.get(path, params)
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+            latencies.append((time.perf_counter() - started) * 1000)
+        queries.append(timer.count)
+    return {
+        'status': response.status_code,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'max_ms': round(max(latencies), 2),
+        'queries': max(queries),
+        'sql_ms': round(timer.seconds * 1000, 2),
+    }
+
+
+@benchmark('urls')
+def urls_benchmark(assets=100000, customers=100, users=200, requests=20, **options):
+    """
+    Latency percentiles and query counts of every page and API endpoint in
+    assets.urls (GET), for an administrator and for a manager of a tenth of
+    the customers, on a dataset from seed_dataset. ``queries`` is the most
+    any request made, ``sql_ms`` the time in SQL of the last one.
+    """
+    customer_objects = seed_dataset(customers, assets, users)
+    admin, manager = User.objects.bulk_create([User(username='bench-admin'), User(username='bench-manager')])
+    UserRole.objects.create(user=admin, role='admin')
+    UserRole.objects.create(user=manager, role='manager').customers.set(
+        customer_objects[:max(1, customers // 10)],
+    )
+    customer = customer_objects[0]
+    asset = Asset.objects.filter(customer=customer).order_by('pk').first()
+    objects = {
+        'asset': asset.pk, 'api-asset': asset.pk,
+        'customer': customer.pk, 'api-customer': customer.pk,
+        'user': User.objects.filter(username__startswith='bench-user-').order_by('pk').first().pk,
+    }
+    results = {'assets': assets, 'customers': customers, 'users': users, 'requests': requests}
+    # Denied and failing pages are reported by status instead of logged per request
+    request_logger = logging.getLogger('django.request')
+    level = request_logger.level
+    request_logger.setLevel(logging.CRITICAL)
+    try:
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for role, user in [('admin', admin), ('manager', manager)]:
+                # A broken page is reported with its status rather than ending the run
+                client = Client(raise_request_exception=False)
+                client.force_login(user)
+                results[role] = {
+                    label: measure_url(client, path, params, requests)
+                    for label, path, params in url_cases(objects)
+                }
+    finally:
+        request_logger.setLevel(level)
+    return results
@@ -0,0 +1,121 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from . import journal
+from .fragments import invalidate_all_asset_rows, invalidate_asset_rows
+from .models import Asset, patch_due
+from .versions import bump_version, get_version, versions_are_shared
+
+VERSION_NAME = 'patch-compliance'
+
+# Asset fields whose changes can move compliance numbers
+COMPLIANCE_FIELDS = {'customer', 'status', 'last_patched', 'patch_cycle', 'patch_due_at'}
+
+
+class Compliance:
+    def __init__(self, total=0, overdue=0):
+        self.total = total
+        self.overdue = overdue
+
+    @property
+    def compliant(self):
+        return self.total - self.overdue
+
+    @property
+    def percent(self):
+        return round(100 * self.compliant / self.total, 1) if self.total else 100.0
+
+    def __add__(self, other):
+        return Compliance(self.total + other.total, self.overdue + other.overdue)
+
+
+def refresh_patch_due(queryset, batch_size=1000):
+    """
+    Recompute patch_due_at for ``queryset``, e.g. after a bulk upsert changed
+    patch cycles: one read and a bulk_update of the rows that moved.
+    """
+    rows = queryset.filter(last_patched__isnull=False).values_list(
+        'pk', 'last_patched', 'patch_cycle', 'patch_due_at',
+    )
+    changed = []
+    now = timezone.now()
+    for pk, last_patched, patch_cycle, current in rows:
+        due = patch_due(last_patched, patch_cycle)
+        if due != current:
+            changed.append(Asset(pk=pk, patch_due_at=due, updated_at=now))
+    if changed:
+        Asset.objects.bulk_update(changed, ['patch_due_at', 'updated_at'], batch_size=batch_size)
+        bump_version(VERSION_NAME)
+        invalidate_asset_rows([asset.pk for asset in changed])
+    return len(changed)
+
+
+def mark_patched(queryset, when=None):
+    """
+    Record a patch run for every asset in ``queryset``: one UPDATE per patch
+    cycle in use, after one read of the previous dates for the journal.
+    """
+    when = when or timezone.now()
+    updated = 0
+    with transaction.atomic():
+        previous = list(queryset.order_by().values_list('pk', 'customer_id', 'patch_cycle', 'last_patched'))
+        for patch_cycle in {row[2] for row in previous}:
+            updated += queryset.filter(patch_cycle=patch_cycle).update(
+                last_patched=when, patch_due_at=patch_due(when, patch_cycle), updated_at=timezone.now(),
+            )
+        journal.record_bulk_update(Asset, [
+            (pk, customer_id, {'last_patched': [last_patched, when]} if last_patched != when else {})
+            for pk, customer_id, _, last_patched in previous
+        ])
+    bump_version(VERSION_NAME)
+    invalidate_all_asset_rows()
+    return updated
+
+
+def compute_compliance(now):
+    """
+    Per-customer totals and overdue counts of active assets, plus the next
+    moment an asset falls due. Two aggregate queries, both answered from
+    the patch_due_at indexes.
+    """
+    rows = (
+        Asset.objects.filter(status=True)
+        .values('customer_id')
+        .annotate(
+            total=Count('pk'),
+            overdue=Count('pk', filter=Q(patch_due_at__isnull=True) | Q(patch_due_at__lte=now)),
+        )
+        .order_by()
+        .values_list('customer_id', 'total', 'overdue')
+    )
+    stats = {customer_id: (total, overdue) for customer_id, total, overdue in rows}
+    next_due = Asset.objects.filter(status=True, patch_due_at__gt=now).aggregate(
+        next_due=Min('patch_due_at'),
+    )['next_due']
+    return stats, next_due
+
+
+def customer_compliance():
+    """
+    ``{customer_id: Compliance}`` for every customer with active assets.
+
+    Cached until an asset change bumps the version (see assets.signals) or
+    the next asset falls due, whichever comes first. Bumps made by other
+    processes only arrive through a shared cache, so with a per-process one
+    the totals are kept for PATCH_COMPLIANCE_LOCAL_CACHE_TIMEOUT at most.
+    """
+    key = f'patch-compliance:{get_version(VERSION_NAME)}'
+    stats = cache.get(key)
+    if stats is None:
+        now = timezone.now()
+        stats, next_due = compute_compliance(now)
+        timeout = getattr(settings, 'PATCH_COMPLIANCE_CACHE_TIMEOUT', 3600)
+        if not versions_are_shared():
+            timeout = min(timeout, getattr(settings, 'PATCH_COMPLIANCE_LOCAL_CACHE_TIMEOUT', 5))
+        if next_due is not None:
+            timeout = max(1, min(timeout, int((next_due - now).total_seconds()) + 1))
+        cache.set(key, stats, timeout)
+    return {customer_id: Compliance(*counts) for customer_id, counts in stats.items()}
@@ -0,0 +1,92 @@
+import json
+
+from django.db import transaction
+
+from .models import Asset, AssetConfigEntry
+from .utils import chunked
+
+# Query string prefix of configuration filters, as in ?config.location=HQ
+FILTER_PREFIX = 'config.'
+
+MAX_KEY_LENGTH = AssetConfigEntry._meta.get_field('key').max_length
+MAX_VALUE_LENGTH = AssetConfigEntry._meta.get_field('value').max_length
+
+
+def config_value(value):
+    """The string a configuration value is indexed and compared as."""
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+def config_pairs(configuration):
+    """
+    The ``(key, value)`` pairs of a configuration that go into the index.
+    Keys or values too long for the index columns are left out, so filters
+    on them match nothing.
+    """
+    if not isinstance(configuration, dict):
+        return []
+    pairs = []
+    for key, value in configuration.items():
+        value = config_value(value)
+        if len(key) <= MAX_KEY_LENGTH and len(value) <= MAX_VALUE_LENGTH:
+            pairs.append((key, value))
+    return pairs
+
+
+def sync_config_entries(assets, created=False, batch_size=1000):
+    """
+    Replace the index entries of ``(asset_id, configuration)`` pairs: one
+    delete and one bulk insert per batch. With ``created`` the assets are
+    known to have no entries yet and the delete is skipped.
+    """
+    for batch in chunked(assets, batch_size):
+        entries = [
+            AssetConfigEntry(asset_id=asset_id, key=key, value=value)
+            for asset_id, configuration in batch
+            for key, value in config_pairs(configuration)
+        ]
+        if created and not entries:
+            continue
+        with transaction.atomic():
+            if not created:
+                AssetConfigEntry.objects.filter(asset_id__in=[asset_id for asset_id, _ in batch]).delete()
+            AssetConfigEntry.objects.bulk_create(entries, batch_size=batch_size)
+
+
+def update_config_index(assets, created=False):
+    """Re-index saved Asset instances, e.g. after save() or a bulk import."""
+    sync_config_entries([(asset.pk, asset.configuration) for asset in assets], created=created)
+
+
+def rebuild_config_index(chunk_size=2000):
+    """Re-index every asset; returns the number of assets indexed."""
+    rows = []
+    count = 0
+    for row in Asset.objects.order_by('pk').values_list('pk', 'configuration').iterator(chunk_size=chunk_size):
+        rows.append(row)
+        if len(rows) >= chunk_size:
+            sync_config_entries(rows)
+            count += len(rows)
+            rows = []
+    sync_config_entries(rows)
+    return count + len(rows)
+
+
+def parse_config_filters(params):
+    """``(key, value)`` filters from ``config.<key>=<value>`` query parameters."""
+    return [
+        (name[len(FILTER_PREFIX):], value)
+        for name, values in params.lists() if name.startswith(FILTER_PREFIX) and name != FILTER_PREFIX
+        for value in values
+    ]
+
+
+def filter_by_config(queryset, filters):
+    """Assets whose configuration has every ``(key, value)`` in ``filters``."""
+    for key, value in filters:
+        queryset = queryset.filter(
+            pk__in=AssetConfigEntry.objects.filter(key=key, value=config_value(value)).values('asset_id')
+        )
+    return queryset
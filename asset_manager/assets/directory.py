@@ -0,0 +1,350 @@
+import json
+import time
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .models import DirectoryIdentity, DirectorySyncState
+from .provisioning import provision_users
+from .utils import chunked
+
+# User fields a directory owns; everything else (roles, customers,
+# passwords) stays under local control
+SYNC_FIELDS = ['username', 'email', 'first_name', 'last_name', 'is_active']
+
+
+class DirectoryError(Exception):
+    pass
+
+
+class DirectoryTokenExpired(DirectoryError):
+    """The stored delta token is no longer accepted; a full sync is needed."""
+
+
+class DirectoryUser:
+    """
+    One entry of a directory listing. Fields left as None were not part of
+    the entry (delta responses only carry changed properties) and keep their
+    local value.
+    """
+
+    def __init__(self, external_id, username=None, email=None, first_name=None,
+                 last_name=None, active=None, removed=False):
+        self.external_id = str(external_id)
+        self.username = username
+        self.email = email
+        self.first_name = first_name
+        self.last_name = last_name
+        self.active = active
+        self.removed = removed
+
+    def values(self):
+        values = {
+            'username': self.username,
+            'email': self.email,
+            'first_name': self.first_name,
+            'last_name': self.last_name,
+            'is_active': False if self.removed else self.active,
+        }
+        return {field: value for field, value in values.items() if value is not None}
+
+
+class DirectoryPage:
+    def __init__(self, users, sync_token=None):
+        self.users = users
+        self.sync_token = sync_token
+
+
+class DirectoryClient:
+    """Minimal JSON-over-HTTPS client with bearer auth and retries on throttling."""
+
+    def __init__(self, token, timeout=30, retries=3):
+        self.token = token
+        self.timeout = timeout
+        self.retries = retries
+
+    def get(self, url, headers=None):
+        request = Request(url, headers={
+            'Authorization': f'Bearer {self.token}',
+            'Accept': 'application/json',
+            **(headers or {}),
+        })
+        for attempt in range(self.retries + 1):
+            try:
+                with urlopen(request, timeout=self.timeout) as response:
+                    return json.load(response)
+            except HTTPError as e:
+                if e.code == 410:
+                    raise DirectoryTokenExpired(url)
+                if e.code not in (429, 503) or attempt == self.retries:
+                    raise DirectoryError(f'GET {url} failed: HTTP {e.code}')
+                delay = e.headers.get('Retry-After', '')
+                time.sleep(min(int(delay) if delay.isdigit() else 2 ** attempt, 60))
+            except URLError as e:
+                raise DirectoryError(f'GET {url} failed: {e.reason}')
+
+
+class EntraDirectory:
+    """
+    Microsoft Entra ID users through the Graph delta query. The delta link
+    returned by the last page is the token for the next, incremental run.
+    """
+    incremental = True
+    SELECT = 'id,userPrincipalName,mail,givenName,surname,accountEnabled'
+
+    def __init__(self, base_url='https://graph.microsoft.com', token='', page_size=999, client=None):
+        self.base_url = base_url.rstrip('/')
+        self.page_size = page_size
+        self.client = client or DirectoryClient(token)
+
+    def pages(self, token=None):
+        url = token or f'{self.base_url}/v1.0/users/delta?' + urlencode({'$select': self.SELECT}, safe='$,')
+        headers = {'Prefer': f'odata.maxpagesize={self.page_size}'}
+        while url:
+            data = self.client.get(url, headers)
+            users = [self.parse(entry) for entry in data.get('value', [])]
+            url = data.get('@odata.nextLink')
+            yield DirectoryPage(users, None if url else data.get('@odata.deltaLink'))
+
+    @staticmethod
+    def parse(entry):
+        if '@removed' in entry:
+            return DirectoryUser(entry['id'], removed=True)
+        return DirectoryUser(
+            entry['id'],
+            username=entry.get('userPrincipalName'),
+            email=entry.get('mail') or ('' if 'mail' in entry else None),
+            first_name=entry.get('givenName') or ('' if 'givenName' in entry else None),
+            last_name=entry.get('surname') or ('' if 'surname' in entry else None),
+            active=entry.get('accountEnabled'),
+        )
+
+
+class GoogleDirectory:
+    """
+    Google Workspace users through the Admin SDK Directory API. It offers no
+    delta token for users, so every run reads the full listing and users that
+    are missing from it are disabled.
+    """
+    incremental = False
+
+    def __init__(self, base_url='https://admin.googleapis.com', token='', customer='my_customer',
+                 page_size=500, client=None):
+        self.base_url = base_url.rstrip('/')
+        self.customer = customer
+        self.page_size = page_size
+        self.client = client or DirectoryClient(token)
+
+    def pages(self, token=None):
+        params = {'customer': self.customer, 'maxResults': self.page_size, 'projection': 'basic'}
+        page_token = None
+        while True:
+            query = {**params, 'pageToken': page_token} if page_token else params
+            data = self.client.get(f'{self.base_url}/admin/directory/v1/users?' + urlencode(query))
+            users = [self.parse(entry) for entry in data.get('users', [])]
+            page_token = data.get('nextPageToken')
+            yield DirectoryPage(users)
+            if not page_token:
+                return
+
+    @staticmethod
+    def parse(entry):
+        name = entry.get('name', {})
+        return DirectoryUser(
+            entry['id'],
+            username=entry.get('primaryEmail'),
+            email=entry.get('primaryEmail', ''),
+            first_name=name.get('givenName', ''),
+            last_name=name.get('familyName', ''),
+            active=not entry.get('suspended', False),
+            removed=bool(entry.get('deleted')),
+        )
+
+
+PROVIDERS = {
+    'entra': EntraDirectory,
+    'google': GoogleDirectory,
+}
+
+
+class SyncResult:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.disabled = 0
+        self.unchanged = 0
+        self.full = False
+        self.errors = []
+
+
+class DirectorySync:
+    """
+    Bring local users in line with one directory source.
+
+    The listing is read completely (page by page, following delta tokens
+    where the provider has them) and diffed in memory against the users
+    linked to the source, which are loaded with a single query. Creates,
+    updates and disables are then written with bulk_create/bulk_update in
+    one transaction, together with the new token, so an interrupted run
+    leaves the previous token in place and is simply repeated. New users are
+    provisioned with provision_users rather than per-user post_save.
+
+    Directory entries whose username matches an unlinked local user adopt
+    that user instead of failing on the unique username.
+    """
+
+    def __init__(self, source, directory, default_role='user', batch_size=1000):
+        self.source = source
+        self.directory = directory
+        self.default_role = default_role
+        self.batch_size = batch_size
+
+    def fetch(self, token):
+        entries = {}
+        sync_token = None
+        for page in self.directory.pages(token):
+            for entry in page.users:
+                entries[entry.external_id] = entry
+            sync_token = page.sync_token or sync_token
+        return entries, sync_token
+
+    def run(self, full=False):
+        state, _ = DirectorySyncState.objects.get_or_create(source=self.source)
+        token = None if full or not self.directory.incremental else (state.token or None)
+        try:
+            entries, sync_token = self.fetch(token)
+        except DirectoryTokenExpired:
+            token = None
+            entries, sync_token = self.fetch(None)
+
+        result = SyncResult()
+        result.full = token is None
+        with transaction.atomic():
+            self.apply(entries, result)
+            state.token = sync_token or ''
+            state.synced_at = timezone.now()
+            state.save()
+        return result
+
+    def local_users(self):
+        rows = DirectoryIdentity.objects.filter(source=self.source).values_list(
+            'external_id', 'user_id', *(f'user__{field}' for field in SYNC_FIELDS),
+        )
+        return {row[0]: (row[1], dict(zip(SYNC_FIELDS, row[2:]))) for row in rows}
+
+    def users_by_username(self, usernames):
+        found = {}
+        for chunk in chunked(usernames):
+            for row in User.objects.filter(username__in=chunk).values_list('pk', *SYNC_FIELDS):
+                found[row[1]] = (row[0], dict(zip(SYNC_FIELDS, row[1:])))
+        return found
+
+    def apply(self, entries, result):
+        local = self.local_users()
+        linked_user_ids = {user_id for user_id, _ in local.values()}
+
+        # Usernames that will be claimed by new or renamed entries
+        wanted = set()
+        for external_id, entry in entries.items():
+            current = local.get(external_id)
+            if entry.username and (current is None or current[1]['username'] != entry.username):
+                wanted.add(entry.username)
+        taken = self.users_by_username(wanted)
+
+        claimed = {}
+        to_create = []
+        to_update = []
+        new_links = []
+
+        def claim(username, external_id):
+            owner = claimed.setdefault(username, external_id)
+            if owner != external_id:
+                result.errors.append((external_id, f"Username '{username}' is already used by {owner}"))
+                return False
+            return True
+
+        def update(user_id, current, values):
+            changed = {field: value for field, value in values.items() if current[field] != value}
+            if not changed:
+                result.unchanged += 1
+                return
+            if changed.get('is_active') is False:
+                result.disabled += 1
+            else:
+                result.updated += 1
+            to_update.append(User(pk=user_id, **{**current, **changed}))
+
+        for external_id, entry in entries.items():
+            values = entry.values()
+            current = local.get(external_id)
+            if current is not None:
+                user_id, fields = current
+                username = values.get('username')
+                if username and username != fields['username']:
+                    if username in taken:
+                        result.errors.append((external_id, f"Username '{username}' belongs to another user"))
+                        continue
+                    if not claim(username, external_id):
+                        continue
+                update(user_id, fields, values)
+                continue
+
+            if not values.get('is_active', True):
+                continue  # Never create users that are already disabled
+            if not entry.username:
+                result.errors.append((external_id, 'Entry has no username'))
+                continue
+            if not claim(entry.username, external_id):
+                continue
+            existing = taken.get(entry.username)
+            if existing is not None:
+                user_id, fields = existing
+                if user_id in linked_user_ids:
+                    result.errors.append((external_id, f"Username '{entry.username}' is linked to another entry"))
+                    continue
+                new_links.append(DirectoryIdentity(source=self.source, external_id=external_id, user_id=user_id))
+                update(user_id, fields, {'is_active': True, **values})
+                continue
+            values.setdefault('is_active', True)
+            to_create.append((external_id, User(password=make_password(None), **values)))
+
+        if result.full:
+            # Users missing from a complete listing have left the directory
+            for external_id, (user_id, fields) in local.items():
+                if external_id not in entries and fields['is_active']:
+                    to_update.append(User(pk=user_id, **{**fields, 'is_active': False}))
+                    result.disabled += 1
+
+        self.write(to_create, to_update, new_links)
+        result.created = len(to_create)
+
+    def write(self, to_create, to_update, new_links):
+        users = [user for _, user in to_create]
+        User.objects.bulk_create(users, batch_size=self.batch_size)
+        if any(user.pk is None for user in users):
+            # Backends that cannot return ids from a bulk INSERT
+            ids = {}
+            for chunk in chunked([user.username for user in users]):
+                ids.update(User.objects.filter(username__in=chunk).values_list('username', 'pk'))
+            for user in users:
+                user.pk = ids[user.username]
+        provision_users(users, role=self.default_role, batch_size=self.batch_size)
+
+        new_links += [
+            DirectoryIdentity(source=self.source, external_id=external_id, user_id=user.pk)
+            for external_id, user in to_create
+        ]
+        DirectoryIdentity.objects.bulk_create(new_links, batch_size=self.batch_size)
+        User.objects.bulk_update(to_update, SYNC_FIELDS, batch_size=self.batch_size)
+
+
+def get_directory(provider, **options):
+    try:
+        return PROVIDERS[provider](**options)
+    except KeyError:
+        raise DirectoryError(f"Unknown directory provider '{provider}'")
@@ -0,0 +1,130 @@
+import csv
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .config_index import filter_by_config
+from .models import Asset
+
+EXPORT_FORMATS = ['ndjson', 'json', 'csv']
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+    'csv': 'text/csv',
+}
+
+EXPORT_FIELDS = [
+    'id', 'customer_id', 'name', 'asset_type', 'ip_address', 'monitoring_status',
+    'status', 'business_criticality', 'patch_cycle', 'last_checked', 'configuration',
+]
+
+# Rows rendered per piece of output handed to the response or file
+ROWS_PER_PIECE = 200
+
+
+def parse_since(value):
+    """
+    An export's ``since`` as an aware datetime; a value without an offset
+    is in the current time zone. Raises ValueError if it is not an ISO 8601
+    datetime, or not a real one (2026-13-01).
+    """
+    since = parse_datetime(value)
+    if since is None:
+        raise ValueError(value)
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+
+def export_queryset(customer_id=None, since=None, config=()):
+    queryset = Asset.objects.order_by('pk')
+    if customer_id is not None:
+        queryset = queryset.filter(customer_id=customer_id)
+    if since is not None:
+        # Polls move last_checked on every asset; edits move updated_at
+        queryset = queryset.filter(updated_at__gt=since)
+    queryset = filter_by_config(queryset, config)
+    return queryset.values(*EXPORT_FIELDS)
+
+
+def _dumps(row):
+    return json.dumps(row, cls=DjangoJSONEncoder, separators=(',', ':'))
+
+
+def _pieces(rows, render_row):
+    piece = []
+    for row in rows:
+        piece.append(render_row(row))
+        if len(piece) >= ROWS_PER_PIECE:
+            yield ''.join(piece)
+            piece = []
+    if piece:
+        yield ''.join(piece)
+
+
+def render_ndjson(rows):
+    return _pieces(rows, lambda row: _dumps(row) + '\n')
+
+
+def render_json(rows):
+    first = True
+
+    def render_row(row):
+        nonlocal first
+        prefix = '\n' if first else ',\n'
+        first = False
+        return prefix + _dumps(row)
+
+    yield '['
+    yield from _pieces(rows, render_row)
+    yield '\n]\n'
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def render_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+
+    def render_row(row):
+        values = [row[field] for field in EXPORT_FIELDS]
+        values[-1] = _dumps(row['configuration'])
+        return writer.writerow(values)
+
+    yield from _pieces(rows, render_row)
+
+
+RENDERERS = {
+    'ndjson': render_ndjson,
+    'json': render_json,
+    'csv': render_csv,
+}
+
+
+def gzip_stream(pieces):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for piece in pieces:
+        data = compressor.compress(piece)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_assets(customer_id=None, fmt='ndjson', since=None, compress=False, chunk_size=2000, config=()):
+    """
+    Yield the export of a customer's assets as encoded bytes.
+
+    Rows are fetched with ``.values().iterator()``, so neither the queryset
+    nor the rendered document is ever held in memory. ``config`` is a list
+    of ``(key, value)`` configuration filters (see assets.config_index).
+    """
+    rows = export_queryset(customer_id, since, config).iterator(chunk_size=chunk_size)
+    pieces = (piece.encode() for piece in RENDERERS[fmt](rows))
+    return gzip_stream(pieces) if compress else pieces
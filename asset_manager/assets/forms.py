@@ -4,6 +4,52 @@ from django.contrib.auth.forms import UserCreationForm
 from .models import Asset, Customer, UserRole
 import json
 
+
+def parse_configuration(config_text):
+    """
+    Parse asset configuration entered either as a JSON object or as
+    key=value pairs separated by commas or semicolons.
+    """
+    config_text = (config_text or '').strip()
+    if not config_text:
+        return {}
+
+    # First try to parse as JSON (for edit mode)
+    try:
+        json_config = json.loads(config_text)
+        if isinstance(json_config, dict):
+            return json_config
+    except json.JSONDecodeError:
+        pass
+
+    # Not a JSON object, try key=value format
+    try:
+        pairs = [p.strip() for p in config_text.replace(';', ',').split(',')]
+        config_dict = {}
+
+        for pair in pairs:
+            if not pair.strip():
+                continue
+
+            if '=' not in pair:
+                raise forms.ValidationError(f"Invalid format: '{pair}'. Use key=value format.")
+
+            key, value = pair.split('=', 1)
+            key = key.strip()
+            value = value.strip()
+
+            if not key:
+                raise forms.ValidationError("Empty keys are not allowed")
+
+            config_dict[key] = value
+
+        return config_dict
+
+    except forms.ValidationError:
+        raise
+    except Exception as e:
+        raise forms.ValidationError(f"Error processing configuration: {str(e)}")
+
 class AssetForm(forms.ModelForm):
     customer = forms.ModelChoiceField(
         queryset=Customer.objects.all(),
@@ -47,6 +93,7 @@ class AssetForm(forms.ModelForm):
             'status',
             'business_criticality',
             'patch_cycle',
+            'last_patched',
             'configuration'
         ]
         widgets = {
@@ -55,6 +102,9 @@ class AssetForm(forms.ModelForm):
             'ip_address': forms.TextInput(attrs={'class': 'form-control'}),
             'status': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
             'business_criticality': forms.Select(attrs={'class': 'form-control'}),
+            'last_patched': forms.DateTimeInput(
+                attrs={'class': 'form-control', 'type': 'datetime-local'}, format='%Y-%m-%dT%H:%M',
+            ),
         }
 
     def __init__(self, *args, **kwargs):
@@ -72,43 +122,7 @@ class AssetForm(forms.ModelForm):
                 self.initial['configuration'] = json.dumps(self.instance.configuration)
 
     def clean_configuration(self):
-        config_text = self.cleaned_data.get('configuration', '').strip()
-        if not config_text:
-            return {}
-
-        # First try to parse as JSON (for edit mode)
-        try:
-            json_config = json.loads(config_text)
-            if isinstance(json_config, dict):
-                return json_config
-        except json.JSONDecodeError:
-            # Not JSON, try key=value format
-            try:
-                pairs = [p.strip() for p in config_text.replace(';', ',').split(',')]
-                config_dict = {}
-
-                for pair in pairs:
-                    if not pair.strip():
-                        continue
-                        
-                    if '=' not in pair:
-                        raise forms.ValidationError(f"Invalid format: '{pair}'. Use key=value format.")
-                    
-                    key, value = pair.split('=', 1)
-                    key = key.strip()
-                    value = value.strip()
-                    
-                    if not key:
-                        raise forms.ValidationError("Empty keys are not allowed")
-                    
-                    config_dict[key] = value
-
-                return config_dict
-
-            except forms.ValidationError:
-                raise
-            except Exception as e:
-                raise forms.ValidationError(f"Error processing configuration: {str(e)}")
+        return parse_configuration(self.cleaned_data.get('configuration', ''))
 
 class CustomerForm(forms.ModelForm):
     class Meta:
@@ -132,4 +146,36 @@ class UserRoleForm(forms.ModelForm):
         widgets = {
             'role': forms.Select(attrs={'class': 'form-control'}),
             'customers': forms.SelectMultiple(attrs={'class': 'form-control'}),
-        }
\ No newline at end of file
+        }
+
+class AssetImportForm(forms.Form):
+    FORMAT_CHOICES = [
+        ('', 'Detect from file name'),
+        ('csv', 'CSV'),
+        ('json', 'JSON array'),
+        ('ndjson', 'NDJSON (one object per line)'),
+    ]
+
+    file = forms.FileField(widget=forms.ClearableFileInput(attrs={'class': 'form-control'}))
+    format = forms.ChoiceField(
+        choices=FORMAT_CHOICES,
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    customer = forms.ModelChoiceField(
+        queryset=Customer.objects.all(),
+        required=False,
+        empty_label='Taken from each row',
+        widget=forms.Select(attrs={'class': 'form-control'}),
+        help_text='Used for rows without a customer column'
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        upload = cleaned_data.get('file')
+        if upload and not cleaned_data.get('format'):
+            from .importers import guess_format
+            cleaned_data['format'] = guess_format(upload.name)
+            if not cleaned_data['format']:
+                raise forms.ValidationError('Cannot tell the file format, please choose one')
+        return cleaned_data
@@ -0,0 +1,76 @@
+"""
+Versions for the dashboard's cached template fragments (``{% cache %}`` in
+assets/dashboard.html).
+
+Each asset row is cached under the asset's pk and its own version counter.
+Every write path that can change what a row shows bumps that counter:
+saves, deletes and assets_bulk_saved (assets.signals), the poller's
+bulk_update and refresh_patch_due. Writers that update a queryset without
+knowing its pks (mark_patched) bump ROWS_VERSION instead, which every row
+key includes.
+
+The counters live in the default cache, so with a per-process cache the
+bumps made by other processes (poll_assets, import_assets) never arrive.
+Row keys therefore also carry the asset's ``updated_at`` and
+``last_checked``, which every write path moves and which the dashboard
+loads anyway.
+
+Customer names appear in the rows and in the customer dropdown, so both
+keys include CUSTOMERS_VERSION, bumped when a customer is saved or deleted.
+The dropdown is also keyed by the tenant: all customers for administrators,
+or the set of assigned customer IDs, so a changed assignment selects
+another entry without any invalidation.
+"""
+import hashlib
+
+from django.conf import settings
+
+from .versions import bump_version, bump_versions, get_version, get_versions
+
+ROWS_VERSION = 'asset-rows'
+CUSTOMERS_VERSION = 'customer-names'
+
+
+def asset_version_name(pk):
+    return f'asset-row:{pk}'
+
+
+def fragment_timeout():
+    return getattr(settings, 'DASHBOARD_FRAGMENT_CACHE_TIMEOUT', 3600)
+
+
+def annotate_row_versions(assets):
+    """
+    Set ``row_version`` on each of ``assets``: its own counter plus the
+    shared ones, read in a single cache round trip, and its timestamps.
+    """
+    names = {asset.pk: asset_version_name(asset.pk) for asset in assets}
+    versions = get_versions([ROWS_VERSION, CUSTOMERS_VERSION, *names.values()])
+    shared = f'{versions[ROWS_VERSION]}.{versions[CUSTOMERS_VERSION]}'
+    for asset in assets:
+        asset.row_version = (
+            f'{shared}.{versions[names[asset.pk]]}'
+            f'.{asset.updated_at.timestamp()}.{asset.last_checked.timestamp()}'
+        )
+
+
+def customer_options_key(scope):
+    """The tenant and version the customer dropdown is cached under."""
+    if scope.is_admin:
+        tenant = 'all'
+    else:
+        ids = ','.join(map(str, sorted(scope.customer_ids)))
+        tenant = hashlib.blake2b(ids.encode(), digest_size=8).hexdigest()
+    return f'{tenant}.{get_version(CUSTOMERS_VERSION)}'
+
+
+def invalidate_asset_rows(pks):
+    bump_versions([asset_version_name(pk) for pk in pks])
+
+
+def invalidate_all_asset_rows():
+    bump_version(ROWS_VERSION)
+
+
+def invalidate_customer_names():
+    bump_version(CUSTOMERS_VERSION)
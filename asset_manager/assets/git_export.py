@@ -0,0 +1,241 @@
+import hashlib
+import json
+import os
+import subprocess
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Asset, Customer
+
+# Inventory fields only: last_checked moves on every poll and would turn each
+# export into a rewrite of the whole tree
+ASSET_FIELDS = [
+    'id', 'name', 'asset_type', 'ip_address', 'monitoring_status', 'status',
+    'business_criticality', 'patch_cycle', 'configuration',
+]
+CUSTOMER_FIELDS = ['id', 'display_name', 'legal_name', 'contact_person']
+
+
+class GitExportError(Exception):
+    pass
+
+
+class ExportResult:
+    def __init__(self):
+        self.written = 0
+        self.deleted = 0
+        self.unchanged = 0
+        self.commit = None
+
+    @property
+    def changed(self):
+        return bool(self.written or self.deleted)
+
+
+def render(payload):
+    return (json.dumps(payload, cls=DjangoJSONEncoder, indent=2, sort_keys=True) + '\n').encode()
+
+
+def blob_id(data):
+    """The id git gives ``data`` as a blob, so the manifest matches ``git ls-tree``."""
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
+
+
+def customer_path(customer_id):
+    return f'customers/{customer_id}/customer.json'
+
+
+def asset_path(customer_id, asset_id):
+    return f'customers/{customer_id}/assets/{asset_id}.json'
+
+
+class GitExporter:
+    """
+    Export one JSON file per customer and per asset to a git branch,
+    committing only the files whose content changed.
+
+    A local bare repository under ``state_dir`` mirrors the target branch. The
+    manifest next to it maps every exported path to the git blob id of its
+    last rendered payload, so an export only hashes payloads: unchanged files
+    never reach git, and a run with no changes creates no commit. Changed
+    files are streamed into ``git fast-import`` and the new commit is pushed
+    to ``remote`` (any URL or path ``git push`` accepts).
+    """
+
+    def __init__(self, remote, state_dir, branch='main', author=None):
+        self.remote = str(remote)
+        self.state_dir = Path(state_dir)
+        self.branch = branch
+        self.author = author or getattr(settings, 'GIT_EXPORT_AUTHOR', 'Asset Manager <asset-manager@localhost>')
+        self.repo_dir = self.state_dir / 'repo.git'
+        self.manifest_path = self.state_dir / 'manifest.json'
+
+    def git(self, *args, **kwargs):
+        env = {**os.environ, 'GIT_DIR': str(self.repo_dir)}
+        try:
+            return subprocess.run(
+                ['git', *args], env=env, check=True, capture_output=True, **kwargs
+            ).stdout
+        except subprocess.CalledProcessError as e:
+            raise GitExportError(f'git {args[0]} failed: {e.stderr.decode(errors="replace").strip()}')
+
+    @property
+    def ref(self):
+        return f'refs/heads/{self.branch}'
+
+    def head(self):
+        try:
+            return self.git('rev-parse', '--verify', '--quiet', self.ref).decode().strip() or None
+        except GitExportError:
+            return None
+
+    def prepare(self):
+        if not self.repo_dir.exists():
+            self.state_dir.mkdir(parents=True, exist_ok=True)
+            self.git('init', '--quiet', '--bare', str(self.repo_dir))
+        remote_refs = self.git('ls-remote', '--heads', self.remote, self.branch)
+        if remote_refs.strip():
+            self.git('fetch', '--quiet', self.remote, f'+{self.ref}:{self.ref}')
+
+    def load_manifest(self, head):
+        if head is None:
+            return {}
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get('commit') == head:
+                return manifest['files']
+        except (OSError, ValueError, KeyError):
+            pass
+        # Missing, stale or written for another commit: the tree itself
+        # records the blob id of every path
+        files = {}
+        listing = self.git('ls-tree', '-r', '-z', head)
+        for entry in listing.split(b'\0'):
+            if entry:
+                meta, path = entry.split(b'\t', 1)
+                files[path.decode()] = meta.split()[2].decode()
+        return files
+
+    def save_manifest(self, head, files):
+        tmp_path = self.manifest_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'commit': head, 'files': files}, f, separators=(',', ':'))
+        os.replace(tmp_path, self.manifest_path)
+
+    def documents(self, customer_ids):
+        customers = Customer.objects.order_by('pk')
+        assets = Asset.objects.order_by('customer_id', 'pk')
+        if customer_ids is not None:
+            customers = customers.filter(pk__in=customer_ids)
+            assets = assets.filter(customer_id__in=customer_ids)
+        for row in customers.values(*CUSTOMER_FIELDS).iterator(chunk_size=2000):
+            yield customer_path(row['id']), row
+        for row in assets.values('customer_id', *ASSET_FIELDS).iterator(chunk_size=2000):
+            yield asset_path(row.pop('customer_id'), row['id']), row
+
+    def export(self, customer_ids=None, message=None):
+        self.prepare()
+        head = self.head()
+        previous = self.load_manifest(head)
+        files = dict(previous)
+        result = ExportResult()
+        importer = None
+
+        def write(command):
+            nonlocal importer
+            if importer is None:
+                importer = self.start_commit(head, message)
+            importer.write(command)
+
+        try:
+            seen = set()
+            for path, payload in self.documents(customer_ids):
+                seen.add(path)
+                data = render(payload)
+                digest = blob_id(data)
+                if previous.get(path) == digest:
+                    result.unchanged += 1
+                    continue
+                write(b'M 100644 inline %s\ndata %d\n%s\n' % (path.encode(), len(data), data))
+                files[path] = digest
+                result.written += 1
+
+            prefixes = None if customer_ids is None else tuple(f'customers/{pk}/' for pk in customer_ids)
+            for path in previous:
+                if path in seen or not path.startswith('customers/'):
+                    continue
+                if prefixes is not None and not path.startswith(prefixes):
+                    continue
+                write(b'D %s\n' % path.encode())
+                del files[path]
+                result.deleted += 1
+            if importer is not None:
+                importer.finish()
+        except BaseException:
+            # Leave no fast-import behind, and the branch as it was
+            if importer is not None:
+                importer.abort()
+            raise
+
+        if importer is not None:
+            head = self.head()
+            self.git('push', '--quiet', self.remote, f'{self.ref}:{self.ref}')
+            result.commit = head
+        self.save_manifest(head, files)
+        return result
+
+    def start_commit(self, parent, message):
+        return _CommitStream(self.repo_dir, self.ref, self.author, parent, message)
+
+
+class _CommitStream:
+    """A single commit being written through ``git fast-import``."""
+
+    def __init__(self, repo_dir, ref, author, parent, message):
+        message = (message or 'Asset inventory export').encode()
+        self.process = subprocess.Popen(
+            ['git', 'fast-import', '--quiet', '--done'],
+            stdin=subprocess.PIPE, stderr=subprocess.PIPE,
+            env={**os.environ, 'GIT_DIR': str(repo_dir)},
+        )
+        header = b'commit %s\ncommitter %s %d +0000\ndata %d\n%s\n' % (
+            ref.encode(), author.encode(), int(time.time()), len(message), message,
+        )
+        if parent:
+            header += b'from %s\n' % parent.encode()
+        self.write(header)
+
+    def write(self, command):
+        try:
+            self.process.stdin.write(command)
+        except OSError:
+            # fast-import exited (e.g. on a command it rejected)
+            self.fail()
+
+    def fail(self):
+        self.abort()
+        raise GitExportError(f'git fast-import failed: {self.process.stderr.read().decode(errors="replace").strip()}')
+
+    def finish(self):
+        # --done makes fast-import reject a stream that was cut short
+        self.write(b'\ndone\n')
+        try:
+            self.process.stdin.close()
+        except OSError:
+            self.fail()
+        if self.process.wait() != 0:
+            self.fail()
+
+    def abort(self):
+        """End fast-import without committing; the ref is left as it was."""
+        if self.process.poll() is None:
+            self.process.kill()
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass  # Unwritten commands to a process that has exited
+        self.process.wait()
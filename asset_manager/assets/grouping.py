@@ -0,0 +1,259 @@
+import fnmatch
+import ipaddress
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from .config_index import config_value
+from .models import Asset, AssetGroup, GroupRule
+from .utils import chunked
+from .versions import bump_version, get_version, versions_are_shared
+
+# Asset fields the rules look at, in the order GroupMatcher.groups_for takes them
+MATCH_FIELDS = ['asset_type', 'business_criticality', 'ip_address', 'name', 'configuration']
+
+Membership = AssetGroup.assets.through
+
+_WILDCARDS = re.compile(r'[*?\[]')
+_LITERAL_SUFFIX = re.compile(r'[^*?\[\]]*$')
+
+
+class GroupMatcher:
+    """
+    The group rules of one customer compiled into lookup tables.
+
+    Every rule becomes an entry in a table keyed by what it matches
+    (asset type, criticality, network at a prefix length, literal name
+    prefix or suffix, configuration key), so evaluating an asset costs a few dict
+    lookups per field rather than one test per rule. Each lookup yields the
+    group of every rule that matched; a group matches when the number of
+    its rules that matched reaches what its match mode requires.
+    """
+
+    def __init__(self, rules):
+        self.types = defaultdict(list)
+        self.criticalities = defaultdict(list)
+        # (ip version, prefix length) -> {network number: [group ids]}
+        self.networks = defaultdict(lambda: defaultdict(list))
+        self.exact_names = defaultdict(list)
+        # Literal prefix (or suffix) length -> {literal: [(pattern, group id)]}
+        self.name_prefixes = defaultdict(lambda: defaultdict(list))
+        self.name_suffixes = defaultdict(lambda: defaultdict(list))
+        self.scanned_names = []
+        self.configuration = defaultdict(list)
+
+        counts = Counter()
+        modes = {}
+        for group_id, match, field, value in rules:
+            counts[group_id] += 1
+            modes[group_id] = match
+            self.add_rule(group_id, field, value)
+        self.required = {
+            group_id: 1 if modes[group_id] == 'any' else count
+            for group_id, count in counts.items()
+        }
+
+    def __bool__(self):
+        return bool(self.required)
+
+    def add_rule(self, group_id, field, value):
+        if field == 'asset_type':
+            self.types[value].append(group_id)
+        elif field == 'business_criticality':
+            self.criticalities[value].append(group_id)
+        elif field == 'ip_network':
+            try:
+                network = ipaddress.ip_network(value.strip(), strict=False)
+            except ValueError:
+                return  # Invalid rules never match
+            shift = network.max_prefixlen - network.prefixlen
+            key = (network.version, network.prefixlen)
+            self.networks[key][int(network.network_address) >> shift].append(group_id)
+        elif field == 'name':
+            pattern = value.strip().lower()
+            wildcard = _WILDCARDS.search(pattern)
+            if wildcard is None:
+                self.exact_names[pattern].append(group_id)
+                return
+            compiled = re.compile(fnmatch.translate(pattern))
+            prefix = pattern[:wildcard.start()]
+            suffix = _LITERAL_SUFFIX.search(pattern).group()
+            if prefix:
+                self.name_prefixes[len(prefix)][prefix].append((compiled, group_id))
+            elif suffix:
+                self.name_suffixes[len(suffix)][suffix].append((compiled, group_id))
+            else:
+                self.scanned_names.append((compiled, group_id))
+        elif field == 'configuration':
+            key, sep, expected = value.partition('=')
+            self.configuration[key.strip()].append((expected.strip() if sep else None, group_id))
+
+    def groups_for(self, asset_type, business_criticality, ip_address, name, configuration):
+        if not self.required:
+            return set()
+        hits = []
+        hits += self.types.get(asset_type, ())
+        hits += self.criticalities.get(business_criticality, ())
+
+        if self.networks and ip_address:
+            try:
+                ip = ipaddress.ip_address(ip_address)
+            except ValueError:
+                ip = None
+            if ip is not None:
+                number = int(ip)
+                for (version, prefixlen), table in self.networks.items():
+                    if version == ip.version:
+                        hits += table.get(number >> (ip.max_prefixlen - prefixlen), ())
+
+        name = (name or '').lower()
+        hits += self.exact_names.get(name, ())
+        for length, table in self.name_prefixes.items():
+            for pattern, group_id in table.get(name[:length], ()):
+                if pattern.match(name):
+                    hits.append(group_id)
+        for length, table in self.name_suffixes.items():
+            for pattern, group_id in table.get(name[-length:], ()):
+                if pattern.match(name):
+                    hits.append(group_id)
+        for pattern, group_id in self.scanned_names:
+            if pattern.match(name):
+                hits.append(group_id)
+
+        if self.configuration and isinstance(configuration, dict):
+            for key, value in configuration.items():
+                for expected, group_id in self.configuration.get(key, ()):
+                    if expected is None or config_value(value) == expected:
+                        hits.append(group_id)
+
+        required = self.required
+        return {group_id for group_id, count in Counter(hits).items() if count >= required[group_id]}
+
+
+def rules_version_name(customer_id):
+    return f'group-rules:{customer_id}'
+
+
+# customer id -> (rules version, matcher, expiry), per process
+_matchers = {}
+
+
+def matcher_timeout():
+    """
+    Seconds a compiled matcher is trusted without its version moving: as
+    long as it does with a shared cache, briefly with a per-process one,
+    which never sees the bumps of rule edits made by other processes.
+    """
+    if versions_are_shared():
+        return None
+    return getattr(settings, 'GROUP_MATCHER_LOCAL_TIMEOUT', 5)
+
+
+def get_matcher(customer_id):
+    version = get_version(rules_version_name(customer_id))
+    now = time.monotonic()
+    cached = _matchers.get(customer_id)
+    if cached is not None and cached[0] == version and (cached[2] is None or now < cached[2]):
+        return cached[1]
+    rules = GroupRule.objects.filter(group__customer_id=customer_id).values_list(
+        'group_id', 'group__match', 'field', 'value',
+    )
+    matcher = GroupMatcher(rules)
+    timeout = matcher_timeout()
+    _matchers[customer_id] = (version, matcher, None if timeout is None else now + timeout)
+    return matcher
+
+
+def sync_memberships(rows, created=False):
+    """
+    Bring the group memberships of the given assets up to date.
+
+    ``rows`` are ``(asset_id, customer_id, *MATCH_FIELDS)`` tuples. Only
+    memberships of these assets are read and written: one query for the
+    current memberships, then one bulk insert and one delete per group
+    that lost members. With ``created``, the assets are known to have no
+    memberships yet and the read is skipped.
+    """
+    matchers = {}
+    desired = {}
+    for asset_id, customer_id, *fields in rows:
+        matcher = matchers.get(customer_id)
+        if matcher is None:
+            matcher = matchers[customer_id] = get_matcher(customer_id)
+        desired[asset_id] = matcher.groups_for(*fields)
+    if not desired or (created and not any(desired.values())):
+        return
+
+    current = defaultdict(set)
+    if not created:
+        for chunk in chunked(desired):
+            for asset_id, group_id in Membership.objects.filter(asset_id__in=chunk).values_list(
+                    'asset_id', 'assetgroup_id'):
+                current[asset_id].add(group_id)
+
+    added = []
+    removed = defaultdict(list)
+    for asset_id, group_ids in desired.items():
+        for group_id in group_ids - current[asset_id]:
+            added.append(Membership(asset_id=asset_id, assetgroup_id=group_id))
+        for group_id in current[asset_id] - group_ids:
+            removed[group_id].append(asset_id)
+    if not added and not removed:
+        return
+
+    with transaction.atomic():
+        for group_id, asset_ids in removed.items():
+            for chunk in chunked(asset_ids):
+                Membership.objects.filter(assetgroup_id=group_id, asset_id__in=chunk).delete()
+        Membership.objects.bulk_create(added, batch_size=1000, ignore_conflicts=True)
+
+
+def asset_row(asset):
+    return (asset.pk, asset.customer_id, *(getattr(asset, field) for field in MATCH_FIELDS))
+
+
+def update_asset_groups(assets, created=False):
+    """Re-evaluate saved Asset instances, e.g. after save() or a bulk import."""
+    sync_memberships([asset_row(asset) for asset in assets if asset.pk is not None], created=created)
+
+
+def rebuild_memberships(customer_ids=None, chunk_size=5000):
+    """Re-evaluate every asset of ``customer_ids`` (default: all customers)."""
+    assets = Asset.objects.order_by('pk')
+    if customer_ids is not None:
+        assets = assets.filter(customer_id__in=customer_ids)
+    rows = []
+    for row in assets.values_list('pk', 'customer_id', *MATCH_FIELDS).iterator(chunk_size=chunk_size):
+        rows.append(row)
+        if len(rows) >= chunk_size:
+            sync_memberships(rows)
+            rows = []
+    sync_memberships(rows)
+
+
+_pending = threading.local()
+
+
+def _rebuild_pending():
+    customer_ids = getattr(_pending, 'customer_ids', None)
+    if customer_ids:
+        _pending.customer_ids = set()
+        rebuild_memberships(customer_ids)
+
+
+def rules_changed(customer_id):
+    """
+    Recompute a customer's memberships once the current transaction commits.
+
+    Saving several rules (or deleting a group and its rules) in one
+    transaction leads to a single rebuild per customer.
+    """
+    bump_version(rules_version_name(customer_id))
+    if not hasattr(_pending, 'customer_ids'):
+        _pending.customer_ids = set()
+    _pending.customer_ids.add(customer_id)
+    transaction.on_commit(_rebuild_pending)
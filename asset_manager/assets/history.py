@@ -0,0 +1,274 @@
+"""
+Check history of assets, stored as packed chunks.
+
+Each CheckChunk holds the points of one asset over a fixed span at one
+resolution, as consecutive fixed-size structs in a binary column:
+
+- raw checks (resolution 0, one chunk per hour): time and connect latency
+  in ms, NaN when the asset was not reached;
+- 5-minute buckets (one chunk per day) and hourly buckets (one chunk per
+  30 days): bucket start, number of checks, checks that reached the asset,
+  and minimum/mean/maximum latency.
+
+A poll sweep appends its points with one INSERT ... ON CONFLICT DO UPDATE
+per batch of chunks, concatenating onto the chunk's data, so history costs
+one row per asset and hour rather than one per check. Databases without
+ON CONFLICT lock the batch's chunks and rewrite them instead. Once an hour is over,
+its raw chunk is downsampled into both coarser tiers; each tier is pruned
+after its retention period. Range queries read the finest tier that covers
+the range with a sensible number of points, plus the raw checks of the
+current hour for the coarser tiers.
+"""
+import math
+import struct
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+
+from .models import CheckChunk
+from .utils import chunked
+
+RAW = 0
+FIVE_MINUTES = 300
+HOURLY = 3600
+RESOLUTIONS = [RAW, FIVE_MINUTES, HOURLY]
+
+TIER_NAMES = {RAW: 'raw', FIVE_MINUTES: '5m', HOURLY: '1h'}
+
+# Seconds of history in one chunk of each tier. Raw chunks are an hour so
+# that every bucket of the coarser tiers comes from a single raw chunk.
+CHUNK_SPANS = {RAW: 3600, FIVE_MINUTES: 86400, HOURLY: 30 * 86400}
+
+# Longest range each tier answers (the rest go to the hourly tier)
+MAX_RANGES = {RAW: 6 * 3600, FIVE_MINUTES: 3 * 86400}
+
+DEFAULT_RETENTION_DAYS = {'raw': 2, '5m': 30, '1h': 400}
+
+# Raw chunks are rolled up this long after their hour ends, so checks of a
+# sweep that straddles the hour still land before the roll-up
+ROLLUP_DELAY = 300
+
+RAW_POINT = struct.Struct('<If')
+# Check counts are 32-bit: an hourly bucket of a sweep every 50ms already
+# passes 65535 (0023_check_buckets_uint32 repacked the 16-bit ones)
+BUCKET_POINT = struct.Struct('<IIIfff')
+
+Bucket = namedtuple('Bucket', ['start', 'checks', 'up', 'latency_min', 'latency_avg', 'latency_max'])
+
+
+def retention(resolution):
+    days = {**DEFAULT_RETENTION_DAYS, **getattr(settings, 'CHECK_HISTORY_RETENTION_DAYS', {})}
+    return days[TIER_NAMES[resolution]] * 86400
+
+
+def chunk_start(timestamp, resolution):
+    return timestamp - timestamp % CHUNK_SPANS[resolution]
+
+
+def pack_raw(points):
+    """``(unix time, latency in ms or None)`` pairs as raw chunk data."""
+    return b''.join(
+        RAW_POINT.pack(timestamp, math.nan if latency is None else latency) for timestamp, latency in points
+    )
+
+
+def unpack_raw(data):
+    return list(RAW_POINT.iter_unpack(bytes(data)))
+
+
+def pack_buckets(buckets):
+    return b''.join(BUCKET_POINT.pack(*bucket) for bucket in buckets)
+
+
+def unpack_buckets(data):
+    return [Bucket(*values) for values in BUCKET_POINT.iter_unpack(bytes(data))]
+
+
+def downsample(points, resolution):
+    """Raw ``(time, latency)`` points as Buckets of ``resolution`` seconds, in time order."""
+    buckets = {}
+    for timestamp, latency in points:
+        start = timestamp - timestamp % resolution
+        bucket = buckets.get(start)
+        if bucket is None:
+            bucket = buckets[start] = [0, 0, math.inf, 0.0, -math.inf]
+        bucket[0] += 1
+        if not math.isnan(latency):
+            bucket[1] += 1
+            bucket[2] = min(bucket[2], latency)
+            bucket[3] += latency
+            bucket[4] = max(bucket[4], latency)
+    return [
+        Bucket(start, checks, up, low, total / up, high) if up else
+        Bucket(start, checks, 0, math.nan, math.nan, math.nan)
+        for start, (checks, up, low, total, high) in sorted(buckets.items())
+    ]
+
+
+def append_points(rows):
+    """
+    Append to chunks, creating them as needed. ``rows`` are ``(asset_id,
+    resolution, chunk start, point count, packed data)``.
+    """
+    if not rows:
+        return
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        for batch in chunked(rows):
+            extend_chunks(batch)
+        return
+    table = connection.ops.quote_name(CheckChunk._meta.db_table)
+    blob = 'bytea' if connection.vendor == 'postgresql' else 'BLOB'
+    sql = (
+        f'INSERT INTO {table} (asset_id, resolution, start, count, data, rolled_up) '
+        f'VALUES (%s, %s, %s, %s, %s, %s) '
+        f'ON CONFLICT (asset_id, resolution, start) DO UPDATE SET '
+        f'data = CAST({table}.data || excluded.data AS {blob}), count = {table}.count + excluded.count'
+    )
+    with connection.cursor() as cursor:
+        for batch in chunked(rows):
+            cursor.executemany(sql, [row + (False,) for row in batch])
+
+
+def extend_chunks(rows, attempts=3):
+    """
+    append_points without ON CONFLICT: lock the chunks of ``rows`` that
+    exist, then write them back extended along with the new ones.
+    """
+    for attempt in range(attempts):
+        try:
+            with transaction.atomic():
+                _write_extended_chunks(rows)
+            return
+        except IntegrityError:
+            # Another writer created one of the chunks first, so the next
+            # attempt finds and locks it. Any other error fails every attempt.
+            if attempt == attempts - 1:
+                raise
+
+
+def _write_extended_chunks(rows):
+    chunks = {
+        (chunk.asset_id, chunk.resolution, chunk.start): chunk
+        for chunk in CheckChunk.objects.select_for_update().filter(
+            asset_id__in={row[0] for row in rows},
+            resolution__in={row[1] for row in rows},
+            start__in={row[2] for row in rows},
+        )
+    }
+    changed, created = {}, []
+    for asset_id, resolution, start, count, data in rows:
+        key = (asset_id, resolution, start)
+        chunk = chunks.get(key)
+        if chunk is None:
+            chunk = chunks[key] = CheckChunk(asset_id=asset_id, resolution=resolution, start=start)
+            created.append(chunk)
+        elif chunk.pk is not None:
+            changed[key] = chunk
+        chunk.count += count
+        chunk.data = bytes(chunk.data) + data
+    CheckChunk.objects.bulk_update(changed.values(), ['count', 'data'])
+    CheckChunk.objects.bulk_create(created)
+
+
+def record_checks(checks):
+    """
+    Append raw checks: ``(asset_id, checked_at, latency in ms or None)``,
+    e.g. the results of a poll sweep.
+    """
+    points = defaultdict(list)
+    for asset_id, checked_at, latency in checks:
+        timestamp = int(checked_at.timestamp())
+        points[(asset_id, chunk_start(timestamp, RAW))].append((timestamp, latency))
+    append_points([
+        (asset_id, RAW, start, len(chunk_points), pack_raw(chunk_points))
+        for (asset_id, start), chunk_points in points.items()
+    ])
+
+
+def rollup(now, batch_size=1000):
+    """
+    Downsample the raw chunks of hours that are over into the 5-minute and
+    hourly tiers. Returns the number of raw chunks rolled up.
+    """
+    cutoff = int(now.timestamp()) - CHUNK_SPANS[RAW] - ROLLUP_DELAY
+    pending = CheckChunk.objects.filter(resolution=RAW, rolled_up=False, start__lte=cutoff)
+    rolled_up = 0
+    while True:
+        chunks = list(pending.order_by('pk').values_list('pk', 'asset_id', 'data')[:batch_size])
+        if not chunks:
+            return rolled_up
+        rows = []
+        for _, asset_id, data in chunks:
+            points = unpack_raw(data)
+            for resolution in (FIVE_MINUTES, HOURLY):
+                buckets = downsample(points, resolution)
+                if buckets:
+                    start = chunk_start(buckets[0].start, resolution)
+                    rows.append((asset_id, resolution, start, len(buckets), pack_buckets(buckets)))
+        with transaction.atomic():
+            append_points(rows)
+            CheckChunk.objects.filter(pk__in=[pk for pk, _, _ in chunks]).update(rolled_up=True)
+        rolled_up += len(chunks)
+
+
+def prune(now):
+    """Delete the chunks that ended before their tier's retention. Returns the number deleted."""
+    timestamp = int(now.timestamp())
+    deleted = 0
+    for resolution in RESOLUTIONS:
+        expired = CheckChunk.objects.filter(
+            resolution=resolution, start__lt=timestamp - retention(resolution) - CHUNK_SPANS[resolution],
+        )
+        if resolution == RAW:
+            expired = expired.filter(rolled_up=True)
+        deleted += expired.delete()[0]
+    return deleted
+
+
+def maintain_history(now):
+    return rollup(now), prune(now)
+
+
+def choose_resolution(start, end, now):
+    """The finest tier that answers ``start``..``end`` (unix times) and still holds ``start``."""
+    for resolution in (RAW, FIVE_MINUTES):
+        if end - start <= MAX_RANGES[resolution] and start >= now - retention(resolution):
+            return resolution
+    return HOURLY
+
+
+def read_chunks(asset_id, resolution, start, end, **filters):
+    return CheckChunk.objects.filter(
+        asset_id=asset_id, resolution=resolution,
+        start__gt=start - CHUNK_SPANS[resolution], start__lt=end, **filters,
+    ).order_by('start').values_list('data', flat=True)
+
+
+def history(asset_id, start, end, now, resolution=None):
+    """
+    Buckets of an asset's checks between ``start`` and ``end`` (datetimes),
+    as ``(resolution, buckets)``. Raw checks are returned as one-check
+    buckets. Without ``resolution`` the tier is picked from the range.
+    """
+    start, end, now = int(start.timestamp()), int(end.timestamp()), int(now.timestamp())
+    if resolution is None:
+        resolution = choose_resolution(start, end, now)
+
+    if resolution == RAW:
+        points = sorted(point for data in read_chunks(asset_id, RAW, start, end) for point in unpack_raw(data))
+        buckets = [
+            Bucket(timestamp, 1, 0, math.nan, math.nan, math.nan) if math.isnan(latency) else
+            Bucket(timestamp, 1, 1, latency, latency, latency)
+            for timestamp, latency in points
+        ]
+    else:
+        buckets = [bucket for data in read_chunks(asset_id, resolution, start, end) for bucket in unpack_buckets(data)]
+        # Hours not rolled up yet come straight from their raw checks
+        recent = [
+            point
+            for data in read_chunks(asset_id, RAW, start, end, rolled_up=False)
+            for point in unpack_raw(data)
+        ]
+        buckets = sorted(buckets + downsample(recent, resolution))
+    return resolution, [bucket for bucket in buckets if start <= bucket.start < end]
@@ -0,0 +1,373 @@
+import csv
+import io
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+
+from .compliance import refresh_patch_due
+from .forms import parse_configuration
+from .ip import ip_key
+from .ipindex import get_ip_index
+from .models import Asset, Customer
+from .signals import assets_bulk_saved
+
+IMPORT_FORMATS = ['csv', 'json', 'ndjson']
+
+# Columns refreshed when a row matches an existing (customer, name)
+# last_checked/last_seen belong to the poller and are left alone on re-import
+UPDATE_FIELDS = [
+    'asset_type', 'ip_address', 'ip_key', 'status', 'business_criticality',
+    'patch_cycle', 'configuration', 'updated_at',
+]
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'active'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'inactive'}
+
+MAX_JSON_OBJECT_SIZE = 1024 * 1024
+
+
+class ImportFormatError(Exception):
+    """The input cannot be read any further (as opposed to a bad row)."""
+
+
+class MalformedRow:
+    def __init__(self, message):
+        self.message = message
+
+
+def guess_format(filename):
+    extension = filename.rsplit('.', 1)[-1].lower()
+    if extension in ('jsonl', 'ndjson'):
+        return 'ndjson'
+    return extension if extension in IMPORT_FORMATS else None
+
+
+def text_stream(binary):
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
+
+
+def read_csv(stream):
+    reader = csv.DictReader(stream)
+    try:
+        for row in reader:
+            yield reader.line_num, row
+    except csv.Error as e:
+        raise ImportFormatError(f'Invalid CSV after line {reader.line_num}: {e}')
+
+
+def read_ndjson(stream):
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield number, MalformedRow(f'Invalid JSON: {e.msg}')
+
+
+def read_json(stream, chunk_size=64 * 1024):
+    """
+    Yield the elements of a top-level JSON array one at a time, holding at
+    most one element (plus a read chunk) in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    number = 0
+    eof = False
+
+    while True:
+        # Skip separators between elements
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position < len(buffer):
+            if not started:
+                if buffer[position] != '[':
+                    raise ImportFormatError('JSON input must be an array of objects')
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as e:
+                if eof or len(buffer) - position > MAX_JSON_OBJECT_SIZE:
+                    raise ImportFormatError(f'Invalid JSON after element {number}: {e.msg}')
+            else:
+                number += 1
+                yield number, value
+                position = end
+                continue
+        elif eof:
+            raise ImportFormatError('Unexpected end of JSON input')
+
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+    'ndjson': read_ndjson,
+}
+
+
+def parse_bool(value, default=True):
+    if isinstance(value, bool):
+        return value
+    if value is None or str(value).strip() == '':
+        return default
+    value = str(value).strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValidationError({'status': f"'{value}' is not a valid status"})
+
+
+def error_messages(error):
+    if hasattr(error, 'error_dict'):
+        return [
+            f'{field}: {message}' if field != '__all__' else message
+            for field, messages in error.message_dict.items()
+            for message in messages
+        ]
+    return list(error.messages)
+
+
+class ImportResult:
+    def __init__(self, max_errors):
+        self.rows = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        # Imported rows with something to check, e.g. a shared address
+        self.warned = 0
+        self.warnings = []
+        self.max_errors = max_errors
+
+    def add_error(self, number, messages):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((number, messages))
+
+    def add_warning(self, number, messages):
+        self.warned += 1
+        if len(self.warnings) < self.max_errors:
+            self.warnings.append((number, messages))
+
+
+class AssetImporter:
+    """
+    Validate asset rows with the same rules as AssetForm and Asset.clean and
+    upsert them on (customer, name) in batches.
+
+    Rows are consumed from an iterator of ``(row_number, data)`` pairs, so the
+    input is never held in memory. Each batch is written with one
+    ``bulk_create`` inside its own transaction, and ``assets_bulk_saved`` is
+    sent once per batch instead of ``post_save`` once per row.
+
+    Imported rows whose address another asset of the customer has, either
+    already or from an earlier row, are imported with a warning.
+    """
+
+    def __init__(self, customer_ids=None, default_customer_id=None, batch_size=1000,
+                 on_error=None, on_warning=None, max_errors=1000):
+        if customer_ids is None:
+            customer_ids = Customer.objects.values_list('pk', flat=True)
+        self.customer_ids = set(customer_ids)
+        self.default_customer_id = default_customer_id
+        self.batch_size = batch_size
+        self.on_error = on_error
+        self.on_warning = on_warning
+        self.max_errors = max_errors
+        self.addresses = None
+        self.seen_addresses = {}
+
+    def customer_for(self, data):
+        value = data.get('customer', data.get('customer_id'))
+        if value in (None, ''):
+            value = self.default_customer_id
+        if value in (None, ''):
+            raise ValidationError({'customer': 'A customer is required'})
+        try:
+            customer_id = int(value)
+        except (TypeError, ValueError):
+            raise ValidationError({'customer': f"'{value}' is not a customer ID"})
+        if customer_id not in self.customer_ids:
+            raise ValidationError({'customer': f'Customer {customer_id} is not available'})
+        return customer_id
+
+    def build_asset(self, data):
+        if not isinstance(data, dict):
+            raise ValidationError('Each row must be an object')
+        errors = {}
+        try:
+            customer_id = self.customer_for(data)
+        except ValidationError as e:
+            errors.update(e.message_dict)
+            customer_id = None
+        configuration = data.get('configuration')
+        try:
+            if configuration is None or isinstance(configuration, str):
+                configuration = parse_configuration(configuration)
+            elif not isinstance(configuration, dict):
+                raise ValidationError('Must be an object or key=value pairs')
+        except ValidationError as e:
+            errors['configuration'] = e.messages
+            configuration = {}
+        try:
+            status = parse_bool(data.get('status'))
+        except ValidationError as e:
+            errors.update(e.message_dict)
+            status = True
+
+        asset = Asset(
+            customer_id=customer_id,
+            name=str(data.get('name') or '').strip(),
+            asset_type=str(data.get('asset_type') or '').strip(),
+            ip_address=str(data.get('ip_address') or '').strip(),
+            status=status,
+            business_criticality=str(data.get('business_criticality') or 'normal').strip(),
+            patch_cycle=data.get('patch_cycle') or 30,
+            configuration=configuration,
+        )
+        try:
+            # Field checks (choices, lengths, patch cycle) and Asset.clean;
+            # uniqueness is what the upsert resolves, so it is not checked
+            asset.full_clean(
+                exclude=['customer', 'ip_key', 'configuration', 'last_checked'],
+                validate_unique=False,
+                validate_constraints=False,
+            )
+        except ValidationError as e:
+            for field, messages in e.message_dict.items():
+                errors.setdefault(field, []).extend(messages)
+        # AssetForm.patch_cycle has min_value=1, the model field allows 0
+        if 'patch_cycle' not in errors and asset.patch_cycle < 1:
+            errors['patch_cycle'] = ['Ensure this value is greater than or equal to 1.']
+        if errors:
+            raise ValidationError(errors)
+        asset.ip_key = ip_key(asset.ip_address)
+        return asset
+
+    def write_batch(self, batch):
+        # A later row for the same (customer, name) wins; PostgreSQL refuses
+        # to update one row twice in a single INSERT ... ON CONFLICT
+        assets = list(batch.values())
+        with transaction.atomic():
+            previous = self.previous_values(assets)
+            Asset.objects.bulk_create(
+                assets,
+                update_conflicts=True,
+                unique_fields=['customer', 'name'],
+                update_fields=UPDATE_FIELDS,
+            )
+            if any(asset.pk is None for asset in assets):
+                self.resolve_ids(assets)
+            # Updated rows may have a new patch_cycle for their last_patched
+            refresh_patch_due(Asset.objects.filter(pk__in=[asset.pk for asset in assets]))
+        assets_bulk_saved.send(sender=Asset, assets=assets, previous=previous)
+        return len(assets)
+
+    @staticmethod
+    def previous_values(assets):
+        # The rows the upsert is about to overwrite, for receivers that
+        # maintain derived data (see assets.signals.assets_bulk_saved)
+        keys = {(asset.customer_id, asset.name) for asset in assets}
+        rows = Asset.objects.filter(
+            customer_id__in={customer_id for customer_id, _ in keys},
+            name__in={name for _, name in keys},
+        ).values('pk', 'customer_id', 'name', *UPDATE_FIELDS)
+        return {row['pk']: row for row in rows if (row['customer_id'], row['name']) in keys}
+
+    @staticmethod
+    def resolve_ids(assets):
+        # Backends that cannot return ids from a bulk upsert
+        by_key = {(asset.customer_id, asset.name): asset for asset in assets}
+        query = Q()
+        for customer_id, name in by_key:
+            query |= Q(customer_id=customer_id, name=name)
+        for pk, customer_id, name in Asset.objects.filter(query).values_list('pk', 'customer_id', 'name'):
+            by_key[(customer_id, name)].pk = pk
+
+    def check_addresses(self, batch, numbers, result):
+        """
+        Warn about written rows that share their address with another asset
+        of their customer. Existing assets are looked up in the IP index as
+        it was before the import started; rows of the import are tracked by
+        address as they are written.
+        """
+        for key, asset in batch.items():
+            address = int(asset.ip_key, 16)
+            number = numbers[key]
+            existing = [
+                hit for hit in self.addresses.lookup(address, [asset.customer_id]) if hit.asset_id != asset.pk
+            ]
+            name, first = self.seen_addresses.setdefault((asset.customer_id, address), (asset.name, number))
+            messages = []
+            if existing:
+                count = len(existing)
+                messages.append(
+                    f'ip_address: {asset.ip_address} is also the address of {count} '
+                    f'existing asset{"s" if count > 1 else ""}'
+                )
+            if name != asset.name:
+                messages.append(f'ip_address: {asset.ip_address} is also the address of {name} (row {first})')
+            if messages:
+                result.add_warning(number, messages)
+                if self.on_warning:
+                    self.on_warning(number, messages)
+
+    def write(self, batch, numbers, result):
+        result.imported += self.write_batch(batch)
+        self.check_addresses(batch, numbers, result)
+
+    def run(self, rows):
+        result = ImportResult(self.max_errors)
+        self.addresses = get_ip_index()
+        self.seen_addresses = {}
+        batch = {}
+        numbers = {}
+        for number, data in rows:
+            result.rows += 1
+            if isinstance(data, MalformedRow):
+                messages = [data.message]
+            else:
+                try:
+                    asset = self.build_asset(data)
+                except ValidationError as e:
+                    messages = error_messages(e)
+                else:
+                    batch[(asset.customer_id, asset.name)] = asset
+                    numbers[(asset.customer_id, asset.name)] = number
+                    if len(batch) >= self.batch_size:
+                        self.write(batch, numbers, result)
+                        batch = {}
+                        numbers = {}
+                    continue
+            result.add_error(number, messages)
+            if self.on_error:
+                self.on_error(number, messages)
+        if batch:
+            self.write(batch, numbers, result)
+        return result
+
+
+def read_rows(stream, fmt):
+    """READERS[fmt] over ``stream``, with undecodable input as ImportFormatError."""
+    try:
+        yield from READERS[fmt](stream)
+    except UnicodeDecodeError:
+        raise ImportFormatError('The file is not UTF-8 text')
+
+
+def import_assets(stream, fmt, **kwargs):
+    """Import a text stream in one of IMPORT_FORMATS; see AssetImporter."""
+    return AssetImporter(**kwargs).run(read_rows(stream, fmt))
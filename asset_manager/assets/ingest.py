@@ -0,0 +1,591 @@
+"""
+Log ingestion: syslog (RFC 3164 and 5424) and NDJSON lines from UDP, TCP
+or files, stored as LogEvents of the asset that sent them.
+
+Sources put ``(source ip, line, received at)`` items on one bounded queue
+and a single writer drains it: it resolves the source address to an asset
+through an in-memory index, parses the line with that asset's settings
+(the ``log_*`` keys of Asset.configuration, see LogSettings) and writes
+the events with bulk_create in batches.
+
+When the writer falls behind, the queue fills up. TCP and file readers
+then block, which pushes back on TCP senders through flow control; UDP
+cannot be slowed down, so datagrams that find the queue full are dropped
+and counted in IngestStats.dropped (and logged) rather than lost silently.
+"""
+import ipaddress
+import json
+import logging
+import queue
+import re
+import socket
+import socketserver
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .ipindex import VERSION_NAME as ADDRESSES_VERSION, get_ip_index
+from .models import Asset, LogEvent
+from .versions import bump_versions, get_version, versions_are_shared
+
+logger = logging.getLogger(__name__)
+
+SETTINGS_VERSION = 'asset-log-settings'
+
+FORMATS = ['auto', 'syslog', 'ndjson']
+
+SEVERITIES = {
+    'emerg': 0, 'emergency': 0, 'panic': 0,
+    'alert': 1,
+    'crit': 2, 'critical': 2, 'fatal': 2,
+    'err': 3, 'error': 3,
+    'warn': 4, 'warning': 4,
+    'notice': 5,
+    'info': 6, 'informational': 6,
+    'debug': 7, 'trace': 7,
+}
+
+MONTHS = {name: number for number, name in enumerate(
+    ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'], 1)}
+
+_PRI = re.compile(r'<(\d{1,3})>')
+# VERSION TIMESTAMP HOSTNAME APP-NAME PROCID MSGID STRUCTURED-DATA MSG
+_RFC5424 = re.compile(r'\d{1,2} (\S+) (\S+) (\S+) \S+ \S+ (?:-|(?:\[(?:[^\]\\]|\\.)*\])+) ?(.*)', re.S)
+# TIMESTAMP HOSTNAME TAG[PID]: MSG
+_RFC3164 = re.compile(r'([A-Z][a-z]{2}) ([ \d]\d) (\d\d):(\d\d):(\d\d) (\S+) (?:([^\s:\[]+)(?:\[[^\]]*\])?: ?)?(.*)', re.S)
+
+NDJSON_FIELDS = {
+    'message': ['message', 'msg'],
+    'severity': ['severity', 'level'],
+    'timestamp': ['timestamp', '@timestamp', 'time'],
+    'hostname': ['host', 'hostname'],
+    'app': ['app', 'program'],
+}
+
+# The configuration keys LogSettings reads
+SETTINGS_KEYS = [
+    'log_enabled', 'log_format', 'log_min_severity', 'log_exclude',
+    *(f'log_{name}_field' for name in NDJSON_FIELDS),
+]
+
+
+def severity_value(value):
+    """A syslog severity (0-7) from a number or a level name, or None."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value if 0 <= value <= 7 else None
+    if isinstance(value, str):
+        value = value.strip().lower()
+        if value.isdigit():
+            return severity_value(int(value))
+        return SEVERITIES.get(value)
+    return None
+
+
+def as_bool(value, default=True):
+    if isinstance(value, str):
+        return value.strip().lower() not in ('false', 'no', 'off', '0', '')
+    return default if value is None else bool(value)
+
+
+class LogSettings:
+    """
+    Parsing settings of one asset, from its configuration:
+
+    - ``log_enabled``: false to ignore the asset's logs
+    - ``log_format``: auto (the default), syslog or ndjson
+    - ``log_min_severity``: keep only events at least this severe (e.g. warning)
+    - ``log_exclude``: a regular expression, or a list of them; matching messages are dropped
+    - ``log_message_field``, ``log_severity_field``, ``log_timestamp_field``,
+      ``log_hostname_field``, ``log_app_field``: NDJSON field names, where
+      they differ from the usual ones
+    """
+
+    def __init__(self, configuration=None):
+        configuration = configuration if isinstance(configuration, dict) else {}
+        self.enabled = as_bool(configuration.get('log_enabled'))
+        log_format = configuration.get('log_format', 'auto')
+        self.format = log_format if log_format in FORMATS else 'auto'
+        self.min_severity = severity_value(configuration.get('log_min_severity'))
+        patterns = configuration.get('log_exclude') or []
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        compiled = []
+        for pattern in patterns:
+            try:
+                compiled.append(re.compile(str(pattern)))
+            except re.error:
+                logger.warning('Ignoring invalid log_exclude pattern %r', pattern)
+        self.exclude = compiled
+        self.fields = {
+            name: [configuration[f'log_{name}_field']] + names
+            if isinstance(configuration.get(f'log_{name}_field'), str) else names
+            for name, names in NDJSON_FIELDS.items()
+        }
+
+    def accepts(self, event):
+        if self.min_severity is not None and event.severity is not None and event.severity > self.min_severity:
+            return False
+        return not any(pattern.search(event.message) for pattern in self.exclude)
+
+
+DEFAULT_SETTINGS = LogSettings()
+
+
+class ParsedEvent:
+    __slots__ = ['timestamp', 'severity', 'facility', 'hostname', 'app', 'message', 'fields']
+
+    def __init__(self, message, timestamp=None, severity=None, facility=None, hostname='', app='', fields=None):
+        self.message = message
+        self.timestamp = timestamp
+        self.severity = severity
+        self.facility = facility
+        self.hostname = hostname
+        self.app = app
+        self.fields = fields or {}
+
+
+def aware(value):
+    if value is not None and timezone.is_naive(value) and settings.USE_TZ:
+        return timezone.make_aware(value)
+    return value
+
+
+def parse_timestamp(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return datetime.fromtimestamp(value / 1000 if value > 1e11 else value, tz=dt_timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            return None
+    if isinstance(value, str):
+        try:
+            return aware(parse_datetime(value))
+        except ValueError:
+            return None
+    return None
+
+
+def parse_syslog(line, now):
+    match = _PRI.match(line)
+    if match is None:
+        return ParsedEvent(line)
+    pri = int(match.group(1))
+    rest = line[match.end():]
+    severity, facility = (pri & 7, pri >> 3) if pri < 192 else (None, None)
+
+    match = _RFC5424.match(rest)
+    if match is not None:
+        timestamp, hostname, app, message = match.groups()
+        return ParsedEvent(
+            message.lstrip('\ufeff'),
+            timestamp=None if timestamp == '-' else parse_timestamp(timestamp),
+            severity=severity, facility=facility,
+            hostname='' if hostname == '-' else hostname,
+            app='' if app == '-' else app,
+        )
+    match = _RFC3164.match(rest)
+    if match is not None:
+        month, day, hour, minute, second, hostname, app, message = match.groups()
+        timestamp = None
+        if month in MONTHS:
+            try:
+                timestamp = aware(datetime(now.year, MONTHS[month], int(day), int(hour), int(minute), int(second)))
+                # No year in the header: a date far ahead is from last year
+                if (timestamp - now).days > 1:
+                    timestamp = timestamp.replace(year=now.year - 1)
+            except ValueError:
+                timestamp = None
+        return ParsedEvent(message, timestamp=timestamp, severity=severity, facility=facility,
+                           hostname=hostname, app=app or '')
+    return ParsedEvent(rest, severity=severity, facility=facility)
+
+
+def parse_ndjson(line, log_settings):
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    values = {}
+    for name, keys in log_settings.fields.items():
+        for key in keys:
+            if key in data:
+                values[name] = data.pop(key)
+                break
+    message = values.get('message')
+    return ParsedEvent(
+        message if isinstance(message, str) else json.dumps(message) if message is not None else '',
+        timestamp=parse_timestamp(values.get('timestamp')),
+        severity=severity_value(values.get('severity')),
+        hostname=str(values.get('hostname') or ''),
+        app=str(values.get('app') or ''),
+        fields=data,
+    )
+
+
+def parse_line(line, log_settings, now):
+    """A ParsedEvent, or None for a line that is not valid in the asset's format."""
+    log_format = log_settings.format
+    if log_format == 'ndjson' or (log_format == 'auto' and line.startswith('{')):
+        event = parse_ndjson(line, log_settings)
+        if event is not None or log_format == 'ndjson':
+            return event
+    return parse_syslog(line, now)
+
+
+class Target:
+    __slots__ = ['asset_id', 'settings']
+
+    def __init__(self, asset_id, log_settings):
+        self.asset_id = asset_id
+        self.settings = log_settings
+
+
+# Target of addresses shared by assets of several customers
+AMBIGUOUS = Target(None, DEFAULT_SETTINGS)
+
+_MISSING = object()
+
+
+class AssetResolver:
+    """
+    Source address -> asset and its LogSettings.
+
+    Addresses are looked up in the shared IP index (assets.ipindex); the
+    settings of the assets with ``log_*`` configuration keys are held here
+    and reloaded when the ``asset-log-settings`` version moves. Both are
+    checked at most every ``refresh_interval`` seconds.
+
+    Version bumps made by other processes only arrive through a shared
+    cache. With ``watch_database`` (the default when the cache is
+    per-process) the resolver also checks the assets' count and latest
+    ``updated_at``, and bumps both versions itself when they moved.
+    """
+
+    def __init__(self, customer_ids=None, refresh_interval=5, watch_database=None):
+        self.customer_ids = customer_ids
+        self.refresh_interval = refresh_interval
+        self.watch_database = not versions_are_shared() if watch_database is None else watch_database
+        self.assets_state = None
+        self.checked_at = 0
+        self.index = None
+        self.settings_version = None
+        self.settings = {}
+        self.lookups = {}
+
+    def load_settings(self):
+        # Not through the configuration index, which leaves out long values
+        # such as lists of exclude patterns
+        configured = Asset.objects.filter(configuration__has_any_keys=SETTINGS_KEYS)
+        self.settings = {
+            pk: LogSettings(configuration) for pk, configuration in configured.values_list('pk', 'configuration')
+        }
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.checked_at < self.refresh_interval:
+            return
+        self.checked_at = now
+        if self.watch_database:
+            # One aggregate over the updated_at index
+            state = Asset.objects.aggregate(count=Count('pk'), updated=Max('updated_at'))
+            if self.assets_state is not None and state != self.assets_state:
+                bump_versions([ADDRESSES_VERSION, SETTINGS_VERSION])
+            self.assets_state = state
+        # Already watched above, if needed
+        index = get_ip_index(watch_database=False)
+        settings_version = get_version(SETTINGS_VERSION)
+        if settings_version != self.settings_version:
+            self.load_settings()
+            self.settings_version = settings_version
+        elif index is self.index:
+            return
+        self.index = index
+        self.lookups = {}
+
+    def resolve(self, address):
+        try:
+            hits = self.index.lookup(address, self.customer_ids)
+        except ValueError:
+            return None
+        if not hits:
+            return None
+        if any(hit.customer_id != hits[0].customer_id for hit in hits):
+            return AMBIGUOUS
+        # Assets of one customer sharing an address: the oldest gets the logs
+        asset_id = min(hit.asset_id for hit in hits)
+        return Target(asset_id, self.settings.get(asset_id, DEFAULT_SETTINGS))
+
+    def get(self, address):
+        """The Target of ``address``, AMBIGUOUS, or None if no asset has it."""
+        target = self.lookups.get(address, _MISSING)
+        if target is _MISSING:
+            target = self.resolve(address)
+            if len(self.lookups) >= 100000:
+                self.lookups = {}
+            self.lookups[address] = target
+        return target
+
+
+EVENT_COLUMNS = ['asset_id', 'received_at', 'timestamp', 'severity', 'facility', 'hostname', 'app', 'message', 'fields']
+
+
+def write_events(rows):
+    """
+    Insert LogEvent rows given as tuples of EVENT_COLUMNS values, prepared
+    for the database. One executemany per batch: bulk_create's per-field
+    preparation would cost more than parsing the lines.
+    """
+    quote = connection.ops.quote_name
+    sql = (
+        f'INSERT INTO {quote(LogEvent._meta.db_table)} ({", ".join(map(quote, EVENT_COLUMNS))}) '
+        f'VALUES ({", ".join(["%s"] * len(EVENT_COLUMNS))})'
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+class IngestStats:
+    FIELDS = ['received', 'written', 'failed', 'dropped', 'unmatched', 'ambiguous', 'filtered', 'malformed']
+
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def __str__(self):
+        return ', '.join(f'{value} {field}' for field, value in self.as_dict().items())
+
+
+class Ingestor:
+    """
+    The writer side: ``submit`` lines from any thread, ``run`` (or
+    ``drain``) in the thread that owns the database connection.
+
+    A batch the database rejects (e.g. "database is locked") is retried
+    ``write_attempts`` times with a doubling delay; meanwhile the queue
+    fills and holds back the sources. A batch that still fails is logged
+    and counted as failed, and ingestion goes on.
+    """
+
+    def __init__(self, resolver=None, batch_size=None, flush_interval=1.0, queue_size=None,
+                 write_attempts=None, retry_delay=0.5):
+        self.resolver = resolver or AssetResolver()
+        self.batch_size = batch_size or getattr(settings, 'LOG_INGEST_BATCH_SIZE', 1000)
+        self.flush_interval = flush_interval
+        self.write_attempts = write_attempts or getattr(settings, 'LOG_INGEST_WRITE_ATTEMPTS', 5)
+        self.retry_delay = retry_delay
+        self.queue = queue.Queue(maxsize=queue_size or getattr(settings, 'LOG_INGEST_QUEUE_SIZE', 50000))
+        self.stats = IngestStats()
+        self.pending = []
+        self.flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._reported_drops = 0
+
+    def submit(self, source_ip, line, block=True):
+        """
+        Queue a line. With ``block`` this waits for room; otherwise a full
+        queue drops the line, counts it and returns False.
+        """
+        item = (source_ip, line, timezone.now())
+        try:
+            self.queue.put(item, block=block)
+        except queue.Full:
+            with self._lock:
+                self.stats.dropped += 1
+            return False
+        with self._lock:
+            self.stats.received += 1
+        return True
+
+    def handle(self, source_ip, line, received_at):
+        line = line.strip()
+        if not line:
+            return
+        target = self.resolver.get(source_ip) if source_ip else None
+        log_settings = target.settings if target is not None else DEFAULT_SETTINGS
+        event = parse_line(line, log_settings, received_at)
+        if event is None:
+            self.stats.malformed += 1
+            return
+        if target is None and not source_ip and event.hostname:
+            # File sources: the event names its host
+            target = self.resolver.get(event.hostname)
+            if target is not None and target.settings is not DEFAULT_SETTINGS:
+                event = parse_line(line, target.settings, received_at)
+                if event is None:
+                    self.stats.malformed += 1
+                    return
+        if target is None:
+            self.stats.unmatched += 1
+            return
+        if target is AMBIGUOUS:
+            self.stats.ambiguous += 1
+            return
+        if not target.settings.enabled or not target.settings.accepts(event):
+            self.stats.filtered += 1
+            return
+        adapt = connection.ops.adapt_datetimefield_value
+        self.pending.append((
+            target.asset_id, adapt(received_at), adapt(event.timestamp), event.severity, event.facility,
+            event.hostname[:255], event.app[:100], event.message, json.dumps(event.fields),
+        ))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def write_pending(self):
+        delay = self.retry_delay
+        for attempt in range(1, self.write_attempts + 1):
+            try:
+                write_events(self.pending)
+            except DatabaseError as e:
+                if attempt == self.write_attempts:
+                    logger.exception('Could not write %d log events', len(self.pending))
+                    self.stats.failed += len(self.pending)
+                    return
+                logger.warning('Writing %d log events failed (%s), retrying in %gs', len(self.pending), e, delay)
+                time.sleep(delay)
+                delay *= 2
+            else:
+                self.stats.written += len(self.pending)
+                return
+
+    def flush(self):
+        if self.pending:
+            self.write_pending()
+            self.pending = []
+        self.flushed_at = time.monotonic()
+        if self.stats.dropped > self._reported_drops:
+            logger.warning('Log queue full: %d UDP lines dropped so far', self.stats.dropped)
+            self._reported_drops = self.stats.dropped
+
+    def drain(self):
+        """Handle everything queued so far, then flush."""
+        self.resolver.refresh()
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self.handle(*item)
+        self.flush()
+
+    def run(self, stop):
+        """Handle queued lines until the ``stop`` event is set and the queue is empty."""
+        self.resolver.refresh(force=True)
+        while not (stop.is_set() and self.queue.empty()):
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+            if item is not None:
+                self.handle(*item)
+            if time.monotonic() - self.flushed_at >= self.flush_interval:
+                self.flush()
+                self.resolver.refresh()
+        self.flush()
+
+    def ingest(self, lines, source_ip=None):
+        """Handle ``lines`` synchronously, e.g. a file in a management command."""
+        self.resolver.refresh()
+        now = timezone.now()
+        for number, line in enumerate(lines):
+            if number % 10000 == 0:
+                now = timezone.now()
+            self.stats.received += 1
+            self.handle(source_ip, line, now)
+        self.flush()
+
+
+class UDPSource(threading.Thread):
+    """One datagram is one or more lines; lines that find the queue full are dropped."""
+
+    def __init__(self, ingestor, host='127.0.0.1', port=514):
+        super().__init__(daemon=True)
+        self.ingestor = ingestor
+        family = socket.AF_INET6 if ':' in host else socket.AF_INET
+        self.socket = socket.socket(family, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self.socket.bind((host, port))
+        self.address = self.socket.getsockname()
+
+    def run(self):
+        while True:
+            try:
+                data, (source_ip, *_) = self.socket.recvfrom(65535)
+            except OSError:
+                return  # Closed
+            for line in data.decode('utf-8', 'replace').splitlines():
+                self.ingestor.submit(source_ip, line, block=False)
+
+    def close(self):
+        self.socket.close()
+
+
+class _TCPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        source_ip = self.client_address[0]
+        for raw in self.rfile:
+            # Blocks while the queue is full, so the sender is slowed down
+            self.server.ingestor.submit(source_ip, raw.decode('utf-8', 'replace'))
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class TCPSource(threading.Thread):
+    """Newline-delimited lines over TCP, one thread per connection."""
+
+    def __init__(self, ingestor, host='127.0.0.1', port=514):
+        super().__init__(daemon=True)
+        _TCPServer.address_family = socket.AF_INET6 if ':' in host else socket.AF_INET
+        self.server = _TCPServer((host, port), _TCPHandler)
+        self.server.ingestor = ingestor
+        self.address = self.server.server_address
+
+    def run(self):
+        self.server.serve_forever(poll_interval=0.5)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FileSource(threading.Thread):
+    """The lines of a file, attributed to ``source_ip`` or else to the host each event names."""
+
+    def __init__(self, ingestor, path, source_ip=None):
+        super().__init__(daemon=True)
+        self.ingestor = ingestor
+        self.path = path
+        self.source_ip = source_ip
+
+    def run(self):
+        with open(self.path, encoding='utf-8', errors='replace') as lines:
+            for line in lines:
+                self.ingestor.submit(self.source_ip, line)
+
+    def close(self):
+        pass
+
+
+def parse_listen_address(value, default_port=514):
+    """``host:port``, ``[v6 host]:port`` or a bare port, as ``(host, port)``."""
+    host, _, port = value.rpartition(':')
+    if not host:
+        return '127.0.0.1', int(port or default_port)
+    host = host.strip('[]')
+    ipaddress.ip_address(host)
+    return host, int(port)
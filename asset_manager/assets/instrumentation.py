@@ -0,0 +1,241 @@
+"""
+Per-view request instrumentation: latency, number of SQL queries, time in
+SQL and time rendering templates, kept in in-process histograms.
+
+InstrumentationMiddleware measures a sample of requests
+(INSTRUMENTATION_SAMPLE_RATE) and counts all of them. Queries are counted
+with a ``connection.execute_wrapper`` around the request, so the cost is a
+``perf_counter()`` pair per query; template time is that of rendering the
+view's TemplateResponse. Streaming responses are measured up to the point
+the view returns them.
+
+Histograms have fixed buckets, so recording is a bisect and three
+increments under a lock, and memory stays constant however long the
+process runs. Each process keeps its own: ``/metrics`` (Prometheus text
+format) reports the process that answers it, which is what a scraper of
+several workers expects; the admin page at ``/performance/`` does the same.
+"""
+import random
+import threading
+from bisect import bisect_left
+from contextlib import ExitStack
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+
+# Upper bounds of the buckets (a last one catches the rest)
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+METRICS = {
+    # name: (buckets, help)
+    'request_seconds': (SECONDS_BUCKETS, 'Time to produce the response'),
+    'queries': (QUERY_BUCKETS, 'SQL queries per request'),
+    'sql_seconds': (SECONDS_BUCKETS, 'Time spent in SQL queries per request'),
+    'template_seconds': (SECONDS_BUCKETS, 'Time spent rendering templates per request'),
+}
+
+UNRESOLVED = '<unresolved>'
+
+
+class Histogram:
+    __slots__ = ['bounds', 'counts', 'sum', 'count']
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def copy(self):
+        histogram = Histogram(self.bounds)
+        histogram.counts = list(self.counts)
+        histogram.sum = self.sum
+        histogram.count = self.count
+        return histogram
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def quantile(self, q):
+        """
+        Estimate of the ``q`` quantile, interpolated within its bucket; the
+        largest bound if it falls in the last one. None if empty.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                low = self.bounds[i - 1] if i else 0
+                return low + (self.bounds[i] - low) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+
+class ViewStats:
+    __slots__ = ['requests', 'histograms']
+
+    def __init__(self):
+        self.requests = 0  # Sampled or not
+        self.histograms = {name: Histogram(buckets) for name, (buckets, _) in METRICS.items()}
+
+    def copy(self):
+        stats = ViewStats()
+        stats.requests = self.requests
+        stats.histograms = {name: histogram.copy() for name, histogram in self.histograms.items()}
+        return stats
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def _stats(self, view):
+        stats = self._views.get(view)
+        if stats is None:
+            stats = self._views[view] = ViewStats()
+        return stats
+
+    def count(self, view):
+        with self._lock:
+            self._stats(view).requests += 1
+
+    def record(self, view, **values):
+        """Count a request and observe its ``values`` (by METRICS name)."""
+        with self._lock:
+            stats = self._stats(view)
+            stats.requests += 1
+            for name, value in values.items():
+                stats.histograms[name].observe(value)
+
+    def snapshot(self):
+        """``{view: ViewStats}``, copied so that it can be read without the lock."""
+        with self._lock:
+            return {view: stats.copy() for view, stats in self._views.items()}
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+# Per process
+registry = Registry()
+
+
+class QueryTimer:
+    """An execute_wrapper counting queries and the time they take."""
+    __slots__ = ['count', 'seconds']
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += perf_counter() - started
+            self.count += 1
+
+
+class _Measurement:
+    __slots__ = ['template_seconds']
+
+    def __init__(self):
+        self.template_seconds = 0.0
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else UNRESOLVED
+
+
+class InstrumentationMiddleware:
+    """Place first in MIDDLEWARE so that the other middleware is measured too."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'INSTRUMENTATION_SAMPLE_RATE', 1.0)
+
+    def __call__(self, request):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            response = self.get_response(request)
+            registry.count(view_name(request))
+            return response
+
+        timer = QueryTimer()
+        request._instrumentation = measurement = _Measurement()
+        started = perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        registry.record(
+            view_name(request),
+            request_seconds=perf_counter() - started,
+            queries=timer.count,
+            sql_seconds=timer.seconds,
+            template_seconds=measurement.template_seconds,
+        )
+        return response
+
+    def process_template_response(self, request, response):
+        measurement = getattr(request, '_instrumentation', None)
+        if measurement is None:
+            return response
+        render = response.render
+
+        def timed_render():
+            started = perf_counter()
+            try:
+                return render()
+            finally:
+                measurement.template_seconds += perf_counter() - started
+
+        response.render = timed_render
+        return response
+
+
+def _label(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def prometheus_text(views, prefix='asset_manager'):
+    """``views`` ({view: ViewStats}) in the Prometheus text exposition format."""
+    lines = [
+        f'# HELP {prefix}_requests_total Requests handled, sampled or not',
+        f'# TYPE {prefix}_requests_total counter',
+    ]
+    for view, stats in sorted(views.items()):
+        lines.append(f'{prefix}_requests_total{{view="{_label(view)}"}} {stats.requests}')
+    for name, (buckets, help_text) in METRICS.items():
+        metric = f'{prefix}_{name}'
+        lines.append(f'# HELP {metric} {help_text} (sampled requests)')
+        lines.append(f'# TYPE {metric} histogram')
+        for view, stats in sorted(views.items()):
+            histogram = stats.histograms[name]
+            label = _label(view)
+            cumulative = 0
+            for bound, count in zip([*buckets, '+Inf'], histogram.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{view="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{view="{label}"}} {_number(histogram.sum)}')
+            lines.append(f'{metric}_count{{view="{label}"}} {histogram.count}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,61 @@
+import ipaddress
+import re
+
+# IPv4 addresses are stored in their IPv4-mapped IPv6 form so that both
+# families share one 128-bit key space.
+IPV4_MAPPED_PREFIX = 0xFFFF << 32
+
+_PARTIAL_IPV4 = re.compile(r'(\d{1,3})(\.\d{1,3}){0,2}\.?')
+
+
+def ip_to_int(address):
+    ip = ipaddress.ip_address(address)
+    if ip.version == 4:
+        return IPV4_MAPPED_PREFIX | int(ip)
+    return int(ip)
+
+
+def int_to_ip(number):
+    """The address ``ip_to_int`` maps to ``number``, as an IPv4 address where it is one."""
+    if number >> 32 == 0xFFFF:
+        return ipaddress.IPv4Address(number & 0xFFFFFFFF)
+    return ipaddress.IPv6Address(number)
+
+
+def ip_key(address):
+    """Fixed-width hex key for an address; sorts the same way the addresses do."""
+    return format(ip_to_int(address), '032x')
+
+
+def network_int_range(network):
+    low, high = int(network.network_address), int(network.broadcast_address)
+    if network.version == 4:
+        low, high = IPV4_MAPPED_PREFIX | low, IPV4_MAPPED_PREFIX | high
+    return low, high
+
+
+def network_key_range(network):
+    low, high = network_int_range(network)
+    return format(low, '032x'), format(high, '032x')
+
+
+def parse_ip_query(term):
+    """
+    Interpret a search term as an address, a CIDR block or a dotted IPv4
+    prefix ("10.20" or "10.20." meaning 10.20.0.0/16). Returns an
+    ``ip_network`` or None when the term is not an IP query.
+    """
+    term = term.strip()
+    if not term:
+        return None
+    try:
+        return ipaddress.ip_network(term, strict=False)
+    except ValueError:
+        pass
+    if '.' in term and _PARTIAL_IPV4.fullmatch(term):
+        octets = [int(part) for part in term.rstrip('.').split('.')]
+        if all(octet <= 255 for octet in octets):
+            prefix = len(octets) * 8
+            octets += [0] * (4 - len(octets))
+            return ipaddress.ip_network(f"{'.'.join(map(str, octets))}/{prefix}")
+    return None
@@ -0,0 +1,222 @@
+"""
+In-memory index of asset addresses.
+
+Addresses are held as integers in the 128-bit space of assets.ip.ip_to_int,
+in sorted arrays: one table of every asset and one per customer. IPv4
+addresses, nearly all of them in practice, take four bytes each in an
+``array``; IPv6 addresses are kept in a list of ints. Every lookup is a
+binary search, so exact, network and longest-prefix lookups take
+microseconds at a million addresses instead of a query each.
+
+The index is built from Asset.ip_key, read in key order so that nothing
+needs sorting, and get_ip_index rebuilds it lazily when the
+``asset-addresses`` version moves (see assets.signals). Bumps made by other
+processes only arrive through a shared cache; with a per-process one it
+also rebuilds when the assets' count or latest ``updated_at`` moved.
+"""
+import heapq
+import ipaddress
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from itertools import islice
+
+from django.db.models import Count, Max
+
+from .ip import IPV4_MAPPED_PREFIX, int_to_ip, ip_to_int, network_int_range
+from .models import Asset
+from .versions import get_version, versions_are_shared
+
+VERSION_NAME = 'asset-addresses'
+
+# Asset fields the index is built from
+INDEX_FIELDS = {'customer', 'ip_address'}
+
+V4_LOW = IPV4_MAPPED_PREFIX
+V4_HIGH = IPV4_MAPPED_PREFIX | 0xFFFFFFFF
+
+
+class Hit(namedtuple('Hit', ['key', 'asset_id', 'customer_id'])):
+    """An indexed asset; ``key`` is its address as ip_to_int gives it."""
+    __slots__ = ()
+
+    @property
+    def address(self):
+        return int_to_ip(self.key)
+
+
+class _Family:
+    """Sorted addresses of one family with the asset (and customer) of each."""
+    __slots__ = ['keys', 'offset', 'width', 'assets', 'customers', 'customer_id']
+
+    def __init__(self, v4, customer_id=None):
+        self.keys = array('I') if v4 else []
+        self.offset = V4_LOW if v4 else 0
+        self.width = 32 if v4 else 128
+        self.assets = array('q')
+        # The table of all assets records each customer; a customer's table
+        # has just the one
+        self.customers = array('q') if customer_id is None else None
+        self.customer_id = customer_id
+
+    def append(self, key, asset_id, customer_id):
+        self.keys.append(key - self.offset)
+        self.assets.append(asset_id)
+        if self.customers is not None:
+            self.customers.append(customer_id)
+
+    def hits(self, start, stop):
+        keys, assets, customers, offset = self.keys, self.assets, self.customers, self.offset
+        for i in range(start, stop):
+            yield Hit(keys[i] + offset, assets[i], customers[i] if customers is not None else self.customer_id)
+
+    def bounds(self, low, high):
+        """The slice of keys between ``low`` and ``high`` (inclusive, ip_to_int space)."""
+        return bisect_left(self.keys, low - self.offset), bisect_right(self.keys, high - self.offset)
+
+    def longest_prefix(self, key):
+        """The longest prefix ``key`` shares with an indexed address, in bits, or -1 if empty."""
+        keys = self.keys
+        key -= self.offset
+        position = bisect_left(keys, key)
+        best = -1
+        for i in (position - 1, position):
+            if 0 <= i < len(keys):
+                best = max(best, self.width - (keys[i] ^ key).bit_length())
+        return best
+
+
+class _Table:
+    __slots__ = ['v4', 'v6']
+
+    def __init__(self, customer_id=None):
+        self.v4 = _Family(True, customer_id)
+        self.v6 = _Family(False, customer_id)
+
+    def __len__(self):
+        return len(self.v4.keys) + len(self.v6.keys)
+
+    def append(self, key, asset_id, customer_id):
+        (self.v4 if V4_LOW <= key <= V4_HIGH else self.v6).append(key, asset_id, customer_id)
+
+    def range(self, low, high):
+        """Hits between ``low`` and ``high`` (inclusive), in address order."""
+        start, stop = self.v6.bounds(low, high)
+        middle = bisect_left(self.v6.keys, V4_LOW, start, stop)
+        yield from self.v6.hits(start, middle)
+        if low <= V4_HIGH and high >= V4_LOW:
+            yield from self.v4.hits(*self.v4.bounds(max(low, V4_LOW), min(high, V4_HIGH)))
+        yield from self.v6.hits(middle, stop)
+
+    def family(self, key):
+        return self.v4 if V4_LOW <= key <= V4_HIGH else self.v6
+
+
+def parse_address(address):
+    return address if isinstance(address, int) else ip_to_int(address)
+
+
+class IPIndex:
+    """
+    The addresses of assets, by customer. Addresses can be given as
+    strings, ``ipaddress`` objects or ip_to_int integers; lookups return
+    Hits in address order, limited to ``customer_ids`` when given.
+    """
+
+    def __init__(self, rows=()):
+        """``rows`` are ``(asset_id, customer_id, address key)`` in key order."""
+        self.all = _Table()
+        self.by_customer = {}
+        for asset_id, customer_id, key in rows:
+            self.add(asset_id, customer_id, key)
+
+    def add(self, asset_id, customer_id, key):
+        # Keys must come in order
+        self.all.append(key, asset_id, customer_id)
+        table = self.by_customer.get(customer_id)
+        if table is None:
+            table = self.by_customer[customer_id] = _Table(customer_id)
+        table.append(key, asset_id, customer_id)
+
+    @classmethod
+    def load(cls, customer_ids=None, chunk_size=10000):
+        """Build the index of ``customer_ids`` (default: all customers) from the database."""
+        assets = Asset.objects.exclude(ip_key='')
+        if customer_ids is not None:
+            assets = assets.filter(customer_id__in=customer_ids)
+        index = cls()
+        add = index.add
+        for asset_id, customer_id, key in (
+                assets.order_by('ip_key', 'pk').values_list('pk', 'customer_id', 'ip_key').iterator(chunk_size)):
+            add(asset_id, customer_id, int(key, 16))
+        return index
+
+    def __len__(self):
+        return len(self.all)
+
+    def tables(self, customer_ids):
+        if customer_ids is None:
+            return [self.all]
+        return [self.by_customer[customer_id] for customer_id in customer_ids if customer_id in self.by_customer]
+
+    def lookup(self, address, customer_ids=None):
+        """The assets at exactly ``address``. Raises ValueError if it is not an address."""
+        key = parse_address(address)
+        return self.in_range(key, key, customer_ids)
+
+    def in_range(self, low, high, customer_ids=None, limit=None):
+        """The assets with addresses from ``low`` to ``high``, inclusive."""
+        low, high = parse_address(low), parse_address(high)
+        tables = self.tables(customer_ids)
+        if len(tables) == 1:
+            hits = tables[0].range(low, high)
+        else:
+            hits = heapq.merge(*(table.range(low, high) for table in tables))
+        return list(islice(hits, limit))
+
+    def in_network(self, network, customer_ids=None, limit=None):
+        """The assets in ``network`` (an ``ip_network`` or CIDR string)."""
+        if isinstance(network, str):
+            network = ipaddress.ip_network(network, strict=False)
+        return self.in_range(*network_int_range(network), customer_ids=customer_ids, limit=limit)
+
+    def longest_prefix(self, address, customer_ids=None, limit=None):
+        """
+        The smallest network around ``address`` that holds indexed assets
+        of its family, and those assets, as ``(network, hits)``; the network
+        is the address itself on an exact match. ``(None, [])`` if there are
+        no assets of the family.
+        """
+        key = parse_address(address)
+        tables = self.tables(customer_ids)
+        prefix = max((table.family(key).longest_prefix(key) for table in tables), default=-1)
+        if prefix < 0:
+            return None, []
+        family = tables[0].family(key)
+        host_bits = family.width - prefix
+        low = key >> host_bits << host_bits
+        high = low | ((1 << host_bits) - 1)
+        network = ipaddress.ip_network((int_to_ip(low), prefix))
+        return network, self.in_range(low, high, customer_ids, limit)
+
+
+# (addresses version, assets state, IPIndex), per process
+_index = None
+
+
+def get_ip_index(watch_database=None):
+    """
+    The index of all assets, rebuilt if an address changed since it was
+    built. ``watch_database`` defaults to whether the cache is per-process.
+    """
+    global _index
+    if watch_database is None:
+        watch_database = not versions_are_shared()
+    version = get_version(VERSION_NAME)
+    state = _index[1] if _index is not None else None
+    if watch_database:
+        # One aggregate over the updated_at index
+        state = Asset.objects.aggregate(count=Count('pk'), updated=Max('updated_at'))
+    if _index is None or _index[:2] != (version, state):
+        _index = (version, state, IPIndex.load())
+    return _index[2]
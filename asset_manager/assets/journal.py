@@ -0,0 +1,459 @@
+"""
+Change journal: field-level diffs of saved and deleted assets, customers
+and user roles, with who made them.
+
+Receivers in assets.signals build JournalEntry rows and hand them over when
+the transaction commits, so that rolled back changes leave no trace. From
+there a background thread writes them in batches off a bounded queue,
+keeping the INSERT out of the request; when the queue is full the committing
+thread writes its entries itself rather than lose them. With JOURNAL_ASYNC
+off every batch is written by the committing thread.
+
+The journal is append-only and read by object or by customer over a time
+range (object_history, customer_history). compact() folds the old entries of
+each object into one snapshot of its state.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import groupby
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import DEFERRED, Count
+from django.utils import timezone
+
+from .models import Asset, Customer, JournalEntry, UserRole
+from .utils import chunked
+
+logger = logging.getLogger(__name__)
+
+# Journaled fields by model. Derived and poll-maintained fields (ip_key,
+# patch_due_at, last_checked, last_seen, timestamps) are left out, so polls
+# write nothing here.
+JOURNAL_FIELDS = {
+    Asset: [
+        'customer', 'name', 'asset_type', 'ip_address', 'status', 'business_criticality',
+        'monitoring_status', 'patch_cycle', 'last_patched', 'configuration',
+    ],
+    Customer: ['user', 'display_name', 'legal_name', 'contact_person'],
+    UserRole: ['user', 'role'],  # And 'customers', from m2m_changed
+}
+
+OBJECT_TYPES = {Asset: 'asset', Customer: 'customer', UserRole: 'userrole'}
+
+_attnames = {
+    model: {name: model._meta.get_field(name).attname for name in names}
+    for model, names in JOURNAL_FIELDS.items()
+}
+
+# The user whose request is making changes (see JournalActorMiddleware)
+_actor = ContextVar('journal_actor', default=None)
+
+
+class JournalActorMiddleware:
+    """Records ``request.user`` as the author of the changes a request makes."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # The lazy user: requests that change nothing do not load it for this
+        with acting_as(getattr(request, 'user', None)):
+            return self.get_response(request)
+
+
+@contextmanager
+def acting_as(user):
+    """Attribute changes made inside the block to ``user`` (e.g. in a command)."""
+    token = _actor.set(user)
+    try:
+        yield
+    finally:
+        _actor.reset(token)
+
+
+def make_entry(model, object_id, customer_id, action, changes):
+    actor = _actor.get()
+    if actor is not None and not actor.is_authenticated:
+        actor = None
+    return JournalEntry(
+        object_type=OBJECT_TYPES[model],
+        object_id=object_id,
+        customer_id=customer_id,
+        actor_id=actor.pk if actor else None,
+        actor_name=actor.get_username() if actor else '',
+        action=action,
+        changes=changes,
+        changed_at=timezone.now(),
+    )
+
+
+def customer_of(instance, values):
+    """The customer an entry about ``instance`` is filed under; ``values`` are its journaled ones."""
+    if isinstance(instance, Asset):
+        return values['customer_id'] if 'customer_id' in values else instance.customer_id
+    if isinstance(instance, Customer):
+        return instance.pk
+    return None
+
+
+def journaled_names(model, update_fields):
+    names = JOURNAL_FIELDS[model]
+    if update_fields is not None:
+        names = [name for name in names if name in update_fields]
+    return names
+
+
+def remember_values(instance, update_fields):
+    """
+    Before a save or delete: note the journaled values the row has in the
+    database, reading them only if the instance was not loaded with all of
+    them.
+    """
+    model = type(instance)
+    attnames = [_attnames[model][name] for name in journaled_names(model, update_fields)]
+    previous = None
+    if instance.pk is not None and attnames:
+        loaded = getattr(instance, '_loaded_values', None) or {}
+        previous = {attname: loaded.get(attname, DEFERRED) for attname in attnames}
+        if DEFERRED in previous.values():
+            previous = model._base_manager.filter(pk=instance.pk).values(*attnames).first()
+    instance._journal_previous = previous
+
+
+def diff(model, names, old, new):
+    """``{field: [old, new]}`` for the ``names`` whose values differ; ``old`` and ``new`` are by attname."""
+    changes = {}
+    for name in names:
+        attname = _attnames[model][name]
+        if attname in old and old[attname] != new[attname]:
+            changes[name] = [old[attname], new[attname]]
+    return changes
+
+
+def record_save(instance, created, update_fields):
+    model = type(instance)
+    names = journaled_names(model, update_fields)
+    if not names:
+        return
+    current = {_attnames[model][name]: getattr(instance, _attnames[model][name]) for name in names}
+    previous = None if created else getattr(instance, '_journal_previous', None)
+    if previous is None:
+        # Created, or saved with an explicit primary key
+        action = 'create'
+        changes = {name: [None, current[_attnames[model][name]]] for name in names}
+    else:
+        action = 'update'
+        changes = diff(model, names, previous, current)
+    if changes:
+        submit([make_entry(model, instance.pk, customer_of(instance, current), action, changes)])
+
+
+def record_delete(instance):
+    model = type(instance)
+    previous = getattr(instance, '_journal_previous', None) or {}
+    changes = {name: [previous[attname], None] for name, attname in _attnames[model].items() if attname in previous}
+    submit([make_entry(model, instance.pk, customer_of(instance, previous), 'delete', changes)])
+
+
+def record_bulk_save(assets, previous):
+    """After a bulk write (see assets.signals.assets_bulk_saved)."""
+    names = JOURNAL_FIELDS[Asset]
+    attnames = _attnames[Asset]
+    entries = []
+    for asset in assets:
+        current = {attname: getattr(asset, attname) for attname in attnames.values()}
+        old = previous.get(asset.pk)
+        if old is None:
+            entries.append(make_entry(
+                Asset, asset.pk, asset.customer_id, 'create', {name: [None, current[attnames[name]]] for name in names}
+            ))
+            continue
+        changes = diff(Asset, names, old, current)
+        if changes:
+            entries.append(make_entry(Asset, asset.pk, asset.customer_id, 'update', changes))
+    submit(entries)
+
+
+def record_bulk_create(instances):
+    """After a bulk_create, which sends no post_save: a create entry for each of ``instances`` (pks set)."""
+    entries = []
+    for instance in instances:
+        model = type(instance)
+        current = {attname: getattr(instance, attname) for attname in _attnames[model].values()}
+        changes = {name: [None, current[attname]] for name, attname in _attnames[model].items()}
+        entries.append(make_entry(model, instance.pk, customer_of(instance, current), 'create', changes))
+    submit(entries)
+
+
+def record_bulk_update(model, rows):
+    """
+    After a QuerySet.update(), which sends no post_save. ``rows`` are
+    ``(pk, customer_id, changes)``, with ``changes`` as in ``diff``.
+    """
+    submit([
+        make_entry(model, pk, customer_id, 'update', changes)
+        for pk, customer_id, changes in rows if changes
+    ])
+
+
+def role_customers(role_ids):
+    """``{role id: sorted customer ids}`` of ``role_ids``."""
+    customers = {role_id: [] for role_id in role_ids}
+    for chunk in chunked(role_ids):
+        rows = (
+            UserRole.customers.through.objects.filter(userrole_id__in=chunk)
+            .order_by('customer_id').values_list('userrole_id', 'customer_id')
+        )
+        for role_id, customer_id in rows:
+            customers[role_id].append(customer_id)
+    return customers
+
+
+def remember_role_customers(instance, role_ids):
+    """Before an M2M change: the customers of the roles it touches."""
+    instance._journal_role_customers = role_customers(role_ids)
+
+
+def record_role_customers(instance):
+    """After an M2M change: an entry for each role whose customers changed."""
+    previous = getattr(instance, '_journal_role_customers', None) or {}
+    entries = []
+    for role_id, customers in role_customers(list(previous)).items():
+        if customers != previous[role_id]:
+            entries.append(make_entry(UserRole, role_id, None, 'update', {'customers': [previous[role_id], customers]}))
+    submit(entries)
+
+
+def record_customer_unassigned(customer):
+    """
+    Before a customer is deleted: the cascade removes its M2M rows without
+    m2m_changed, so note that its roles lose it here.
+    """
+    role_ids = list(customer.userrole_set.values_list('pk', flat=True))
+    entries = []
+    for role_id, customers in role_customers(role_ids).items():
+        remaining = [customer_id for customer_id in customers if customer_id != customer.pk]
+        entries.append(make_entry(UserRole, role_id, None, 'update', {'customers': [customers, remaining]}))
+    submit(entries)
+
+
+def write_entries(entries):
+    JournalEntry.objects.bulk_create(entries, batch_size=getattr(settings, 'JOURNAL_BATCH_SIZE', 500))
+
+
+class JournalWriter:
+    """
+    Writes submitted entries in batches from a background thread, started on
+    first use. ``submit`` never blocks: entries that find the queue full are
+    written by the caller.
+    """
+
+    def __init__(self, batch_size=None, queue_size=None, flush_interval=None, write=write_entries):
+        self.batch_size = batch_size or getattr(settings, 'JOURNAL_BATCH_SIZE', 500)
+        self.flush_interval = flush_interval or getattr(settings, 'JOURNAL_FLUSH_INTERVAL', 0.5)
+        self.queue = queue.Queue(maxsize=queue_size or getattr(settings, 'JOURNAL_QUEUE_SIZE', 10000))
+        self.write = write
+        self.overflowed = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, entries):
+        overflow = []
+        for entry in entries:
+            try:
+                self.queue.put_nowait(entry)
+            except queue.Full:
+                overflow.append(entry)
+        self.start()
+        if overflow:
+            self.overflowed += len(overflow)
+            logger.warning('Journal queue full: writing %d entries in the caller', len(overflow))
+            self.write(overflow)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name='journal-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            if batch[0] is _STOP:
+                self.queue.task_done()
+                return
+            # Wait a little for more, so that bursts go out together
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            close_old_connections()
+            self.write_batch(batch)
+
+    def write_batch(self, batch):
+        try:
+            self.write(batch)
+        except Exception:
+            logger.exception('Could not write %d journal entries', len(batch))
+        finally:
+            for _ in batch:
+                self.queue.task_done()
+
+    def flush(self):
+        """Write whatever is queued and wait for the batch in progress."""
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self.write_batch(batch)
+        self.queue.join()
+
+    def stop(self):
+        """
+        Flush and end the thread, releasing its database connection (an
+        in-memory SQLite database lives as long as a connection to it).
+        The next ``submit`` starts a new one.
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        self.flush()
+        if thread is not None:
+            self.queue.put(_STOP)
+            thread.join()
+
+
+# Ends the writer thread when dequeued
+_STOP = object()
+
+# Per process
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = JournalWriter()
+        return _writer
+
+
+def submit(entries):
+    """Queue ``entries`` for writing once the current transaction commits."""
+    if not entries:
+        return
+
+    def hand_over():
+        if getattr(settings, 'JOURNAL_ASYNC', True):
+            get_writer().submit(entries)
+        else:
+            write_entries(entries)
+
+    # Robust: the change is committed, a failed entry must not fail the request
+    transaction.on_commit(hand_over, robust=True)
+
+
+def flush():
+    """Write everything submitted so far (e.g. before reading the journal back in a command)."""
+    if _writer is not None:
+        _writer.flush()
+
+
+def stop():
+    """Write everything submitted so far and end the writer thread."""
+    if _writer is not None:
+        _writer.stop()
+
+
+def object_history(model, object_id, start=None, end=None):
+    """The entries of one object, newest first, changed in ``[start, end)``."""
+    entries = JournalEntry.objects.filter(object_type=OBJECT_TYPES[model], object_id=object_id)
+    return between(entries, start, end)
+
+
+def customer_history(customer_id, start=None, end=None):
+    """The entries of a customer and its assets, newest first, changed in ``[start, end)``."""
+    return between(JournalEntry.objects.filter(customer_id=customer_id), start, end)
+
+
+def between(entries, start, end):
+    if start is not None:
+        entries = entries.filter(changed_at__gte=start)
+    if end is not None:
+        entries = entries.filter(changed_at__lt=end)
+    return entries
+
+
+def fold(entries):
+    """
+    The state of an object after ``entries`` (oldest first), as a snapshot's
+    ``{field: value}``, or None if the last of them deleted it.
+    """
+    state = {}
+    for entry in entries:
+        if entry.action == 'snapshot':
+            state = dict(entry.changes)
+        elif entry.action == 'delete':
+            state = None
+        else:
+            if state is None:  # The id was reused
+                state = {}
+            for field, (old, new) in entry.changes.items():
+                state[field] = new
+    return state
+
+
+def compact(before, chunk_size=1000):
+    """
+    Fold the entries older than ``before`` of each object that has more than
+    one into a single snapshot of its state at the last of them; of objects
+    deleted by then only the delete entry is kept. Returns the number of
+    objects compacted and the number of entries the journal shrank by.
+    """
+    old_entries = JournalEntry.objects.filter(changed_at__lt=before)
+    objects = (
+        old_entries.values('object_type', 'object_id').annotate(count=Count('pk')).filter(count__gt=1)
+        .order_by('object_type', 'object_id').values_list('object_type', 'object_id')
+    )
+    # Read up front: SQLite gives no isolation between the rows being
+    # iterated and the deletes below
+    objects = list(objects)
+    compacted = removed = 0
+    for object_type, group in groupby(objects, key=lambda row: row[0]):
+        for object_ids in chunked(object_id for _, object_id in group):
+            entries = old_entries.filter(object_type=object_type, object_id__in=object_ids).order_by(
+                'object_id', 'changed_at', 'id'
+            )
+            with transaction.atomic():
+                snapshots = []
+                obsolete = []
+                for object_id, history in groupby(entries, key=lambda entry: entry.object_id):
+                    history = list(history)
+                    last = history[-1]
+                    state = fold(history)
+                    if state is None:
+                        obsolete.extend(entry.pk for entry in history[:-1])
+                    else:
+                        obsolete.extend(entry.pk for entry in history)
+                        snapshots.append(JournalEntry(
+                            object_type=object_type, object_id=object_id, customer_id=last.customer_id,
+                            action='snapshot', changes=state, changed_at=last.changed_at,
+                        ))
+                    compacted += 1
+                for chunk in chunked(obsolete):
+                    removed += JournalEntry.objects.filter(pk__in=chunk).delete()[0]
+                JournalEntry.objects.bulk_create(snapshots)
+                removed -= len(snapshots)
+    return compacted, removed
@@ -0,0 +1,15 @@
+import time
+
+from django.core.management.base import BaseCommand
+from assets.config_index import rebuild_config_index
+
+class Command(BaseCommand):
+    help = 'Rebuilds the configuration key/value index (AssetConfigEntry) from Asset.configuration'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = rebuild_config_index(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} assets ({time.monotonic() - started:.1f}s)'))
@@ -0,0 +1,21 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from assets.journal import compact
+
+class Command(BaseCommand):
+    help = 'Folds change journal entries older than --days into one snapshot per object'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=getattr(settings, 'JOURNAL_COMPACT_AFTER_DAYS', 90),
+                            help='Compact entries older than this many days')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        compacted, removed = compact(timezone.now() - timedelta(days=options['days']))
+        self.stdout.write(self.style.SUCCESS(
+            f'Compacted {compacted} objects, {removed} fewer entries ({time.monotonic() - started:.1f}s)'
+        ))
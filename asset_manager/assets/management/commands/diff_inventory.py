@@ -0,0 +1,50 @@
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from assets.snapshots import diff_snapshots, open_snapshot, snapshot_at
+
+def parse_when(value):
+    when = parse_datetime(value)
+    if when is None:
+        date = parse_date(value)
+        if date is None:
+            raise CommandError(f'Not a date or datetime: {value}')
+        # The whole day counts
+        when = datetime.combine(date, time.max)
+    if timezone.is_naive(when):
+        when = timezone.make_aware(when)
+    return when
+
+class Command(BaseCommand):
+    help = "Shows how a customer's assets changed between the snapshots in effect on two dates"
+
+    def add_arguments(self, parser):
+        parser.add_argument('customer', type=int, help='Customer ID')
+        parser.add_argument('since', help='Date or ISO 8601 datetime of the earlier state')
+        parser.add_argument('until', nargs='?', help='Date or datetime of the later state (default: latest snapshot)')
+        parser.add_argument('--limit', type=int, default=50, help='Changed assets to list')
+
+    def handle(self, *args, **options):
+        customer_id = options['customer']
+        until = parse_when(options['until']) if options['until'] else timezone.now()
+        old = snapshot_at(customer_id, parse_when(options['since']))
+        new = snapshot_at(customer_id, until)
+        if old is None or new is None:
+            raise CommandError('No snapshot of this customer at or before that date')
+
+        with open_snapshot(old) as before, open_snapshot(new) as after:
+            diff = diff_snapshots(before, after)
+            self.stdout.write(
+                f'{old.taken_at:%Y-%m-%d %H:%M} ({old.asset_count} assets) -> '
+                f'{new.taken_at:%Y-%m-%d %H:%M} ({new.asset_count} assets): '
+                f'{len(diff.added)} added, {len(diff.removed)} removed, {len(diff.changed)} changed'
+            )
+            for asset_id in diff.added[:options['limit']]:
+                self.stdout.write(f'+ {asset_id} {after.get(asset_id)["name"]}')
+            for asset_id in diff.removed[:options['limit']]:
+                self.stdout.write(f'- {asset_id} {before.get(asset_id)["name"]}')
+            for asset_id, changes in list(diff.changed.items())[:options['limit']]:
+                fields = ', '.join(f'{field}: {old_value!r} -> {new_value!r}' for field, (old_value, new_value) in changes.items())
+                self.stdout.write(f'~ {asset_id} {fields}')
@@ -0,0 +1,49 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from assets.exporters import EXPORT_FORMATS, export_assets, parse_since
+from assets.models import Customer
+
+class Command(BaseCommand):
+    help = 'Exports assets as NDJSON, a JSON array or CSV without loading them all into memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customer', type=int, help='Only export this customer ID (default: all customers)')
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='ndjson')
+        parser.add_argument('--since', help='Only export assets changed after this ISO 8601 datetime')
+        parser.add_argument('--config', action='append', default=[], metavar='KEY=VALUE',
+                            help='Only export assets with this configuration value (repeatable)')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip')
+        parser.add_argument('--output', '-o', help='Output file (default: stdout)')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched per database round trip')
+
+    def handle(self, *args, **options):
+        customer_id = options['customer']
+        if customer_id is not None and not Customer.objects.filter(pk=customer_id).exists():
+            raise CommandError(f'Customer {customer_id} not found')
+        since = None
+        if options['since']:
+            try:
+                since = parse_since(options['since'])
+            except ValueError:
+                raise CommandError('--since must be an ISO 8601 datetime')
+
+        config = []
+        for pair in options['config']:
+            key, sep, value = pair.partition('=')
+            if not sep or not key.strip():
+                raise CommandError(f"--config must be KEY=VALUE, got '{pair}'")
+            config.append((key.strip(), value.strip()))
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for piece in export_assets(
+                customer_id, options['format'], since=since,
+                compress=options['gzip'], chunk_size=options['chunk_size'], config=config,
+            ):
+                output.write(piece)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+            else:
+                output.flush()
@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from assets.git_export import GitExporter, GitExportError
+
+class Command(BaseCommand):
+    help = 'Exports customers and assets to a git repository, committing only files that changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--remote', default=settings.GIT_EXPORT_REMOTE, help='Repository URL or path to push to')
+        parser.add_argument('--branch', default=settings.GIT_EXPORT_BRANCH)
+        parser.add_argument('--state-dir', default=settings.GIT_EXPORT_STATE_DIR,
+                            help='Where the local mirror and hash manifest are kept')
+        parser.add_argument('--customer', type=int, action='append', dest='customers',
+                            help='Only export this customer ID (repeatable)')
+        parser.add_argument('--message', '-m', help='Commit message')
+
+    def handle(self, *args, **options):
+        if not options['remote']:
+            raise CommandError('No remote configured, pass --remote or set GIT_EXPORT_REMOTE')
+
+        exporter = GitExporter(options['remote'], options['state_dir'], branch=options['branch'])
+        started = time.monotonic()
+        try:
+            result = exporter.export(customer_ids=options['customers'], message=options['message'])
+        except GitExportError as e:
+            raise CommandError(str(e))
+        elapsed = time.monotonic() - started
+
+        if result.changed:
+            summary = f'Committed {result.commit[:12]}: {result.written} written, {result.deleted} deleted'
+        else:
+            summary = 'Nothing changed'
+        self.stdout.write(self.style.SUCCESS(f'{summary}, {result.unchanged} unchanged ({elapsed:.1f}s)'))
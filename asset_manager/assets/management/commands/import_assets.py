@@ -0,0 +1,61 @@
+import csv
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from assets.importers import (
+    IMPORT_FORMATS, ImportFormatError, guess_format, import_assets, text_stream,
+)
+
+class Command(BaseCommand):
+    help = 'Imports assets from a CSV, JSON or NDJSON file, updating existing assets by (customer, name)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - for stdin')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='Input format (default: from the file extension)')
+        parser.add_argument('--customer', type=int, help='Customer ID for rows without a customer column')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--report', help='Write rejected rows and warnings to this CSV file instead of stderr')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or (None if path == '-' else guess_format(path))
+        if not fmt:
+            raise CommandError('Cannot tell the input format, pass --format')
+
+        report_file = open(options['report'], 'w', newline='') if options['report'] else None
+        if report_file:
+            report = csv.writer(report_file)
+            report.writerow(['row', 'errors', 'warnings'])
+            on_error = lambda number, messages: report.writerow([number, '; '.join(messages), ''])
+            on_warning = lambda number, messages: report.writerow([number, '', '; '.join(messages)])
+        else:
+            on_error = lambda number, messages: self.stderr.write(f'Row {number}: {"; ".join(messages)}')
+            on_warning = lambda number, messages: self.stderr.write(f'Row {number} (warning): {"; ".join(messages)}')
+
+        source = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        started = time.monotonic()
+        try:
+            result = import_assets(
+                text_stream(source), fmt,
+                default_customer_id=options['customer'],
+                batch_size=options['batch_size'],
+                on_error=on_error,
+                on_warning=on_warning,
+                max_errors=0,
+            )
+        except ImportFormatError as e:
+            raise CommandError(str(e))
+        finally:
+            if source is not sys.stdin.buffer:
+                source.close()
+            if report_file:
+                report_file.close()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Imported {result.imported} assets from {result.rows} rows in {elapsed:.1f}s '
+                f'({result.failed} rejected, {result.warned} with warnings)'
+            )
+        )
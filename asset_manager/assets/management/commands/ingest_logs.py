@@ -0,0 +1,76 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from assets.ingest import AssetResolver, FileSource, Ingestor, TCPSource, UDPSource, parse_listen_address
+
+class Command(BaseCommand):
+    help = 'Receives syslog and NDJSON lines over UDP/TCP or reads them from files, and stores them as log events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--udp', metavar='HOST:PORT', help='Listen for datagrams on this address')
+        parser.add_argument('--tcp', metavar='HOST:PORT', help='Accept newline-delimited streams on this address')
+        parser.add_argument('--file', action='append', dest='files', default=[],
+                            help='Read this file (repeatable); with only files, exit when they are read')
+        parser.add_argument('--source-ip',
+                            help='Asset address of the lines in --file (default: the host address each line names)')
+        parser.add_argument('--customer', type=int, action='append', dest='customers',
+                            help='Only assets of this customer ID (repeatable)')
+        parser.add_argument('--batch-size', type=int, help='Events per insert (default: LOG_INGEST_BATCH_SIZE)')
+        parser.add_argument('--queue-size', type=int, help='Lines buffered (default: LOG_INGEST_QUEUE_SIZE)')
+        parser.add_argument('--stats-interval', type=float, default=60,
+                            help='Seconds between progress lines while listening')
+
+    def handle(self, *args, **options):
+        if not (options['udp'] or options['tcp'] or options['files']):
+            raise CommandError('Give --udp, --tcp or --file')
+        ingestor = Ingestor(
+            resolver=AssetResolver(customer_ids=options['customers']),
+            batch_size=options['batch_size'],
+            queue_size=options['queue_size'],
+        )
+        if ingestor.resolver.watch_database:
+            self.stdout.write('The cache is per-process: following asset changes in the database instead')
+        try:
+            sources = []
+            if options['udp']:
+                sources.append(UDPSource(ingestor, *parse_listen_address(options['udp'])))
+            if options['tcp']:
+                sources.append(TCPSource(ingestor, *parse_listen_address(options['tcp'])))
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Cannot listen: {e}')
+        listening = bool(sources)
+        sources += [FileSource(ingestor, path, options['source_ip']) for path in options['files']]
+        for source in sources:
+            source.start()
+            if hasattr(source, 'address'):
+                self.stdout.write(f'Listening on {source.address[0]}:{source.address[1]} ({type(source).__name__[:3]})')
+
+        stop = threading.Event()
+        started = time.monotonic()
+        if not listening:
+            # Stop once every file is read and queued
+            def wait_for_files():
+                for source in sources:
+                    source.join()
+                stop.set()
+            threading.Thread(target=wait_for_files, daemon=True).start()
+        else:
+            def report():
+                while not stop.wait(options['stats_interval']):
+                    self.stdout.write(str(ingestor.stats))
+            threading.Thread(target=report, daemon=True).start()
+
+        interrupted = False
+        try:
+            ingestor.run(stop)
+        except KeyboardInterrupt:
+            interrupted = True
+        finally:
+            stop.set()
+            for source in sources:
+                source.close()
+        if interrupted:
+            ingestor.drain()
+        seconds = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Log lines: {ingestor.stats} ({seconds:.1f}s)'))
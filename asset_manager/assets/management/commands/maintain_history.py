@@ -0,0 +1,15 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from assets.history import maintain_history
+
+class Command(BaseCommand):
+    help = 'Downsamples finished hours of check history and prunes chunks past their retention'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        rolled_up, pruned = maintain_history(timezone.now())
+        self.stdout.write(self.style.SUCCESS(
+            f'Rolled up {rolled_up} raw chunks, pruned {pruned} chunks ({time.monotonic() - started:.1f}s)'
+        ))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from assets.history import maintain_history
+from assets.models import Asset
+from assets.poller import Poller, raise_open_file_limit
+
+class Command(BaseCommand):
+    help = 'Checks whether monitored assets are reachable and records last_checked/last_seen'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, action='append', dest='ports',
+                            help='TCP port to try (repeatable; default: ASSET_POLL_PORTS)')
+        parser.add_argument('--concurrency', type=int, help='Hosts probed at once')
+        parser.add_argument('--timeout', type=float, help='Seconds per host')
+        parser.add_argument('--customer', type=int, action='append', dest='customers',
+                            help='Only this customer ID (repeatable)')
+        parser.add_argument('--interval', type=float,
+                            help='Keep polling, starting a sweep every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        poller = Poller(ports=options['ports'], concurrency=options['concurrency'], timeout=options['timeout'])
+        # Every port of a host is tried at once
+        raise_open_file_limit(poller.concurrency * len(poller.ports) + 100)
+        queryset = Asset.objects.filter(monitoring_status=True, status=True)
+        if options['customers']:
+            queryset = queryset.filter(customer_id__in=options['customers'])
+
+        while True:
+            started = time.monotonic()
+            result = poller.run(queryset)
+            self.stdout.write(self.style.SUCCESS(
+                f'Checked {result.checked} assets: {result.seen} reachable, '
+                f'{result.unreachable} unreachable ({result.seconds:.1f}s)'
+            ))
+            maintain_history(timezone.now())
+            if options['interval'] is None:
+                return
+            time.sleep(max(0, options['interval'] - (time.monotonic() - started)))
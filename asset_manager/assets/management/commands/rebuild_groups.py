@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+from assets.grouping import rebuild_memberships
+
+class Command(BaseCommand):
+    help = 'Re-evaluates asset group rules for every asset and fixes up group memberships'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customer', type=int, action='append', dest='customers',
+                            help='Only this customer ID (repeatable)')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        rebuild_memberships(options['customers'])
+        self.stdout.write(self.style.SUCCESS(f'Group memberships rebuilt ({time.monotonic() - started:.1f}s)'))
@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+from assets.stats import rebuild_stats
+
+class Command(BaseCommand):
+    help = 'Recounts assets per customer, type, criticality and status and corrects CustomerAssetStats'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customer', type=int, action='append', dest='customers',
+                            help='Only this customer ID (repeatable)')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        corrected = rebuild_stats(options['customers'])
+        style = self.style.WARNING if corrected else self.style.SUCCESS
+        self.stdout.write(style(f'Corrected {corrected} stats cells ({time.monotonic() - started:.1f}s)'))
@@ -0,0 +1,100 @@
+import gc
+import json
+import platform
+import subprocess
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, teardown_databases
+from django.utils import timezone
+from assets.benchmarks import BENCHMARKS, run_benchmark
+from assets.journal import stop as stop_journal
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def numbers(results, prefix=''):
+    """``{dotted.key: value}`` of the numeric values in nested ``results``."""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(numbers(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+class Command(BaseCommand):
+    help = 'Runs benchmarks from assets.benchmarks against a throwaway database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help=f'Benchmarks to run (default: all of {", ".join(BENCHMARKS)})')
+        parser.add_argument('--assets', type=int, nargs='+',
+                            help="Numbers of assets to seed, each a run (default: each benchmark's own)")
+        parser.add_argument('--output', '-o', help='Also write the results to this JSON file')
+        parser.add_argument('--baseline', help='A previous --output file to compare the results with')
+        parser.add_argument('--threshold', type=float, default=10,
+                            help='Report changes from the baseline larger than this many percent (default: 10)')
+
+    def handle(self, *args, **options):
+        names = options['names'] or list(BENCHMARKS)
+        unknown = set(names) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(f'Unknown benchmarks: {", ".join(sorted(unknown))}')
+        sizes = options['assets'] or [None]
+
+        results = {}
+        for name in names:
+            for size in sizes:
+                key = f'{name}@{size}' if len(sizes) > 1 else name
+                # A fresh database per run so seeded data does not add up
+                old_config = setup_databases(verbosity=0, interactive=False)
+                try:
+                    results[key] = run_benchmark(name, **({'assets': size} if size else {}))
+                finally:
+                    # Journal entries the benchmark queued need its database,
+                    # and the writer's connection would keep it alive
+                    stop_journal()
+                    # ...as would its connection object until collected
+                    gc.collect()
+                    teardown_databases(old_config, verbosity=0)
+                self.stdout.write(f'{key}: {json.dumps(results[key])}')
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'commit': git_commit(),
+                    'recorded_at': timezone.now().isoformat(),
+                    'python': platform.python_version(),
+                    'results': results,
+                }, f, indent=2)
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['threshold'])
+
+    def compare(self, results, path, threshold):
+        with open(path) as f:
+            baseline = json.load(f)
+        # Files written before results were wrapped with their commit
+        previous = baseline.get('results', baseline)
+        self.stdout.write(f'Compared with {path} (commit {baseline.get("commit") or "unknown"}):')
+        changed = 0
+        for key in results:
+            if key not in previous:
+                continue
+            old_values = numbers(previous[key])
+            for metric, new in numbers(results[key]).items():
+                old = old_values.get(metric)
+                if old is None or old == new:
+                    continue
+                change = (new - old) / old * 100 if old else float('inf')
+                if abs(change) > threshold:
+                    changed += 1
+                    self.stdout.write(f'  {key}.{metric}: {old} -> {new} ({change:+.0f}%)')
+        if not changed:
+            self.stdout.write(f'  No change above {threshold:g}%')
@@ -0,0 +1,35 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from assets.benchmarks import seed_dataset
+
+
+class Command(BaseCommand):
+    help = ('Fills the database with a generated dataset (customers, assets, users with roles) '
+            'for load testing; run_benchmarks seeds its own throwaway database instead')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=100)
+        parser.add_argument('--assets', type=int, default=100000)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for reproducible datasets')
+        parser.add_argument('--prefix', default='bench', help='Prefix of the generated usernames')
+        parser.add_argument('--password', help='Password of the generated users (default: none can log in)')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}-').exists():
+            raise CommandError(f'Users named {prefix}-* already exist; choose another --prefix')
+
+        started = time.monotonic()
+        with transaction.atomic():
+            seed_dataset(
+                options['customers'], options['assets'], options['users'],
+                seed=options['seed'], prefix=prefix, password=options['password'],
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {options["customers"]} customers, {options["assets"]} assets and '
+            f'{options["users"]} users ({time.monotonic() - started:.1f}s)'
+        ))
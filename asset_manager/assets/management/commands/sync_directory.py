@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from assets.directory import DirectoryError, DirectorySync, get_directory
+
+class Command(BaseCommand):
+    help = 'Synchronizes users from an Entra ID or Google Workspace directory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help=f'One of: {", ".join(settings.DIRECTORY_SOURCES)}')
+        parser.add_argument('--full', action='store_true',
+                            help='Ignore the stored delta token and diff the full listing')
+        parser.add_argument('--base-url', help='Override the API base URL')
+        parser.add_argument('--token', help='Override the access token')
+
+    def handle(self, *args, **options):
+        try:
+            options_for_source = dict(settings.DIRECTORY_SOURCES[options['source']])
+        except KeyError:
+            raise CommandError(f"Unknown directory source '{options['source']}'")
+        provider = options_for_source.pop('provider')
+        role = options_for_source.pop('role', 'user')
+        for name in ('base_url', 'token'):
+            if options[name]:
+                options_for_source[name] = options[name]
+
+        started = time.monotonic()
+        try:
+            directory = get_directory(provider, **options_for_source)
+            result = DirectorySync(options['source'], directory, default_role=role).run(full=options['full'])
+        except DirectoryError as e:
+            raise CommandError(str(e))
+        elapsed = time.monotonic() - started
+
+        for external_id, message in result.errors:
+            self.stderr.write(f'{external_id}: {message}')
+        kind = 'Full' if result.full else 'Incremental'
+        self.stdout.write(self.style.SUCCESS(
+            f'{kind} sync: {result.created} created, {result.updated} updated, '
+            f'{result.disabled} disabled, {result.unchanged} unchanged ({elapsed:.1f}s)'
+        ))
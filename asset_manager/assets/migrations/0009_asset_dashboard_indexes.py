@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0008_userrole'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='userrole',
+            options={'permissions': [('can_manage_users', 'Can manage users'), ('can_view_users', 'Can view users list'), ('can_assign_customers', 'Can assign customers to users'), ('can_view_all_customers', 'Can view all customers')]},
+        ),
+        migrations.AddIndex(
+            model_name='asset',
+            index=models.Index(fields=['-last_checked', '-id'], name='asset_last_checked_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='asset',
+            index=models.Index(fields=['customer', '-last_checked', '-id'], name='asset_customer_checked_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='asset',
+            index=models.Index(fields=['asset_type', '-last_checked', '-id'], name='asset_type_checked_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='asset',
+            index=models.Index(fields=['business_criticality', '-last_checked', '-id'], name='asset_criticality_checked_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='asset',
+            index=models.Index(fields=['status', '-last_checked', '-id'], name='asset_status_checked_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='asset',
+            index=models.Index(fields=['name', 'id'], name='asset_name_idx'),
+        ),
+    ]
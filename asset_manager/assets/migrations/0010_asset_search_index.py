@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:52
+
+from django.db import migrations, models
+
+from assets.ip import ip_key
+from assets.search import install_search_index, remove_search_index
+
+
+def backfill_ip_keys(apps, schema_editor):
+    Asset = apps.get_model('assets', 'Asset')
+    batch = []
+    for asset in Asset.objects.only('pk', 'ip_address').iterator(chunk_size=2000):
+        asset.ip_key = ip_key(asset.ip_address)
+        batch.append(asset)
+        if len(batch) >= 2000:
+            Asset.objects.bulk_update(batch, ['ip_key'])
+            batch = []
+    Asset.objects.bulk_update(batch, ['ip_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0009_asset_dashboard_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asset',
+            name='ip_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=32),
+        ),
+        migrations.RunPython(backfill_ip_keys, migrations.RunPython.noop),
+        migrations.RunPython(install_search_index, remove_search_index),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0011_directory_sync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssetGroup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('match', models.CharField(choices=[('all', 'All rules'), ('any', 'Any rule')], default='all', max_length=3)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('assets', models.ManyToManyField(blank=True, related_name='groups', to='assets.asset')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='asset_groups', to='assets.customer')),
+            ],
+            options={
+                'ordering': ['name'],
+                'unique_together': {('customer', 'name')},
+            },
+        ),
+        migrations.CreateModel(
+            name='GroupRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(choices=[('asset_type', 'Asset type'), ('business_criticality', 'Business criticality'), ('ip_network', 'IP network (CIDR)'), ('name', 'Name pattern'), ('configuration', 'Configuration key')], max_length=30)),
+                ('value', models.CharField(help_text='Name patterns use * and ?; configuration rules are "key" or "key=value"', max_length=200)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rules', to='assets.assetgroup')),
+            ],
+        ),
+    ]
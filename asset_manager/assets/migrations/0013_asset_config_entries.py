@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from assets.config_index import config_pairs
+
+
+def backfill_config_entries(apps, schema_editor):
+    # Same as `manage.py backfill_config_index`, with the historical models
+    Asset = apps.get_model('assets', 'Asset')
+    AssetConfigEntry = apps.get_model('assets', 'AssetConfigEntry')
+    batch = []
+    for asset_id, configuration in Asset.objects.values_list('pk', 'configuration').iterator(chunk_size=2000):
+        batch += [
+            AssetConfigEntry(asset_id=asset_id, key=key, value=value)
+            for key, value in config_pairs(configuration)
+        ]
+        if len(batch) >= 2000:
+            AssetConfigEntry.objects.bulk_create(batch)
+            batch = []
+    AssetConfigEntry.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0012_asset_groups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssetConfigEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100)),
+                ('value', models.CharField(max_length=255)),
+                ('asset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='config_entries', to='assets.asset')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['key', 'value', 'asset'], name='asset_config_lookup_idx')],
+                'unique_together': {('asset', 'key')},
+            },
+        ),
+        migrations.RunPython(backfill_config_entries, migrations.RunPython.noop),
+    ]
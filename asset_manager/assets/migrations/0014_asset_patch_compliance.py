@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0013_asset_config_entries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asset',
+            name='last_patched',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Last Patched'),
+        ),
+        migrations.AddField(
+            model_name='asset',
+            name='patch_due_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='asset',
+            index=models.Index(fields=['status', 'customer', 'patch_due_at'], name='asset_patch_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='asset',
+            index=models.Index(fields=['status', 'patch_due_at'], name='asset_next_due_idx'),
+        ),
+    ]
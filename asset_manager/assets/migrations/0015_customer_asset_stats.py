@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def build_stats(apps, schema_editor):
+    # Same as `manage.py rebuild_stats` on an empty table, with the historical models
+    Asset = apps.get_model('assets', 'Asset')
+    CustomerAssetStats = apps.get_model('assets', 'CustomerAssetStats')
+    fields = ['customer_id', 'asset_type', 'business_criticality', 'status']
+    rows = Asset.objects.values(*fields).annotate(count=Count('pk')).order_by()
+    CustomerAssetStats.objects.bulk_create([CustomerAssetStats(**row) for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0014_asset_patch_compliance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerAssetStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('asset_type', models.CharField(choices=[('server', 'Server'), ('network', 'Network Device'), ('storage', 'Storage System')], max_length=50)),
+                ('business_criticality', models.CharField(choices=[('critical', 'Critical'), ('high', 'High'), ('normal', 'Normal'), ('low', 'Low'), ('test', 'Test')], max_length=20)),
+                ('status', models.BooleanField()),
+                ('count', models.IntegerField(default=0)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='asset_stats', to='assets.customer')),
+            ],
+            options={
+                'unique_together': {('customer', 'asset_type', 'business_criticality', 'status')},
+            },
+        ),
+        migrations.RunPython(build_stats, migrations.RunPython.noop),
+    ]
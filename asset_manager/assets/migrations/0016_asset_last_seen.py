@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:27
+
+import django.utils.timezone
+from django.db import migrations, models
+
+from assets.search import install_search_index
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0015_customer_asset_stats'),
+    ]
+
+    operations = [
+        # Reversed last, after the table was rebuilt once more
+        migrations.RunPython(migrations.RunPython.noop, install_search_index),
+        migrations.AddField(
+            model_name='asset',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='asset',
+            name='last_checked',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        # Dropping auto_now rebuilds the table on SQLite, which drops the
+        # search triggers
+        migrations.RunPython(install_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0016_asset_last_seen'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveIntegerField()),
+                ('start', models.BigIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('data', models.BinaryField(default=b'')),
+                ('rolled_up', models.BooleanField(default=False)),
+                ('asset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='check_chunks', to='assets.asset')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['resolution', 'rolled_up', 'start'], name='check_chunk_tier_idx')],
+                'unique_together': {('asset', 'resolution', 'start')},
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0017_check_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LogEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('received_at', models.DateTimeField()),
+                ('timestamp', models.DateTimeField(blank=True, null=True)),
+                ('severity', models.PositiveSmallIntegerField(blank=True, choices=[(0, 'Emergency'), (1, 'Alert'), (2, 'Critical'), (3, 'Error'), (4, 'Warning'), (5, 'Notice'), (6, 'Informational'), (7, 'Debug')], null=True)),
+                ('facility', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('hostname', models.CharField(blank=True, max_length=255)),
+                ('app', models.CharField(blank=True, max_length=100)),
+                ('message', models.TextField()),
+                ('fields', models.JSONField(blank=True, default=dict)),
+                ('asset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='log_events', to='assets.asset')),
+            ],
+            options={
+                'ordering': ['-received_at'],
+                'indexes': [models.Index(fields=['asset', '-received_at'], name='log_event_asset_idx')],
+            },
+        ),
+    ]
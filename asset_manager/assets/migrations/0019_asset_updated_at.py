@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:53
+
+import django.utils.timezone
+from django.db import migrations, models
+
+from assets.search import install_search_index
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0018_log_events'),
+    ]
+
+    operations = [
+        # Reversed last, after the table was rebuilt once more
+        migrations.RunPython(migrations.RunPython.noop, install_search_index),
+        migrations.AddField(
+            model_name='asset',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='asset',
+            index=models.Index(fields=['updated_at', 'id'], name='asset_updated_idx'),
+        ),
+        # Adding a column with a default rebuilds the table on SQLite, which
+        # drops the search triggers
+        migrations.RunPython(install_search_index, migrations.RunPython.noop),
+    ]
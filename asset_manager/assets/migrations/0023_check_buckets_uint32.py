@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:05
+
+import struct
+
+from django.db import migrations
+
+# Bucket layouts before and after: start, checks, up, min/mean/max latency
+UINT16_BUCKET = struct.Struct('<IHHfff')
+UINT32_BUCKET = struct.Struct('<IIIfff')
+
+
+def repack(apps, source, target, clamp=None):
+    CheckChunk = apps.get_model('assets', 'CheckChunk')
+    chunks = CheckChunk.objects.exclude(resolution=0).only('data')
+    batch = []
+    for chunk in chunks.iterator(chunk_size=2000):
+        buckets = source.iter_unpack(bytes(chunk.data))
+        if clamp:
+            buckets = ((start, min(checks, clamp), min(up, clamp), *latency) for start, checks, up, *latency in buckets)
+        chunk.data = b''.join(target.pack(*bucket) for bucket in buckets)
+        batch.append(chunk)
+        if len(batch) >= 2000:
+            CheckChunk.objects.bulk_update(batch, ['data'])
+            batch = []
+    CheckChunk.objects.bulk_update(batch, ['data'])
+
+
+def widen_counts(apps, schema_editor):
+    repack(apps, UINT16_BUCKET, UINT32_BUCKET)
+
+
+def narrow_counts(apps, schema_editor):
+    repack(apps, UINT32_BUCKET, UINT16_BUCKET, clamp=0xFFFF)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assets', '0022_asset_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(widen_counts, narrow_counts),
+    ]
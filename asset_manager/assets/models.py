@@ -1,12 +1,41 @@
+import ipaddress
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.contrib.auth.models import User, AbstractUser, Group, Permission
+from django.core.exceptions import ValidationError
 from django.core.validators import validate_ipv46_address
 from django.urls import reverse
-from django.db.models.signals import post_save
-from django.dispatch import receiver
 from django.utils import timezone
+from .ip import ip_key
+
+def patch_due(last_patched, patch_cycle):
+    if last_patched is None:
+        return None
+    return last_patched + timedelta(days=patch_cycle)
+
+class TracksLoadedValues(models.Model):
+    """
+    Keeps the values an instance was loaded or last saved with in
+    ``_loaded_values`` (by attname), so that post_save receivers can tell
+    what a save changed (see assets.stats and assets.journal).
+    """
+
+    class Meta:
+        abstract = True
 
-class Customer(models.Model):
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = {field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields}
+
+class Customer(TracksLoadedValues):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     display_name = models.CharField(max_length=100, default="Customer A")
     legal_name = models.CharField(max_length=200, default="A real big company")
@@ -20,7 +49,7 @@ class Customer(models.Model):
     class Meta:
         ordering = ['display_name']
 
-class Asset(models.Model):
+class Asset(TracksLoadedValues):
     ASSET_TYPES = (
         ('server', 'Server'),
         ('network', 'Network Device'),
@@ -47,8 +76,12 @@ class Asset(models.Model):
     name = models.CharField(max_length=200)
     asset_type = models.CharField(max_length=50, choices=ASSET_TYPES)
     ip_address = models.GenericIPAddressField()
+    ip_key = models.CharField(max_length=32, default='', editable=False, db_index=True)  # See assets.ip.ip_key
     monitoring_status = models.BooleanField(default=True)
-    last_checked = models.DateTimeField(auto_now=True)
+    # Set by assets.poller: when the asset was last probed (its creation
+    # until then) and when a probe last reached it
+    last_checked = models.DateTimeField(default=timezone.now, editable=False)
+    last_seen = models.DateTimeField(null=True, blank=True, editable=False)
     configuration = models.JSONField(default=dict)  # For log analysis settings
     status = models.BooleanField(default=True, verbose_name='Active')
     business_criticality = models.CharField(
@@ -61,13 +94,69 @@ class Asset(models.Model):
         default=30,
         verbose_name='Patch Cycle (days)'
     )
+    last_patched = models.DateTimeField(null=True, blank=True, verbose_name='Last Patched')
+    # last_patched + patch_cycle, kept by save() and assets.compliance; None
+    # (never patched) counts as overdue
+    patch_due_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Last change to the asset's own fields; polls only move last_checked and
+    # last_seen (see assets.api for how the two make up validators)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-last_checked']
         unique_together = ['customer', 'name']
+        # Match the dashboard filters and sort options (see AssetListView)
+        indexes = [
+            models.Index(fields=['-last_checked', '-id'], name='asset_last_checked_idx'),
+            models.Index(fields=['customer', '-last_checked', '-id'], name='asset_customer_checked_idx'),
+            models.Index(fields=['asset_type', '-last_checked', '-id'], name='asset_type_checked_idx'),
+            models.Index(fields=['business_criticality', '-last_checked', '-id'], name='asset_criticality_checked_idx'),
+            models.Index(fields=['status', '-last_checked', '-id'], name='asset_status_checked_idx'),
+            models.Index(fields=['name', 'id'], name='asset_name_idx'),
+            # Keyset pages order by (sort column, id): one index per equality
+            # filter and sort column, so no page needs a sort step. The unique
+            # constraint covers (customer, name)
+            models.Index(fields=['business_criticality', 'id'], name='asset_criticality_idx'),
+            models.Index(fields=['customer', 'business_criticality', 'id'], name='asset_customer_crit_idx'),
+            models.Index(fields=['asset_type', 'name', 'id'], name='asset_type_name_idx'),
+            models.Index(fields=['asset_type', 'business_criticality', 'id'], name='asset_type_crit_idx'),
+            models.Index(fields=['business_criticality', 'name', 'id'], name='asset_crit_name_idx'),
+            models.Index(fields=['status', 'name', 'id'], name='asset_status_name_idx'),
+            models.Index(fields=['status', 'business_criticality', 'id'], name='asset_status_crit_idx'),
+            # Per-customer compliance counts and the next due date (see assets.compliance)
+            models.Index(fields=['status', 'customer', 'patch_due_at'], name='asset_patch_due_idx'),
+            models.Index(fields=['status', 'patch_due_at'], name='asset_next_due_idx'),
+            # API clients fetching what changed since their last sync
+            models.Index(fields=['updated_at', 'id'], name='asset_updated_idx'),
+        ]
     
     def clean(self):
         validate_ipv46_address(self.ip_address)
+
+    @property
+    def reachable(self):
+        """Whether the last poll reached the asset; None before it was ever seen."""
+        if self.last_seen is None:
+            return None
+        return self.last_seen >= self.last_checked
+
+    @property
+    def patch_overdue(self):
+        return self.patch_due_at is None or self.patch_due_at <= timezone.now()
+
+    def save(self, *args, **kwargs):
+        self.ip_key = ip_key(self.ip_address)
+        self.patch_due_at = patch_due(self.last_patched, self.patch_cycle)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            derived = set()
+            if 'ip_address' in update_fields:
+                derived.add('ip_key')
+            if {'last_patched', 'patch_cycle'} & set(update_fields):
+                derived.add('patch_due_at')
+            if derived:
+                kwargs['update_fields'] = {*update_fields, *derived}
+        super().save(*args, **kwargs)
     
     def get_absolute_url(self):
         return reverse('asset-detail', kwargs={'pk': self.pk})
@@ -75,6 +164,205 @@ class Asset(models.Model):
     def __str__(self):
         return f"{self.name} ({self.get_asset_type_display()})"
 
+class CustomerAssetStats(models.Model):
+    """
+    Number of a customer's assets per type, criticality and status, kept up
+    to date by assets.stats so dashboards never count Asset rows.
+    """
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='asset_stats')
+    asset_type = models.CharField(max_length=50, choices=Asset.ASSET_TYPES)
+    business_criticality = models.CharField(max_length=20, choices=Asset.CRITICALITY_CHOICES)
+    status = models.BooleanField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['customer', 'asset_type', 'business_criticality', 'status']
+
+    def __str__(self):
+        return f"{self.customer_id} {self.asset_type}/{self.business_criticality}/{self.status}: {self.count}"
+
+class CheckChunk(models.Model):
+    """
+    Packed check history of one asset over one time span, at one resolution
+    (see assets.history for the layout, downsampling and retention).
+    """
+    asset = models.ForeignKey(Asset, on_delete=models.CASCADE, related_name='check_chunks')
+    resolution = models.PositiveIntegerField()  # Seconds per point; 0 for raw checks
+    start = models.BigIntegerField()  # Unix time
+    count = models.PositiveIntegerField(default=0)
+    data = models.BinaryField(default=b'')
+    rolled_up = models.BooleanField(default=False)  # Raw chunks already downsampled
+
+    class Meta:
+        unique_together = ['asset', 'resolution', 'start']
+        indexes = [
+            models.Index(fields=['resolution', 'rolled_up', 'start'], name='check_chunk_tier_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.asset_id}/{self.resolution}s@{self.start} ({self.count})"
+
+class LogEvent(models.Model):
+    """A log line received from an asset (see assets.ingest)."""
+    SEVERITY_CHOICES = [
+        (0, 'Emergency'),
+        (1, 'Alert'),
+        (2, 'Critical'),
+        (3, 'Error'),
+        (4, 'Warning'),
+        (5, 'Notice'),
+        (6, 'Informational'),
+        (7, 'Debug'),
+    ]
+
+    asset = models.ForeignKey(Asset, on_delete=models.CASCADE, related_name='log_events')
+    received_at = models.DateTimeField()
+    timestamp = models.DateTimeField(null=True, blank=True)  # As stated in the event
+    severity = models.PositiveSmallIntegerField(choices=SEVERITY_CHOICES, null=True, blank=True)
+    facility = models.PositiveSmallIntegerField(null=True, blank=True)
+    hostname = models.CharField(max_length=255, blank=True)
+    app = models.CharField(max_length=100, blank=True)
+    message = models.TextField()
+    fields = models.JSONField(default=dict, blank=True)  # Remaining NDJSON fields
+
+    class Meta:
+        ordering = ['-received_at']
+        indexes = [
+            models.Index(fields=['asset', '-received_at'], name='log_event_asset_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.asset_id} {self.received_at:%Y-%m-%d %H:%M:%S} {self.message[:50]}"
+
+class JournalEntry(models.Model):
+    """A change to an asset, customer or user role (see assets.journal)."""
+    ACTION_CHOICES = [
+        ('create', 'Created'),
+        ('update', 'Updated'),
+        ('delete', 'Deleted'),
+        ('snapshot', 'Snapshot'),  # Older entries compacted into one
+    ]
+
+    object_type = models.CharField(max_length=20)  # 'asset', 'customer' or 'userrole'
+    object_id = models.BigIntegerField()
+    # No constraints: the journal outlives what it records. The customer is
+    # the asset's, the customer itself, or None for user roles.
+    customer = models.ForeignKey(
+        Customer, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+'
+    )
+    actor = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+'
+    )
+    actor_name = models.CharField(max_length=150, blank=True)  # Username at the time
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    # {field: [old, new]}; a snapshot holds {field: value}
+    changes = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    changed_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-changed_at', '-id']
+        indexes = [
+            models.Index(fields=['object_type', 'object_id', '-changed_at', '-id'], name='journal_object_idx'),
+            models.Index(fields=['customer', '-changed_at', '-id'], name='journal_customer_idx'),
+            models.Index(fields=['changed_at'], name='journal_changed_idx'),
+        ]
+
+    @property
+    def field_changes(self):
+        """``(field, old, new)`` for display; a snapshot's values count as new."""
+        if self.action == 'snapshot':
+            return [(field, None, value) for field, value in self.changes.items()]
+        return [(field, old, new) for field, (old, new) in self.changes.items()]
+
+    def __str__(self):
+        return f"{self.object_type} {self.object_id} {self.action} {self.changed_at:%Y-%m-%d %H:%M:%S}"
+
+class InventorySnapshot(models.Model):
+    """A customer's assets at one point in time, in a columnar file (see assets.snapshots)."""
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='inventory_snapshots')
+    taken_at = models.DateTimeField()
+    path = models.CharField(max_length=255)  # Relative to INVENTORY_SNAPSHOT_DIR
+    asset_count = models.PositiveIntegerField()
+    size = models.PositiveBigIntegerField()  # Bytes
+
+    class Meta:
+        ordering = ['-taken_at']
+        unique_together = ['customer', 'taken_at']
+        indexes = [
+            models.Index(fields=['taken_at'], name='snapshot_taken_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.customer_id} {self.taken_at:%Y-%m-%d %H:%M:%S}"
+
+class AssetConfigEntry(models.Model):
+    """One key of Asset.configuration, indexed for filtering (see assets.config_index)."""
+    asset = models.ForeignKey(Asset, on_delete=models.CASCADE, related_name='config_entries')
+    key = models.CharField(max_length=100)
+    value = models.CharField(max_length=255)
+
+    class Meta:
+        unique_together = ['asset', 'key']
+        indexes = [
+            models.Index(fields=['key', 'value', 'asset'], name='asset_config_lookup_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key}={self.value}"
+
+class AssetGroup(models.Model):
+    MATCH_CHOICES = [
+        ('all', 'All rules'),
+        ('any', 'Any rule'),
+    ]
+
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='asset_groups')
+    name = models.CharField(max_length=100)
+    match = models.CharField(max_length=3, choices=MATCH_CHOICES, default='all')
+    # Maintained by assets.grouping from the rules; not edited directly
+    assets = models.ManyToManyField(Asset, blank=True, related_name='groups')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['name']
+        unique_together = ['customer', 'name']
+
+    def __str__(self):
+        return self.name
+
+class GroupRule(models.Model):
+    FIELD_CHOICES = [
+        ('asset_type', 'Asset type'),
+        ('business_criticality', 'Business criticality'),
+        ('ip_network', 'IP network (CIDR)'),
+        ('name', 'Name pattern'),
+        ('configuration', 'Configuration key'),
+    ]
+
+    group = models.ForeignKey(AssetGroup, on_delete=models.CASCADE, related_name='rules')
+    field = models.CharField(max_length=30, choices=FIELD_CHOICES)
+    value = models.CharField(
+        max_length=200,
+        help_text='Name patterns use * and ?; configuration rules are "key" or "key=value"',
+    )
+
+    def clean(self):
+        if self.field == 'asset_type' and self.value not in dict(Asset.ASSET_TYPES):
+            raise ValidationError({'value': f"'{self.value}' is not an asset type"})
+        if self.field == 'business_criticality' and self.value not in dict(Asset.CRITICALITY_CHOICES):
+            raise ValidationError({'value': f"'{self.value}' is not a criticality"})
+        if self.field == 'ip_network':
+            try:
+                ipaddress.ip_network(self.value, strict=False)
+            except ValueError:
+                raise ValidationError({'value': f"'{self.value}' is not an IP network"})
+        if self.field == 'configuration' and not self.value.split('=', 1)[0].strip():
+            raise ValidationError({'value': 'A configuration key is required'})
+
+    def __str__(self):
+        return f"{self.get_field_display()}: {self.value}"
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     # Add any additional fields you want for the user profile
@@ -84,7 +372,7 @@ class UserProfile(models.Model):
     def __str__(self):
         return f"{self.user.username}'s profile"
 
-class UserRole(models.Model):
+class UserRole(TracksLoadedValues):
     ROLE_CHOICES = [
         ('admin', 'Administrator'),
         ('manager', 'Manager'),
@@ -108,56 +396,24 @@ class UserRole(models.Model):
             ("can_view_all_customers", "Can view all customers"),  # Admin and Manager
         ]
 
-@receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
-    from .models import UserProfile
-    if created:
-        UserProfile.objects.create(user=instance)
-
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    try:
-        instance.userprofile.save()
-    except UserProfile.DoesNotExist:
-        UserProfile.objects.create(user=instance)
-
-@receiver(post_save, sender=User)
-def create_customer(sender, instance, created, **kwargs):
-    if created and not instance.is_staff:
-        Customer.objects.create(
-            user=instance,
-            display_name=f"Customer {instance.username}",  # Changed from 'name'
-            legal_name=f"Company {instance.username}",
-            contact_person=instance.get_full_name() or instance.username
-        )
-
-@receiver(post_save, sender=User)
-def save_customer(sender, instance, **kwargs):
-    try:
-        if not instance.is_staff and hasattr(instance, 'customer'):
-            instance.customer.save()
-    except Customer.DoesNotExist:
-        if not instance.is_staff:
-            Customer.objects.create(
-                user=instance,
-                display_name=f"Customer {instance.username}",
-                legal_name=f"Company {instance.username}",
-                contact_person=instance.get_full_name() or instance.username
-            )
-
-@receiver(post_save, sender=User)
-def create_user_role(sender, instance, created, **kwargs):
-    if created:
-        UserRole.objects.create(
-            user=instance,
-            role='user'
-        )
-
-@receiver(post_save, sender=User)
-def save_user_role(sender, instance, **kwargs):
-    try:
-        instance.userrole.save()
-    except UserRole.DoesNotExist:
-        UserRole.objects.create(user=instance, role='user')
+class DirectoryIdentity(models.Model):
+    """Links a local user to its entry in an external directory (see assets.directory)."""
+    source = models.CharField(max_length=50)
+    external_id = models.CharField(max_length=255)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='directory_identities')
+
+    class Meta:
+        unique_together = ['source', 'external_id']
+
+    def __str__(self):
+        return f"{self.source}:{self.external_id}"
+
+class DirectorySyncState(models.Model):
+    source = models.CharField(max_length=50, unique=True)
+    token = models.TextField(blank=True)  # Delta link or sync token of the last run
+    synced_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.source
 
 # Create your models here.
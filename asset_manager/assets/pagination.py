@@ -0,0 +1,124 @@
+import base64
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPage:
+    """A page of results fetched by seeking past a cursor instead of OFFSET."""
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Paginates a queryset ordered by a single column plus the primary key.
+
+    Each page is fetched with ``WHERE (col, pk) > (value, pk) ORDER BY col, pk
+    LIMIT n``, so the cost of a page does not depend on how deep it is.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.descending = ordering.startswith('-')
+        self.field_name = ordering.lstrip('-')
+        self.field = queryset.model._meta.get_field(self.field_name)
+        self.per_page = per_page
+
+    def encode_cursor(self, obj, backwards=False):
+        # Rows are model instances, or dicts from .values() that include the
+        # ordering column and 'pk'
+        if isinstance(obj, dict):
+            value, pk = obj[self.field_name], obj['pk']
+        else:
+            value, pk = getattr(obj, self.field.attname), obj.pk
+        # DjangoJSONEncoder cuts datetimes to milliseconds, and seeking past a
+        # rounded value skips the rows that share its millisecond
+        if isinstance(value, datetime.datetime):
+            value = value.isoformat(timespec='microseconds')
+        payload = {
+            'v': value,
+            'pk': pk,
+            'd': 'p' if backwards else 'n',
+        }
+        raw = json.dumps(payload, cls=DjangoJSONEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            value = self.field.to_python(payload['v'])
+            pk = int(payload['pk'])
+            backwards = payload['d'] == 'p'
+        except Exception:
+            raise InvalidCursor(cursor)
+        return value, pk, backwards
+
+    def _ordered(self, reverse):
+        descending = self.descending != reverse
+        prefix = '-' if descending else ''
+        return self.queryset.order_by(prefix + self.field_name, prefix + 'pk'), descending
+
+    def _seek(self, queryset, descending, value, pk):
+        # (col > value OR (col = value AND pk > pk)), led by the redundant
+        # col >= value so the database can seek to it in the index instead
+        # of scanning from the first row
+        op = 'lt' if descending else 'gt'
+        return queryset.filter(**{f'{self.field_name}__{op}e': value}).filter(
+            Q(**{f'{self.field_name}__{op}': value}) | Q(**{f'pk__{op}': pk})
+        )
+
+    def page(self, cursor=None):
+        if cursor:
+            value, pk, backwards = self.decode_cursor(cursor)
+        else:
+            value = pk = None
+            backwards = False
+
+        queryset, descending = self._ordered(reverse=backwards)
+        if pk is not None:
+            queryset = self._seek(queryset, descending, value, pk)
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if backwards:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, pk is not None
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_next:
+                next_cursor = self.encode_cursor(rows[-1])
+            if has_previous:
+                previous_cursor = self.encode_cursor(rows[0], backwards=True)
+        return KeysetPage(rows, self, next_cursor, previous_cursor)
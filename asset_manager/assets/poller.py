@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .fragments import invalidate_asset_rows
+from .history import record_checks
+from .models import Asset
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# The fields a poll writes
+POLL_FIELDS = ['last_checked', 'last_seen']
+
+
+class PollResult:
+    def __init__(self):
+        self.checked = 0
+        self.seen = 0
+        self.seconds = 0.0
+
+    @property
+    def unreachable(self):
+        return self.checked - self.seen
+
+
+def poll_ports(configuration, default, asset_id=None):
+    """
+    The "poll_ports" of an asset's configuration, else ``default``: a list
+    of ports, or one port, as ints or strings. The asset form stores strings,
+    several ports separated by spaces ("22 443"). Invalid ports are logged
+    and skipped.
+    """
+    values = configuration.get('poll_ports') if isinstance(configuration, dict) else None
+    if values is None:
+        return default
+    if isinstance(values, str):
+        values = values.split()
+    elif not isinstance(values, list):
+        values = [values]
+    ports = []
+    for value in values:
+        try:
+            port = int(value) if isinstance(value, (int, str)) and not isinstance(value, bool) else 0
+        except ValueError:
+            port = 0
+        if 0 < port < 65536:
+            ports.append(port)
+        else:
+            logger.warning('Ignoring invalid poll port %r of asset %s', value, asset_id)
+    return ports or default
+
+
+def raise_open_file_limit(needed):
+    """Raise the soft limit on open files towards ``needed`` (never above the hard limit)."""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY or soft >= needed:
+        return
+    resource.setrlimit(resource.RLIMIT_NOFILE, (needed if hard == resource.RLIM_INFINITY else min(needed, hard), hard))
+
+
+class Poller:
+    """
+    Checks whether monitored assets are reachable with TCP connects.
+
+    Assets are read in primary key order, ``chunk_size`` at a time, and each
+    chunk is probed on an asyncio event loop: at most ``concurrency`` hosts
+    at once, every port of a host in parallel, and ``timeout`` seconds per
+    host. An asset is seen when any connect succeeds. The results of a chunk
+    are written with one bulk_update per ``batch_size`` assets, and appended
+    to the check history (see assets.history), before the next chunk is
+    read, so the database is only used outside the event loop.
+
+    bulk_update sends no post_save: a poll never touches the fields that
+    search, groups, the configuration index or the stats are built from.
+    """
+
+    def __init__(self, ports=None, concurrency=None, timeout=None, chunk_size=5000, batch_size=1000):
+        self.ports = list(ports or getattr(settings, 'ASSET_POLL_PORTS', [22, 80, 443, 3389]))
+        self.concurrency = concurrency or getattr(settings, 'ASSET_POLL_CONCURRENCY', 500)
+        self.timeout = timeout or getattr(settings, 'ASSET_POLL_TIMEOUT', 3)
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+
+    async def connect(self, host, port):
+        _, writer = await asyncio.open_connection(host, port)
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+    async def probe(self, host, ports):
+        """
+        Milliseconds until a connect to any of ``ports`` succeeded, or None
+        if none did; the ports are tried at once.
+        """
+        started = time.perf_counter()
+        attempts = [asyncio.ensure_future(self.connect(host, port)) for port in ports]
+        try:
+            for attempt in asyncio.as_completed(attempts):
+                try:
+                    await attempt
+                except (OSError, ValueError):  # Refused, unreachable, or not an address
+                    continue
+                return (time.perf_counter() - started) * 1000
+            return None
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+            await asyncio.gather(*attempts, return_exceptions=True)
+
+    async def check_all(self, targets):
+        """``(pk, latency in ms or None, checked_at)`` for ``(pk, host, ports)`` targets."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def check(pk, host, ports):
+            async with semaphore:
+                try:
+                    latency = await asyncio.wait_for(self.probe(host, ports), self.timeout)
+                except asyncio.TimeoutError:
+                    latency = None
+                return pk, latency, timezone.now()
+
+        return await asyncio.gather(*(check(*target) for target in targets))
+
+    def run(self, queryset=None):
+        """Poll ``queryset`` (default: active assets with monitoring enabled)."""
+        if queryset is None:
+            queryset = Asset.objects.filter(monitoring_status=True, status=True)
+        queryset = queryset.order_by('pk').values_list('pk', 'ip_address', 'configuration', 'last_seen')
+        result = PollResult()
+        started = time.monotonic()
+        loop = asyncio.new_event_loop()
+        try:
+            last_pk = None
+            while True:
+                chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+                rows = list(chunk[:self.chunk_size])
+                if not rows:
+                    break
+                last_pk = rows[-1][0]
+                targets = [(pk, ip_address, poll_ports(configuration, self.ports, pk))
+                           for pk, ip_address, configuration, _ in rows]
+                checks = loop.run_until_complete(self.check_all(targets))
+                self.write(checks, {pk: last_seen for pk, _, _, last_seen in rows})
+                result.checked += len(checks)
+                result.seen += sum(1 for _, latency, _ in checks if latency is not None)
+        finally:
+            loop.close()
+        result.seconds = time.monotonic() - started
+        return result
+
+    def write(self, checks, last_seen):
+        assets = [
+            Asset(pk=pk, last_checked=checked_at, last_seen=last_seen[pk] if latency is None else checked_at)
+            for pk, latency, checked_at in checks
+        ]
+        Asset.objects.bulk_update(assets, POLL_FIELDS, batch_size=self.batch_size)
+        # The dashboard rows show the poll results
+        invalidate_asset_rows([asset.pk for asset in assets])
+        record_checks([(pk, checked_at, latency) for pk, latency, checked_at in checks])
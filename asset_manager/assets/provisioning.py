@@ -0,0 +1,83 @@
+from django.db import transaction
+
+from . import journal
+from .fragments import invalidate_customer_names
+from .models import Customer, UserProfile, UserRole
+from .scope import invalidate_scopes
+from .utils import chunked
+
+
+def default_customer(user):
+    return Customer(
+        user_id=user.pk,
+        display_name=f"Customer {user.username}",
+        legal_name=f"Company {user.username}",
+        contact_person=user.get_full_name() or user.username,
+    )
+
+
+def existing_user_ids(model, user_ids):
+    found = set()
+    for chunk in chunked(user_ids):
+        found.update(model.objects.filter(user_id__in=chunk).values_list('user_id', flat=True))
+    return found
+
+
+def created_rows(model, user_ids):
+    rows = []
+    for chunk in chunked(user_ids):
+        rows.extend(model.objects.filter(user_id__in=chunk))
+    return rows
+
+
+def provision_users(users, role='user', batch_size=1000):
+    """
+    Create the profile, role and (for non-staff users) the customer record
+    that every user needs.
+
+    Runs in one transaction with one INSERT per table for each batch of
+    users, whatever their number. Users that already have some of these rows
+    are skipped for those rows, so provisioning can be repeated safely (for
+    example by a directory sync). Roles and customers are journaled, so the
+    ones that did not exist yet are read back for their create entries.
+    """
+    users = [user for user in users if user.pk is not None]
+    if not users:
+        return
+    # Rows are built from user_id: with user= each unsaved row would be
+    # cached on the user's reverse relation, without the pk ignore_conflicts
+    # leaves unset (and in place of rows the user may already have loaded)
+    with transaction.atomic():
+        UserProfile.objects.bulk_create(
+            [UserProfile(user_id=user.pk) for user in users],
+            batch_size=batch_size, ignore_conflicts=True,
+        )
+        # ignore_conflicts leaves the pks unset, so the new rows are told
+        # apart from the users' existing ones and read back for the journal
+        user_ids = [user.pk for user in users]
+        existing = existing_user_ids(UserRole, user_ids)
+        new_ids = [user_id for user_id in user_ids if user_id not in existing]
+        if new_ids:
+            UserRole.objects.bulk_create(
+                [UserRole(user_id=user_id, role=role) for user_id in new_ids],
+                batch_size=batch_size, ignore_conflicts=True,
+            )
+            journal.record_bulk_create(created_rows(UserRole, new_ids))
+
+        user_ids = [user.pk for user in users if not user.is_staff]
+        existing = existing_user_ids(Customer, user_ids)
+        new_users = [user for user in users if not user.is_staff and user.pk not in existing]
+        if new_users:
+            Customer.objects.bulk_create(
+                [default_customer(user) for user in new_users],
+                batch_size=batch_size, ignore_conflicts=True,
+            )
+            journal.record_bulk_create(created_rows(Customer, [user.pk for user in new_users]))
+    # bulk_create does not send post_save, which is what normally clears them
+    invalidate_scopes([user.pk for user in users])
+    if new_users:
+        invalidate_customer_names()
+
+
+def provision_user(user, role='user'):
+    provision_users([user], role=role)
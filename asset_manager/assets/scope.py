@@ -0,0 +1,120 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.functional import SimpleLazyObject
+
+from .models import Customer, UserRole
+from .versions import versions_are_shared
+
+
+class TenantScope:
+    """A user's role and the set of customer IDs assigned to them."""
+
+    def __init__(self, role=None, customer_ids=()):
+        self.role = role
+        self.customer_ids = frozenset(customer_ids)
+
+    @property
+    def has_role(self):
+        return self.role is not None
+
+    @property
+    def is_admin(self):
+        return self.role == 'admin'
+
+    @property
+    def can_manage(self):
+        return self.role in ('admin', 'manager')
+
+    def assigned_customers(self):
+        return Customer.objects.filter(pk__in=self.customer_ids)
+
+    def visible_customers(self):
+        """The customers the user may list: all of them for admins and managers."""
+        if self.can_manage:
+            return Customer.objects.all()
+        return self.assigned_customers()
+
+    def restrict(self, queryset, field='customer'):
+        """Limit ``queryset`` to rows whose ``field`` is one of the user's customers."""
+        if self.is_admin:
+            return queryset
+        if not self.has_role:
+            return queryset.none()
+        return queryset.filter(**{f'{field}__in': self.customer_ids})
+
+    def __repr__(self):
+        return f'<TenantScope role={self.role!r} customers={sorted(self.customer_ids)}>'
+
+
+def scope_cache_key(user_id):
+    return f'tenant-scope:{user_id}'
+
+
+def _query_scope(user_id):
+    # One LEFT JOIN over the M2M: a row per assigned customer (or a single
+    # row with None when there are none)
+    rows = UserRole.objects.filter(user_id=user_id).values_list('role', 'customers')
+    role = None
+    customer_ids = set()
+    for role, customer_id in rows:
+        if customer_id is not None:
+            customer_ids.add(customer_id)
+    return role, sorted(customer_ids)
+
+
+def scope_cache_timeout():
+    if versions_are_shared():
+        return getattr(settings, 'TENANT_SCOPE_CACHE_TIMEOUT', 3600)
+    return getattr(settings, 'TENANT_SCOPE_LOCAL_CACHE_TIMEOUT', 5)
+
+
+def load_scope(user):
+    """
+    Build the scope for ``user``, from the shared cache when possible.
+
+    Cached entries are dropped by the receivers in assets.signals whenever
+    a UserRole or its customer assignments change. Those only reach other
+    processes through a shared cache; with a per-process one the entries
+    expire after TENANT_SCOPE_LOCAL_CACHE_TIMEOUT seconds instead, so a
+    change made by another worker or a management command shows up soon.
+    """
+    if not user.is_authenticated:
+        return TenantScope()
+    key = scope_cache_key(user.pk)
+    cached = cache.get(key)
+    if cached is None:
+        cached = _query_scope(user.pk)
+        cache.set(key, cached, scope_cache_timeout())
+    role, customer_ids = cached
+    return TenantScope(role, customer_ids)
+
+
+def invalidate_scopes(user_ids):
+    keys = [scope_cache_key(user_id) for user_id in user_ids]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    # A concurrent request may have cached the old rows before this
+    # transaction committed, so drop the keys again once it has
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_scope(request):
+    """The request user's scope, loaded at most once per request."""
+    try:
+        return request._tenant_scope
+    except AttributeError:
+        request._tenant_scope = load_scope(request.user)
+        return request._tenant_scope
+
+
+def tenant_scope(request):
+    """Template context processor exposing the scope as ``scope``."""
+    return {'scope': SimpleLazyObject(lambda: get_scope(request))}
+
+
+class TenantScopeMixin:
+    @property
+    def scope(self):
+        return get_scope(self.request)
@@ -0,0 +1,121 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .ip import network_key_range, parse_ip_query
+
+# SQLite keeps a trigram FTS5 index over Asset.name in sync with triggers.
+# Migrations that rebuild the assets_asset table on SQLite drop its
+# triggers, so they have to run install_search_index again afterwards.
+SQLITE_FTS_TABLE = 'assets_asset_fts'
+
+SQLITE_SEARCH_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} USING fts5(
+        name, content='assets_asset', content_rowid='id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_ai AFTER INSERT ON assets_asset BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, name) VALUES (new.id, new.name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_ad AFTER DELETE ON assets_asset BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, name) VALUES ('delete', old.id, old.name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_au AFTER UPDATE OF name ON assets_asset BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, name) VALUES (new.id, new.name);
+    END""",
+    f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')",
+]
+
+SQLITE_DROP_SQL = [
+    f'DROP TRIGGER IF EXISTS {SQLITE_FTS_TABLE}_ai',
+    f'DROP TRIGGER IF EXISTS {SQLITE_FTS_TABLE}_ad',
+    f'DROP TRIGGER IF EXISTS {SQLITE_FTS_TABLE}_au',
+    f'DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}',
+]
+
+# Django compiles icontains to UPPER(name) LIKE UPPER(%s) on PostgreSQL,
+# so the trigram index is built over the same expression.
+POSTGRES_SEARCH_SQL = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS asset_name_trgm_idx ON assets_asset USING gin (UPPER(name) gin_trgm_ops)',
+]
+
+POSTGRES_DROP_SQL = [
+    'DROP INDEX IF EXISTS asset_name_trgm_idx',
+]
+
+
+def _run(schema_editor, statements):
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def install_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        _run(schema_editor, SQLITE_SEARCH_SQL)
+    elif vendor == 'postgresql':
+        _run(schema_editor, POSTGRES_SEARCH_SQL)
+
+
+def remove_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        _run(schema_editor, SQLITE_DROP_SQL)
+    elif vendor == 'postgresql':
+        _run(schema_editor, POSTGRES_DROP_SQL)
+
+
+def _fts_phrase(term):
+    return '"%s"' % term.replace('"', '""')
+
+
+def filter_assets(queryset, term):
+    """
+    Restrict ``queryset`` to assets matching ``term`` without ranking it.
+
+    IP addresses, CIDR blocks and dotted prefixes are range scans over
+    ``Asset.ip_key``; anything else is a trigram match on the name.
+    """
+    term = term.strip()
+    network = parse_ip_query(term)
+    if network is not None:
+        return queryset.filter(ip_key__range=network_key_range(network))
+    if connection.vendor == 'sqlite' and len(term) >= 3:
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH %s',
+            [_fts_phrase(term)],
+        ))
+    if connection.vendor == 'postgresql':
+        return queryset.filter(name__icontains=term)
+    # Terms shorter than a trigram (or other backends): prefix match
+    return queryset.filter(name__istartswith=term)
+
+
+def search_assets(queryset, term, limit=None):
+    """
+    Return the best ``limit`` assets in ``queryset`` matching ``term``,
+    ordered by relevance. The result is sliced, so it cannot be filtered
+    further or used as a subquery.
+    """
+    term = term.strip()
+    limit = limit or getattr(settings, 'ASSET_SEARCH_LIMIT', 500)
+
+    if parse_ip_query(term) is not None:
+        return filter_assets(queryset, term).order_by('ip_key', 'pk')[:limit]
+    if connection.vendor == 'sqlite' and len(term) >= 3:
+        # FTS5's bm25 rank of each matching row, lower is better
+        queryset = filter_assets(queryset, term).annotate(search_rank=RawSQL(
+            f'SELECT rank FROM {SQLITE_FTS_TABLE} '
+            f'WHERE {SQLITE_FTS_TABLE} MATCH %s AND {SQLITE_FTS_TABLE}.rowid = assets_asset.id',
+            [_fts_phrase(term)],
+        ))
+        return queryset.order_by('search_rank', 'name', 'pk')[:limit]
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        queryset = filter_assets(queryset, term).annotate(
+            search_rank=TrigramSimilarity('name', term),
+        )
+        return queryset.order_by('-search_rank', 'name', 'pk')[:limit]
+    return filter_assets(queryset, term).order_by('name', 'pk')[:limit]
@@ -1,13 +1,212 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
 from django.contrib.auth.models import User
-from django.dispatch import receiver
-from .models import UserProfile
+from django.db.models import DEFERRED
+from django.db import transaction
+from django.dispatch import Signal, receiver
+from .models import Asset, AssetGroup, Customer, GroupRule, InventorySnapshot, UserRole
+from .compliance import COMPLIANCE_FIELDS, VERSION_NAME as COMPLIANCE_VERSION
+from .config_index import update_config_index
+from .fragments import invalidate_asset_rows, invalidate_customer_names
+from .grouping import MATCH_FIELDS, rules_changed, update_asset_groups
+from .ingest import SETTINGS_VERSION as LOG_SETTINGS_VERSION
+from .ipindex import INDEX_FIELDS, VERSION_NAME as ADDRESSES_VERSION
+from . import journal
+from .snapshots import delete_snapshot_file
+from .provisioning import provision_user
+from .scope import invalidate_scopes
+from .stats import STATS_FIELD_NAMES, record_bulk_save, record_delete, record_save, remember_previous
+from .versions import bump_version, bump_versions
 
-@receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
-    if created:
-        UserProfile.objects.create(user=instance)
+# Sent once per batch by bulk write paths (e.g. assets.importers) in place of
+# per-row post_save. ``assets`` is the list of saved Asset instances, with
+# their primary keys set; ``previous`` maps the primary key of every row that
+# existed before the write to a dict of its old field values.
+assets_bulk_saved = Signal()
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.userprofile.save()
\ No newline at end of file
+def provision_new_user(sender, instance, created, raw, **kwargs):
+    # Ordinary saves (profile edits, last_login updates) need nothing here
+    if created and not raw:
+        provision_user(instance)
+
+@receiver(post_save, sender=UserRole)
+@receiver(post_delete, sender=UserRole)
+def invalidate_user_role_scope(sender, instance, **kwargs):
+    invalidate_scopes([instance.user_id])
+
+@receiver(m2m_changed, sender=UserRole.customers.through)
+def invalidate_assigned_customer_scopes(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        invalidate_scopes([instance.user_id])
+    elif action == 'pre_clear':
+        invalidate_scopes(instance.userrole_set.values_list('user_id', flat=True))
+    else:
+        invalidate_scopes(UserRole.objects.filter(pk__in=pk_set).values_list('user_id', flat=True))
+
+@receiver(pre_delete, sender=Customer)
+def invalidate_deleted_customer_scopes(sender, instance, **kwargs):
+    # The cascade removes the M2M rows without sending m2m_changed
+    invalidate_scopes(instance.userrole_set.values_list('user_id', flat=True))
+
+@receiver(post_save, sender=Asset)
+def update_saved_asset_groups(sender, instance, created, raw, update_fields, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and not {'customer', *MATCH_FIELDS}.intersection(update_fields):
+        return  # e.g. a poll that only touched last_checked
+    update_asset_groups([instance], created=created)
+
+@receiver(post_save, sender=Asset)
+def update_saved_asset_config_index(sender, instance, created, raw, update_fields, **kwargs):
+    if raw or (update_fields is not None and 'configuration' not in update_fields):
+        return
+    update_config_index([instance], created=created)
+
+@receiver(assets_bulk_saved)
+def update_bulk_saved_asset_groups(sender, assets, **kwargs):
+    update_asset_groups(assets)
+
+@receiver(assets_bulk_saved)
+def update_bulk_saved_asset_config_index(sender, assets, **kwargs):
+    update_config_index(assets)
+
+@receiver(post_save, sender=GroupRule)
+@receiver(pre_delete, sender=GroupRule)
+def regroup_on_rule_change(sender, instance, **kwargs):
+    rules_changed(instance.group.customer_id)
+
+@receiver(post_save, sender=AssetGroup)
+def regroup_on_group_change(sender, instance, created, **kwargs):
+    if not created:
+        rules_changed(instance.customer_id)
+
+@receiver(post_save, sender=Asset)
+def invalidate_compliance_on_save(sender, instance, update_fields, **kwargs):
+    if update_fields is None or COMPLIANCE_FIELDS.intersection(update_fields):
+        bump_version(COMPLIANCE_VERSION)
+
+@receiver(post_delete, sender=Asset)
+@receiver(assets_bulk_saved)
+def invalidate_compliance(sender, **kwargs):
+    bump_version(COMPLIANCE_VERSION)
+
+@receiver(pre_save, sender=Asset)
+def remember_asset_stats_key(sender, instance, raw, update_fields, **kwargs):
+    if raw or (update_fields is not None and not STATS_FIELD_NAMES.intersection(update_fields)):
+        return
+    remember_previous(instance)
+
+@receiver(post_save, sender=Asset)
+def update_saved_asset_stats(sender, instance, created, raw, update_fields, **kwargs):
+    if raw or (update_fields is not None and not STATS_FIELD_NAMES.intersection(update_fields)):
+        return
+    record_save(instance, created)
+
+@receiver(pre_delete, sender=Asset)
+def remember_deleted_asset_stats_key(sender, instance, **kwargs):
+    remember_previous(instance)
+
+@receiver(post_delete, sender=Asset)
+def update_deleted_asset_stats(sender, instance, **kwargs):
+    record_delete(instance)
+
+@receiver(assets_bulk_saved)
+def update_bulk_saved_asset_stats(sender, assets, previous, **kwargs):
+    record_bulk_save(assets, previous)
+
+@receiver(post_save, sender=Asset)
+def invalidate_addresses_on_save(sender, instance, created, raw, update_fields, **kwargs):
+    if raw:
+        return
+    names = {*INDEX_FIELDS, 'configuration'}
+    if update_fields is not None:
+        names.intersection_update(update_fields)
+    # Asset.save() refreshes _loaded_values after the receivers ran
+    loaded = getattr(instance, '_loaded_values', None) or {}
+    attnames = {name: Asset._meta.get_field(name).attname for name in names}
+    changed = {
+        name for name, attname in attnames.items()
+        if created or loaded.get(attname, DEFERRED) != getattr(instance, attname)
+    }
+    versions = []
+    if INDEX_FIELDS & changed:
+        versions.append(ADDRESSES_VERSION)
+    if 'configuration' in changed:
+        versions.append(LOG_SETTINGS_VERSION)
+    bump_versions(versions)
+
+@receiver(post_delete, sender=Asset)
+def invalidate_addresses(sender, **kwargs):
+    bump_version(ADDRESSES_VERSION)
+
+@receiver(assets_bulk_saved)
+def invalidate_bulk_saved_addresses(sender, **kwargs):
+    bump_versions([ADDRESSES_VERSION, LOG_SETTINGS_VERSION])
+
+@receiver(post_save, sender=Asset)
+@receiver(post_delete, sender=Asset)
+def invalidate_asset_row(sender, instance, **kwargs):
+    invalidate_asset_rows([instance.pk])
+
+@receiver(assets_bulk_saved)
+def invalidate_bulk_saved_asset_rows(sender, assets, **kwargs):
+    invalidate_asset_rows([asset.pk for asset in assets])
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def invalidate_customer_fragments(sender, **kwargs):
+    invalidate_customer_names()
+
+@receiver(pre_save, sender=Asset)
+@receiver(pre_save, sender=Customer)
+@receiver(pre_save, sender=UserRole)
+def remember_journaled_values(sender, instance, raw, update_fields, **kwargs):
+    if not raw:
+        journal.remember_values(instance, update_fields)
+
+@receiver(post_save, sender=Asset)
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=UserRole)
+def journal_save(sender, instance, created, raw, update_fields, **kwargs):
+    if not raw:
+        journal.record_save(instance, created, update_fields)
+
+@receiver(pre_delete, sender=Asset)
+@receiver(pre_delete, sender=Customer)
+@receiver(pre_delete, sender=UserRole)
+def remember_deleted_journaled_values(sender, instance, **kwargs):
+    journal.remember_values(instance, None)
+
+@receiver(post_delete, sender=Asset)
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=UserRole)
+def journal_delete(sender, instance, **kwargs):
+    journal.record_delete(instance)
+
+@receiver(assets_bulk_saved)
+def journal_bulk_save(sender, assets, previous, **kwargs):
+    journal.record_bulk_save(assets, previous)
+
+@receiver(m2m_changed, sender=UserRole.customers.through)
+def journal_assigned_customers(sender, instance, action, reverse, pk_set, **kwargs):
+    if action.startswith('pre_'):
+        if not reverse:
+            role_ids = [instance.pk]
+        elif action == 'pre_clear':
+            role_ids = list(instance.userrole_set.values_list('pk', flat=True))
+        else:
+            role_ids = list(pk_set)
+        journal.remember_role_customers(instance, role_ids)
+    else:
+        journal.record_role_customers(instance)
+
+@receiver(pre_delete, sender=Customer)
+def journal_deleted_customer_assignments(sender, instance, **kwargs):
+    journal.record_customer_unassigned(instance)
+
+@receiver(post_delete, sender=InventorySnapshot)
+def delete_inventory_snapshot_file(sender, instance, **kwargs):
+    # After the commit: a rolled back delete must keep its file
+    transaction.on_commit(lambda: delete_snapshot_file(instance))
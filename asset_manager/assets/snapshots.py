@@ -0,0 +1,457 @@
+"""
+Point-in-time inventory snapshots: each customer's assets written to a
+columnar file, read back through ``mmap``.
+
+A file is a header and one section per column, each aligned to 8 bytes:
+
+- ``id``: asset ids, ascending (int64);
+- ``name``: UTF-8 names, concatenated, with ``name_offsets`` (uint32);
+- ``asset_type`` and ``business_criticality``: one byte each, coded through
+  the dictionaries in the header;
+- ``ipv4``: IPv4 addresses as uint32; the rows holding IPv6 addresses are
+  listed in ``ipv6_rows`` with their 16 bytes in ``ipv6``;
+- ``flags``: bit 0 ``status``, bit 1 ``monitoring_status``;
+- ``patch_cycle`` (uint32) and ``last_patched`` (int64 microseconds since
+  the epoch, NULL_TIME for none);
+- ``configuration``: canonical JSON of every row, zlib-compressed as one
+  stream, with ``configuration_offsets`` into the decompressed data;
+- ``configuration_hash`` and ``row_hash``: 64-bit digests of the
+  configuration and of the whole row.
+
+The header is ``MAGIC``, a uint32 length and JSON describing the sections.
+Columns are little-endian and, on little-endian hosts, used in place as
+``memoryview`` casts of the mapping, so opening a snapshot reads nothing
+but the header and diffing two compares ids and row hashes without
+decoding the rows that did not change.
+
+InventorySnapshot rows record the files (see ``take_snapshot``);
+``snapshot_at`` finds the one in effect on a date.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone as dt_timezone
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .ip import IPV4_MAPPED_PREFIX, int_to_ip
+from .models import Asset, InventorySnapshot
+
+MAGIC = b'ASNAP01\n'
+HEADER_LENGTH = struct.Struct('<I')
+ALIGNMENT = 8
+
+NULL_TIME = -2 ** 63
+
+STATUS = 1
+MONITORING = 2
+
+# In the order rows are read
+FIELDS = [
+    'id', 'name', 'asset_type', 'ip_address', 'status', 'monitoring_status',
+    'business_criticality', 'patch_cycle', 'last_patched', 'configuration',
+]
+
+# Dictionary-coded columns, with the values known up front
+CODED_FIELDS = {
+    'asset_type': [value for value, _ in Asset.ASSET_TYPES],
+    'business_criticality': [value for value, _ in Asset.CRITICALITY_CHOICES],
+}
+
+V4_LOW = IPV4_MAPPED_PREFIX
+V4_HIGH = IPV4_MAPPED_PREFIX | 0xFFFFFFFF
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def snapshot_dir():
+    return Path(getattr(settings, 'INVENTORY_SNAPSHOT_DIR', settings.BASE_DIR / 'snapshots'))
+
+
+def to_micros(value):
+    if value is None:
+        return NULL_TIME
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def from_micros(value):
+    if value == NULL_TIME:
+        return None
+    return datetime.fromtimestamp(value // 1000000, dt_timezone.utc).replace(microsecond=value % 1000000)
+
+
+def canonical_json(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def digest(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+
+class SnapshotWriter:
+    """Collects rows (in FIELDS order, ascending ids) and writes them as one file."""
+
+    def __init__(self):
+        self.ids = array('q')
+        self.names = bytearray()
+        self.name_offsets = array('I', [0])
+        self.dictionaries = {field: list(values) for field, values in CODED_FIELDS.items()}
+        self.codes = {field: {value: code for code, value in enumerate(values)} for field, values in CODED_FIELDS.items()}
+        self.coded = {field: array('B') for field in CODED_FIELDS}
+        self.ipv4 = array('I')
+        self.ipv6_rows = array('I')
+        self.ipv6 = bytearray()
+        self.flags = array('B')
+        self.patch_cycle = array('I')
+        self.last_patched = array('q')
+        self.compressor = zlib.compressobj(6)
+        self.configuration = bytearray()
+        self.configuration_offsets = array('I', [0])
+        self.configuration_hash = array('Q')
+        self.row_hash = array('Q')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def code(self, field, value):
+        codes = self.codes[field]
+        code = codes.get(value)
+        if code is None:
+            # A value outside the choices; 256 would need a wider column
+            if len(codes) == 256:
+                raise SnapshotError(f'Too many distinct values of {field}')
+            code = codes[value] = len(self.dictionaries[field])
+            self.dictionaries[field].append(value)
+        self.coded[field].append(code)
+
+    def add(self, asset_id, name, asset_type, ip_key, status, monitoring_status, business_criticality,
+            patch_cycle, last_patched, configuration):
+        """One asset, with its address as Asset.ip_key."""
+        if self.ids and asset_id <= self.ids[-1]:
+            raise SnapshotError('Rows must come in ascending id order')
+        row = len(self.ids)
+        self.ids.append(asset_id)
+        encoded_name = name.encode()
+        self.names += encoded_name
+        self.name_offsets.append(len(self.names))
+        self.code('asset_type', asset_type)
+        self.code('business_criticality', business_criticality)
+        key = int(ip_key, 16) if ip_key else 0
+        if V4_LOW <= key <= V4_HIGH:
+            self.ipv4.append(key - V4_LOW)
+        else:
+            self.ipv4.append(0)
+            self.ipv6_rows.append(row)
+            self.ipv6 += key.to_bytes(16, 'big')
+        flags = (STATUS if status else 0) | (MONITORING if monitoring_status else 0)
+        self.flags.append(flags)
+        self.patch_cycle.append(patch_cycle)
+        patched = to_micros(last_patched)
+        self.last_patched.append(patched)
+        config = canonical_json(configuration)
+        self.configuration += self.compressor.compress(config)
+        self.configuration_offsets.append(self.configuration_offsets[-1] + len(config))
+        config_hash = digest(config)
+        self.configuration_hash.append(config_hash)
+        self.row_hash.append(digest(b'\0'.join([
+            encoded_name, asset_type.encode(), ip_key.encode(), b'%d:%d:%d' % (flags, patch_cycle, patched),
+            business_criticality.encode(), config_hash.to_bytes(8, 'little'),
+        ])))
+
+    def sections(self):
+        self.configuration += self.compressor.flush()
+        sections = {
+            'id': self.ids,
+            'name_offsets': self.name_offsets,
+            'name': self.names,
+            'ipv4': self.ipv4,
+            'ipv6_rows': self.ipv6_rows,
+            'ipv6': self.ipv6,
+            'flags': self.flags,
+            'patch_cycle': self.patch_cycle,
+            'last_patched': self.last_patched,
+            'configuration_offsets': self.configuration_offsets,
+            'configuration': self.configuration,
+            'configuration_hash': self.configuration_hash,
+            'row_hash': self.row_hash,
+        }
+        sections.update(self.coded)
+        return sections
+
+    def write(self, path, **metadata):
+        """Write the file at ``path`` (replacing it atomically); returns its size."""
+        path = Path(path)
+        sections = self.sections()
+        columns = {}
+        offset = 0
+        for name, data in sections.items():
+            if isinstance(data, array) and sys.byteorder != 'little':
+                data = sections[name] = array(data.typecode, data)
+                data.byteswap()
+            length = len(data) * (data.itemsize if isinstance(data, array) else 1)
+            columns[name] = {'type': data.typecode if isinstance(data, array) else None, 'offset': offset, 'length': length}
+            offset += length + -length % ALIGNMENT
+        header = json.dumps({
+            'count': len(self.ids),
+            'dictionaries': self.dictionaries,
+            'columns': columns,
+            **metadata,
+        }).encode()
+        prefix = len(MAGIC) + HEADER_LENGTH.size + len(header)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_name(path.name + '.partial')
+        with open(partial, 'wb') as f:
+            f.write(MAGIC + HEADER_LENGTH.pack(len(header)) + header + bytes(-prefix % ALIGNMENT))
+            for name, data in sections.items():
+                f.write(data)
+                f.write(bytes(-columns[name]['length'] % ALIGNMENT))
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        os.replace(partial, path)
+        return size
+
+
+class Snapshot:
+    """
+    A snapshot file, memory-mapped. Columns are memoryviews into the mapping
+    and only valid until ``close()``; use it as a context manager.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # Empty file
+                raise SnapshotError(f'{self.path} is not an inventory snapshot')
+        self._view = memoryview(self._map)
+        self._columns = {}
+        self._configuration = None
+        try:
+            if bytes(self._view[:len(MAGIC)]) != MAGIC:
+                raise SnapshotError(f'{self.path} is not an inventory snapshot')
+            length, = HEADER_LENGTH.unpack_from(self._view, len(MAGIC))
+            start = len(MAGIC) + HEADER_LENGTH.size
+            self.header = json.loads(bytes(self._view[start:start + length]))
+        except Exception:
+            self.close()
+            raise
+        data_start = start + length
+        self._data_start = data_start + -data_start % ALIGNMENT
+        self.count = self.header['count']
+        self.dictionaries = self.header['dictionaries']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        for column in self._columns.values():
+            if isinstance(column, memoryview):
+                column.release()
+        self._columns.clear()
+        self._view.release()
+        self._map.close()
+
+    def column(self, name):
+        column = self._columns.get(name)
+        if column is None:
+            spec = self.header['columns'][name]
+            start = self._data_start + spec['offset']
+            column = self._view[start:start + spec['length']]
+            if spec['type'] is not None:
+                if sys.byteorder == 'little':
+                    column = column.cast(spec['type'])
+                else:
+                    column = array(spec['type'], column)
+                    column.byteswap()
+            self._columns[name] = column
+        return column
+
+    @property
+    def ids(self):
+        return self.column('id')
+
+    def index(self, asset_id):
+        """The row of ``asset_id``, or None."""
+        ids = self.ids
+        row = bisect_left(ids, asset_id)
+        return row if row < len(ids) and ids[row] == asset_id else None
+
+    def configuration_data(self):
+        if self._configuration is None:
+            self._configuration = zlib.decompress(self.column('configuration'))
+        return self._configuration
+
+    def value(self, row, field):
+        """One field of one row, decoded."""
+        if field == 'id':
+            return self.ids[row]
+        if field == 'name':
+            offsets = self.column('name_offsets')
+            return bytes(self.column('name')[offsets[row]:offsets[row + 1]]).decode()
+        if field in CODED_FIELDS:
+            return self.dictionaries[field][self.column(field)[row]]
+        if field == 'ip_address':
+            position = self._ipv6_position(row)
+            if position is None:
+                return str(int_to_ip(V4_LOW | self.column('ipv4')[row]))
+            return str(int_to_ip(int.from_bytes(self.column('ipv6')[position * 16:position * 16 + 16], 'big')))
+        if field == 'status':
+            return bool(self.column('flags')[row] & STATUS)
+        if field == 'monitoring_status':
+            return bool(self.column('flags')[row] & MONITORING)
+        if field == 'patch_cycle':
+            return self.column('patch_cycle')[row]
+        if field == 'last_patched':
+            return from_micros(self.column('last_patched')[row])
+        if field == 'configuration':
+            offsets = self.column('configuration_offsets')
+            return json.loads(self.configuration_data()[offsets[row]:offsets[row + 1]])
+        raise KeyError(field)
+
+    def _ipv6_position(self, row):
+        rows = self.column('ipv6_rows')
+        position = bisect_left(rows, row)
+        return position if position < len(rows) and rows[position] == row else None
+
+    def row(self, row):
+        return {field: self.value(row, field) for field in FIELDS}
+
+    def get(self, asset_id):
+        """The asset ``asset_id`` as a dict of FIELDS, or None if it was not in the snapshot."""
+        row = self.index(asset_id)
+        return None if row is None else self.row(row)
+
+    def rows(self):
+        for row in range(self.count):
+            yield self.row(row)
+
+
+class SnapshotDiff:
+    def __init__(self):
+        self.added = []  # Asset ids
+        self.removed = []
+        self.changed = {}  # {asset id: {field: (old, new)}}
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+
+def changed_fields(old, old_row, new, new_row):
+    changes = {}
+    for field in FIELDS[1:]:
+        if field == 'configuration':
+            if old.column('configuration_hash')[old_row] == new.column('configuration_hash')[new_row]:
+                continue
+        before, after = old.value(old_row, field), new.value(new_row, field)
+        if before != after:
+            changes[field] = (before, after)
+    return changes
+
+
+# Rows compared at a time by diff_snapshots before looking at single rows
+BLOCK = 4096
+
+
+def diff_snapshots(old, new):
+    """
+    What changed from Snapshot ``old`` to ``new``. Runs of rows with the
+    same ids and row hashes are skipped a block at a time; only rows whose
+    hash differs are decoded.
+    """
+    diff = SnapshotDiff()
+    old_ids, new_ids = old.ids, new.ids
+    old_hashes, new_hashes = old.column('row_hash'), new.column('row_hash')
+    i = j = 0
+    while i < len(old_ids) and j < len(new_ids):
+        size = min(BLOCK, len(old_ids) - i, len(new_ids) - j)
+        if old_ids[i:i + size] == new_ids[j:j + size] and old_hashes[i:i + size] == new_hashes[j:j + size]:
+            i += size
+            j += size
+            continue
+        # Step through the block row by row
+        stop_i, stop_j = i + size, j + size
+        while i < stop_i and j < stop_j:
+            old_id, new_id = old_ids[i], new_ids[j]
+            if old_id == new_id:
+                if old_hashes[i] != new_hashes[j]:
+                    diff.changed[old_id] = changed_fields(old, i, new, j)
+                i += 1
+                j += 1
+            elif old_id < new_id:
+                diff.removed.append(old_id)
+                i += 1
+            else:
+                diff.added.append(new_id)
+                j += 1
+    diff.removed.extend(islice(old_ids, i, None))
+    diff.added.extend(islice(new_ids, j, None))
+    return diff
+
+
+def snapshot_path(customer_id, taken_at):
+    return f'{customer_id}/{taken_at:%Y%m%dT%H%M%S%fZ}.snap'
+
+
+def take_snapshot(customer_id, taken_at=None, chunk_size=10000):
+    """Write the current assets of ``customer_id`` to a new snapshot and record it."""
+    taken_at = taken_at or timezone.now()
+    writer = SnapshotWriter()
+    columns = [
+        'pk', 'name', 'asset_type', 'ip_key', 'status', 'monitoring_status',
+        'business_criticality', 'patch_cycle', 'last_patched', 'configuration',
+    ]
+    # One transaction, so the rows are read as of one moment
+    with transaction.atomic():
+        rows = Asset.objects.filter(customer_id=customer_id).order_by('pk').values_list(*columns)
+        for row in rows.iterator(chunk_size):
+            writer.add(*row)
+    relative = snapshot_path(customer_id, taken_at.astimezone(dt_timezone.utc))
+    size = writer.write(snapshot_dir() / relative, customer_id=customer_id, taken_at=taken_at.isoformat())
+    return InventorySnapshot.objects.create(
+        customer_id=customer_id, taken_at=taken_at, path=relative, asset_count=len(writer), size=size,
+    )
+
+
+def snapshot_at(customer_id, when):
+    """The last InventorySnapshot of ``customer_id`` taken at or before ``when``, or None."""
+    return InventorySnapshot.objects.filter(customer_id=customer_id, taken_at__lte=when).order_by('-taken_at').first()
+
+
+def open_snapshot(snapshot):
+    return Snapshot(snapshot_dir() / snapshot.path)
+
+
+def delete_snapshot_file(snapshot):
+    try:
+        (snapshot_dir() / snapshot.path).unlink()
+    except FileNotFoundError:
+        pass
+
+
+def prune_snapshots(before):
+    """Delete the snapshots taken before ``before``; their files go with them (see assets.signals)."""
+    count, _ = InventorySnapshot.objects.filter(taken_at__lt=before).delete()
+    return count
@@ -0,0 +1,184 @@
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import DEFERRED, Count, F, Sum
+
+from .models import Asset, CustomerAssetStats
+from .utils import chunked
+
+# The dimensions of CustomerAssetStats, as Asset attnames
+STATS_FIELDS = ['customer_id', 'asset_type', 'business_criticality', 'status']
+
+# The same as model field names, for comparing with save(update_fields=...)
+STATS_FIELD_NAMES = {'customer', 'asset_type', 'business_criticality', 'status'}
+
+
+class AssetTotals:
+    """Asset counts of one customer, or of several added up, with breakdowns."""
+
+    def __init__(self):
+        self.total = 0
+        self.active = 0
+        self.by_type = Counter()
+        self.by_criticality = Counter()
+
+    def add(self, asset_type, business_criticality, status, count):
+        self.total += count
+        if status:
+            self.active += count
+        self.by_type[asset_type] += count
+        self.by_criticality[business_criticality] += count
+
+    @property
+    def inactive(self):
+        return self.total - self.active
+
+    @property
+    def types(self):
+        """``(value, label, count)`` for every asset type, in choice order."""
+        return [(value, label, self.by_type[value]) for value, label in Asset.ASSET_TYPES]
+
+    @property
+    def criticalities(self):
+        return [(value, label, self.by_criticality[value]) for value, label in Asset.CRITICALITY_CHOICES]
+
+
+def stats_key(asset):
+    return tuple(getattr(asset, field) for field in STATS_FIELDS)
+
+
+def loaded_key(asset):
+    """The key of ``asset`` as it was last loaded or saved, or None if unknown."""
+    loaded = getattr(asset, '_loaded_values', None)
+    if loaded is None:
+        return None
+    key = tuple(loaded.get(field, DEFERRED) for field in STATS_FIELDS)
+    return None if DEFERRED in key else key
+
+
+def apply_deltas(deltas):
+    """
+    Add ``{(customer_id, asset_type, business_criticality, status): delta}``
+    to the stats: one UPDATE per changed cell, plus an INSERT for cells that
+    do not exist yet. Increments are atomic, so concurrent writers do not
+    lose counts.
+    """
+    for key, delta in sorted(deltas.items()):
+        if not delta:
+            continue
+        cell = dict(zip(STATS_FIELDS, key))
+        rows = CustomerAssetStats.objects.filter(**cell)
+        if rows.update(count=F('count') + delta) or delta < 0:
+            # A decrement without a cell means the stats were never built
+            # (or the customer is being deleted); rebuild_stats fixes the former
+            continue
+        try:
+            with transaction.atomic():
+                CustomerAssetStats.objects.create(count=delta, **cell)
+        except IntegrityError:
+            rows.update(count=F('count') + delta)  # Created concurrently
+
+
+def remember_previous(asset):
+    """
+    Before a save or delete: note the key the row has in the database,
+    reading it only if the instance was not loaded with all of STATS_FIELDS.
+    """
+    key = loaded_key(asset)
+    if key is None and asset.pk is not None:
+        row = Asset.objects.filter(pk=asset.pk).values_list(*STATS_FIELDS).first()
+        key = tuple(row) if row else None
+    asset._stats_previous = key
+
+
+def record_save(asset, created):
+    previous = None if created else getattr(asset, '_stats_previous', None)
+    current = stats_key(asset)
+    if previous != current:
+        deltas = {current: 1}
+        if previous is not None:
+            deltas[previous] = -1
+        apply_deltas(deltas)
+
+
+def record_delete(asset):
+    previous = getattr(asset, '_stats_previous', None)
+    if previous is not None:
+        apply_deltas({previous: -1})
+
+
+def record_bulk_save(assets, previous):
+    """
+    After a bulk write: ``previous`` maps the primary key of every row that
+    existed before it to its old values (see assets.signals.assets_bulk_saved).
+    """
+    deltas = Counter()
+    for asset in assets:
+        deltas[stats_key(asset)] += 1
+        old = previous.get(asset.pk)
+        if old is not None:
+            deltas[tuple(old[field] for field in STATS_FIELDS)] -= 1
+    apply_deltas(deltas)
+
+
+def rebuild_stats(customer_ids=None):
+    """
+    Recount the assets of ``customer_ids`` (default: all customers) and
+    correct the cells that drifted. Returns the number of cells corrected.
+    """
+    assets = Asset.objects.all()
+    cells = CustomerAssetStats.objects.all()
+    if customer_ids is not None:
+        assets = assets.filter(customer_id__in=customer_ids)
+        cells = cells.filter(customer_id__in=customer_ids)
+    with transaction.atomic():
+        actual = {
+            tuple(row[:-1]): row[-1]
+            for row in assets.values(*STATS_FIELDS).annotate(count=Count('pk')).order_by()
+            .values_list(*STATS_FIELDS, 'count')
+        }
+        stored = {
+            tuple(row[1:-1]): (row[0], row[-1])
+            for row in cells.values_list('pk', *STATS_FIELDS, 'count')
+        }
+        to_create = []
+        to_update = []
+        for key, count in actual.items():
+            if key not in stored:
+                to_create.append(CustomerAssetStats(count=count, **dict(zip(STATS_FIELDS, key))))
+            elif stored[key][1] != count:
+                to_update.append(CustomerAssetStats(pk=stored[key][0], count=count))
+        stale = {pk: count for key, (pk, count) in stored.items() if key not in actual}
+        CustomerAssetStats.objects.bulk_create(to_create, batch_size=1000)
+        CustomerAssetStats.objects.bulk_update(to_update, ['count'], batch_size=1000)
+        for chunk in chunked(stale):
+            CustomerAssetStats.objects.filter(pk__in=chunk).delete()
+    # Cells left at zero by deletes are dropped but were not wrong
+    return len(to_create) + len(to_update) + sum(1 for count in stale.values() if count)
+
+
+def customer_totals(customer_ids=None):
+    """``{customer_id: AssetTotals}`` from the stats, one row per non-empty cell."""
+    cells = CustomerAssetStats.objects.filter(count__gt=0)
+    if customer_ids is not None:
+        cells = cells.filter(customer_id__in=customer_ids)
+    totals = {}
+    for customer_id, *cell in cells.values_list(*STATS_FIELDS, 'count'):
+        totals.setdefault(customer_id, AssetTotals()).add(*cell)
+    return totals
+
+
+def asset_totals(customer_ids=None):
+    """The AssetTotals of ``customer_ids`` (default: all customers) added up in the database."""
+    cells = CustomerAssetStats.objects.filter(count__gt=0)
+    if customer_ids is not None:
+        cells = cells.filter(customer_id__in=customer_ids)
+    totals = AssetTotals()
+    rows = (
+        cells.values('asset_type', 'business_criticality', 'status')
+        .annotate(total=Sum('count')).order_by()
+        .values_list('asset_type', 'business_criticality', 'status', 'total')
+    )
+    for row in rows:
+        totals.add(*row)
+    return totals
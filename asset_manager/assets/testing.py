@@ -0,0 +1,90 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+TESTDATA_DIR = Path(__file__).resolve().parent / 'testdata'
+
+
+def load_recording(name):
+    """A recorded list of ``{"path", "status", "body"}`` exchanges from testdata/."""
+    with open(TESTDATA_DIR / name) as f:
+        return json.load(f)
+
+
+class FakeDirectoryServer:
+    """
+    Replay recorded directory API responses on a local port.
+
+    ``exchanges`` map request paths (including the query string) to a status
+    and JSON body; ``{base_url}`` in a body is replaced with the server's own
+    URL, so recorded next/delta links point back at it. Requests are kept in
+    ``requests`` for assertions.
+    """
+
+    def __init__(self, exchanges=()):
+        self.routes = {}
+        self.requests = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler_class())
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}'
+        self.add(exchanges)
+
+    def add(self, exchanges):
+        for exchange in exchanges:
+            body = exchange['body']
+            if not isinstance(body, str):
+                body = json.dumps(body)
+            self.routes[exchange['path']] = (exchange.get('status', 200), body)
+
+    def handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake.requests.append(self.path)
+                status, body = fake.routes.get(self.path, (404, '{"error": "not recorded"}'))
+                data = body.replace('{base_url}', fake.base_url).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def entra_recording(count, page_size=999, prefix='user'):
+    """A generated Entra ID delta listing of ``count`` users, for load tests."""
+    exchanges = []
+    path = '/v1.0/users/delta?$select=id,userPrincipalName,mail,givenName,surname,accountEnabled'
+    for start in range(0, max(count, 1), page_size):
+        page = {'value': [
+            {
+                'id': f'{prefix}-{i:08d}',
+                'userPrincipalName': f'{prefix}{i}@contoso.com',
+                'mail': f'{prefix}{i}@contoso.com',
+                'givenName': f'Given{i}',
+                'surname': f'Surname{i}',
+                'accountEnabled': True,
+            }
+            for i in range(start, min(start + page_size, count))
+        ]}
+        next_path = f'/v1.0/users/delta?$skiptoken={prefix}-{start + page_size}'
+        if start + page_size < count:
+            page['@odata.nextLink'] = '{base_url}' + next_path
+        else:
+            page['@odata.deltaLink'] = '{base_url}/v1.0/users/delta?$deltatoken=' + prefix
+        exchanges.append({'path': path, 'body': page})
+        path = next_path
+    return exchanges
@@ -1,3 +1,2323 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import itertools
+import json
+import queue
+import re
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+import unittest
+import warnings
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import OperationalError, connection, transaction
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import (
+    Asset, AssetConfigEntry, AssetGroup, CheckChunk, Customer, CustomerAssetStats, DirectoryIdentity, DirectorySyncState, GroupRule,
+    InventorySnapshot, LogEvent, UserProfile, UserRole,
+)
+from . import scope
+from .compliance import customer_compliance, mark_patched
+from .directory import DirectorySync, EntraDirectory, GoogleDirectory
+from .exporters import export_assets
+from .git_export import GitExporter, GitExportError
+from .grouping import GroupMatcher, get_matcher
+from . import history
+from .api import ASSET_FIELDS, AssetListApiView
+from .benchmarks import BENCHMARKS, percentile, run_benchmark, url_cases
+from .importers import ImportFormatError, import_assets, read_json, text_stream
+from .instrumentation import Histogram, registry
+from .ingest import AMBIGUOUS, AssetResolver, Ingestor, TCPSource, UDPSource
+from .ipindex import IPIndex, get_ip_index
+from .journal import JournalWriter, acting_as, compact, customer_history, object_history
+from .ip import ip_key
+from .pagination import KeysetPaginator
+from .poller import Poller, poll_ports
+from .provisioning import provision_user, provision_users
+from .scope import load_scope
+from .search import search_assets
+from .snapshots import Snapshot, SnapshotError, diff_snapshots, open_snapshot, snapshot_at, take_snapshot
+from .stats import customer_totals, rebuild_stats
+from .testing import FakeDirectoryServer, entra_recording, load_recording
+from .views import AssetListView
+
+
+def make_user(username, role='user', customers=(), is_staff=False):
+    # bulk_create skips the post_save provisioning receivers
+    user, = User.objects.bulk_create([User(username=username, is_staff=is_staff)])
+    user_role = UserRole.objects.create(user=user, role=role)
+    user_role.customers.set(customers)
+    return user
+
+
+def get_scope_for(user):
+    return load_scope(User.objects.get(pk=user.pk))
+
+
+def make_customer(name):
+    owner, = User.objects.bulk_create([User(username=f'owner-{name}')])
+    return Customer.objects.create(user=owner, display_name=name)
+
+
+class AssetListPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = make_customer('Acme')
+        cls.admin = make_user('admin', role='admin', is_staff=True)
+        Asset.objects.bulk_create([
+            Asset(
+                customer=cls.customer,
+                name=f'host-{i:02d}',
+                asset_type='server' if i % 2 else 'network',
+                ip_address=f'10.0.0.{i}',
+            )
+            for i in range(25)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def walk(self, params):
+        names = []
+        response = self.client.get(reverse('dashboard'), params)
+        while True:
+            names.extend(asset.name for asset in response.context['assets'])
+            page = response.context['page_obj']
+            if not page.has_next():
+                return names, response
+            response = self.client.get(reverse('dashboard'), {**params, 'cursor': page.next_cursor})
+
+    def test_keyset_pages_cover_every_row_once(self):
+        names, _ = self.walk({'sort': 'name', 'page_size': 10})
+        self.assertEqual(names, sorted(f'host-{i:02d}' for i in range(25)))
+
+    def test_keyset_cursor_keeps_sub_millisecond_timestamps(self):
+        # Twenty rows inside one millisecond, and twenty more a few
+        # microseconds apart across the next ones
+        now = timezone.now().replace(microsecond=123000)
+        Asset.objects.all().update(last_checked=now)
+        Asset.objects.bulk_create([
+            Asset(customer=self.customer, name=f'fast-{i:02d}', asset_type='server',
+                  ip_address=f'10.0.1.{i}', last_checked=now + timedelta(microseconds=37 * i))
+            for i in range(40)
+        ])
+        names, _ = self.walk({'page_size': 3})
+        self.assertEqual(sorted(names), sorted(Asset.objects.values_list('name', flat=True)))
+
+        expected = set(Asset.objects.values_list('pk', flat=True))
+        paginator = KeysetPaginator(Asset.objects.values('pk', 'last_checked'), '-last_checked', 7)
+        pks, page = [], paginator.page()
+        while True:
+            pks.extend(row['pk'] for row in page)
+            if not page.has_next():
+                break
+            page = paginator.page(page.next_cursor)
+        self.assertEqual(len(pks), len(expected))
+        self.assertEqual(set(pks), expected)
+
+    def test_keyset_previous_cursor_returns_prior_page(self):
+        first = self.client.get(reverse('dashboard'), {'sort': '-name', 'page_size': 10})
+        second = self.client.get(reverse('dashboard'), {
+            'sort': '-name', 'page_size': 10, 'cursor': first.context['page_obj'].next_cursor,
+        })
+        back = self.client.get(reverse('dashboard'), {
+            'sort': '-name', 'page_size': 10, 'cursor': second.context['page_obj'].previous_cursor,
+        })
+        self.assertEqual(list(back.context['assets']), list(first.context['assets']))
+        self.assertFalse(back.context['page_obj'].has_previous())
+
+    def test_filters_survive_page_navigation(self):
+        names, response = self.walk({'asset_type': 'server', 'sort': 'name', 'page_size': 5})
+        self.assertEqual(len(names), 12)
+        self.assertIn('asset_type=server', response.content.decode())
+
+    def test_criticality_filter_and_sort_pages_by_pk(self):
+        Asset.objects.filter(name__in=['host-03', 'host-07', 'host-11']).update(
+            business_criticality='critical', status=False)
+        names, response = self.walk({
+            'criticality': 'critical', 'status': 'inactive', 'sort': '-business_criticality', 'page_size': 2,
+        })
+        self.assertEqual(names, ['host-11', 'host-07', 'host-03'])
+        self.assertEqual(response.context['current_filters']['sort'], '-business_criticality')
+
+    def test_offset_mode_and_invalid_input(self):
+        response = self.client.get(reverse('dashboard'), {'page': 2, 'page_size': 10, 'sort': 'bogus'})
+        self.assertEqual(response.context['page_obj'].number, 2)
+        self.assertEqual(response.context['current_filters']['sort'], '-last_checked')
+        response = self.client.get(reverse('dashboard'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class DashboardQueryPlanTests(TestCase):
+    """
+    Every supported filter/sort combination must be served by an index in
+    the order pages are read: no full scans and no sort step, for the first
+    page and for seeks past a cursor in either direction.
+    """
+
+    full_scan_patterns = {
+        # A walk over the table or a whole index, or a sort step
+        'sqlite': re.compile(r'\bSCAN assets_asset\b|\bUSE TEMP B-TREE\b'),
+        'postgresql': re.compile(r'Seq Scan on assets_asset\b'),
+    }
+    # With no filter to search on, the first page can only walk the sort
+    # index from its start, stopping at the page size
+    ordered_walk = re.compile(r'\bSCAN assets_asset USING INDEX asset_\w+\n')
+    cursor_values = {
+        'id': 1,
+        'name': 'm',
+        'last_checked': timezone.now(),
+        'business_criticality': 'high',
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = make_customer('Acme')
+        cls.admin = make_user('admin', role='admin', is_staff=True)
+        cls.manager = make_user('manager', role='manager', customers=[cls.customer])
+        cls.member = make_user('member', customers=[cls.customer])
+
+    def filter_combinations(self):
+        filters = {
+            'asset_type': 'server',
+            'criticality': 'high',
+            'status': 'active',
+            'customer': str(self.customer.pk),
+            'patch': 'overdue',
+        }
+        for size in range(len(filters) + 1):
+            for combo in itertools.combinations(filters, size):
+                for sort in AssetListView.sort_options:
+                    yield {**{key: filters[key] for key in combo}, 'sort': sort}
+
+    def explain(self, user, params):
+        """Plans for the first page and for seeking forwards and backwards."""
+        request = RequestFactory().get(reverse('dashboard'), params)
+        request.user = user
+        view = AssetListView()
+        view.setup(request)
+        queryset = view.get_queryset()
+        page_size = view.get_paginate_by(queryset)
+        paginator = KeysetPaginator(queryset, view.get_keyset_ordering(), page_size)
+        plans = {'first': queryset[:page_size].explain()}
+        for direction, backwards in [('next', False), ('previous', True)]:
+            ordered, descending = paginator._ordered(reverse=backwards)
+            value = self.cursor_values[paginator.field_name]
+            plans[direction] = paginator._seek(ordered, descending, value, 1)[:page_size].explain()
+        return plans
+
+    def assert_no_full_scans(self):
+        pattern = self.full_scan_patterns[connection.vendor]
+        for user in (self.admin, self.manager, self.member):
+            for params in self.filter_combinations():
+                unfiltered = user.is_staff and set(params) <= {'sort', 'patch'}
+                for page, plan in self.explain(user, params).items():
+                    with self.subTest(user=user.username, page=page, **params):
+                        if page == 'first' and unfiltered:
+                            plan = self.ordered_walk.sub('', plan)
+                        self.assertIsNone(pattern.search(plan), plan)
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+    def test_sqlite_plans_use_indexes(self):
+        self.assert_no_full_scans()
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+    def test_sqlite_configuration_filters_use_the_config_index(self):
+        # The lookup index yields the matching pks, which are then sorted
+        for user in (self.admin, self.manager, self.member):
+            with self.subTest(user=user.username):
+                plan = self.explain(user, {'config.location': 'HQ', 'config': 'backup=daily'})['first']
+                self.assertNotIn('SCAN assets_asset', plan)
+                self.assertIn('asset_config_lookup_idx', plan)
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'PostgreSQL only')
+    def test_postgresql_plans_use_indexes(self):
+        # Test tables are tiny, so take sequential scans off the table to see
+        # whether an index path exists at all
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        self.assert_no_full_scans()
+
+
+class AssetSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = make_customer('Acme')
+        cls.other = make_customer('Other')
+        cls.member = make_user('member', customers=[cls.customer])
+        for name, ip, customer in [
+            ('web-frontend-01', '10.20.1.5', cls.customer),
+            ('web-frontend-02', '10.20.9.7', cls.customer),
+            ('db-primary', '10.30.0.2', cls.customer),
+            ('mail-gateway', '2001:db8::25', cls.customer),
+            ('web-frontend-99', '10.20.1.6', cls.other),
+        ]:
+            Asset(customer=customer, name=name, asset_type='server', ip_address=ip).save()
+
+    def setUp(self):
+        self.client.force_login(self.member)
+
+    def search(self, term, **params):
+        response = self.client.get(reverse('dashboard'), {'search': term, **params})
+        return [asset.name for asset in response.context['assets']]
+
+    def test_name_search_uses_substring_match_within_scope(self):
+        self.assertEqual(sorted(self.search('FRONTEND')), ['web-frontend-01', 'web-frontend-02'])
+        self.assertEqual(self.search('primary'), ['db-primary'])
+
+    def test_ip_prefix_and_cidr_search(self):
+        self.assertEqual(self.search('10.20.0.0/16'), ['web-frontend-01', 'web-frontend-02'])
+        self.assertEqual(self.search('10.20.1'), ['web-frontend-01'])
+        self.assertEqual(self.search('10.30.0.2'), ['db-primary'])
+        self.assertEqual(self.search('2001:db8::/32'), ['mail-gateway'])
+
+    def test_search_can_be_combined_with_sort_and_filters(self):
+        names = self.search('frontend', sort='-name', asset_type='server')
+        self.assertEqual(names, ['web-frontend-02', 'web-frontend-01'])
+
+    def test_search_index_follows_renames_and_deletes(self):
+        asset = Asset.objects.get(name='db-primary')
+        asset.name = 'db-replica'
+        asset.save()
+        self.assertEqual(self.search('primary'), [])
+        self.assertEqual(self.search('replica'), ['db-replica'])
+        asset.delete()
+        self.assertEqual(self.search('replica'), [])
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'ranks with the SQLite FTS5 index')
+    def test_name_search_is_ranked(self):
+        Asset(customer=self.customer, name='web-web-web', asset_type='server', ip_address='10.40.0.1').save()
+        results = list(search_assets(Asset.objects.filter(customer=self.customer), 'web'))
+        self.assertEqual([asset.name for asset in results],
+                         ['web-web-web', 'web-frontend-01', 'web-frontend-02'])
+        self.assertTrue(all(asset.search_rank is not None for asset in results))
+
+    def test_results_are_bounded(self):
+        with self.settings(ASSET_SEARCH_LIMIT=1):
+            self.assertEqual(len(self.search('frontend')), 1)
+
+
+class TenantScopeQueryCountTests(TestCase):
+    """The role and customer set cost at most one query per request, whatever their size."""
+
+    # Steady state, with the scope already cached. Two of each budget are the
+    # session and auth user lookups; the dashboard and customer list also
+    # read CustomerAssetStats once.
+    budgets = {
+        'dashboard': 4,
+        'asset-create': 2,
+        'asset-update': 4,
+        'asset-delete': 4,
+        'customer-list': 4,
+        'customer-create': 2,
+        'customer-update': 3,
+        'user-create': 2,
+        'user-update': 3,
+        'user-role': 7,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customers = [make_customer(f'Customer {i}') for i in range(3)]
+        cls.asset = Asset(customer=cls.customers[0], name='host', asset_type='server', ip_address='10.0.0.1')
+        cls.asset.save()
+        cls.managers = [
+            make_user('manager-1', role='manager', customers=cls.customers[:1]),
+            make_user('manager-3', role='manager', customers=cls.customers),
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def url_for(self, name, user):
+        args = {
+            'asset-update': [self.asset.pk],
+            'asset-delete': [self.asset.pk],
+            'customer-update': [self.customers[0].pk],
+            'user-update': [user.pk],
+            'user-role': [user.pk],
+        }.get(name, [])
+        return reverse(name, args=args)
+
+    def scope_loads(self, url):
+        with mock.patch('assets.scope._query_scope', wraps=scope._query_scope) as query_scope:
+            self.client.get(url)
+        return query_scope.call_count
+
+    def test_query_count_per_view_is_fixed(self):
+        for user in self.managers:
+            self.client.force_login(user)
+            self.client.get(reverse('dashboard'))
+            for name, budget in self.budgets.items():
+                with self.subTest(user=user.username, view=name), self.assertNumQueries(budget):
+                    response = self.client.get(self.url_for(name, user))
+                    self.assertEqual(response.status_code, 200)
+
+    def test_scope_is_loaded_once_then_cached(self):
+        self.client.force_login(self.managers[1])
+        self.assertEqual(self.scope_loads(reverse('dashboard')), 1)
+        for name in ('dashboard', 'customer-list', 'user-list'):
+            with self.subTest(view=name):
+                self.assertEqual(self.scope_loads(reverse(name)), 0)
+
+    @override_settings(TENANT_SCOPE_CACHE_TIMEOUT=3600, TENANT_SCOPE_LOCAL_CACHE_TIMEOUT=5)
+    def test_per_process_cache_keeps_scopes_briefly(self):
+        # Another process's invalidations never reach a LocMemCache
+        manager = self.managers[0]
+        with mock.patch.object(scope.cache, 'set', wraps=scope.cache.set) as cache_set:
+            get_scope_for(manager)
+        self.assertEqual(cache_set.call_args.args[2], 5)
+        cache.clear()
+        with mock.patch('assets.scope.versions_are_shared', return_value=True), \
+                mock.patch.object(scope.cache, 'set', wraps=scope.cache.set) as cache_set:
+            get_scope_for(manager)
+        self.assertEqual(cache_set.call_args.args[2], 3600)
+
+    def test_assignment_changes_invalidate_cached_scope(self):
+        manager = self.managers[0]
+        self.client.force_login(manager)
+        self.client.get(reverse('dashboard'))
+
+        manager.userrole.customers.add(self.customers[2])
+        self.assertEqual(get_scope_for(manager).customer_ids, {self.customers[0].pk, self.customers[2].pk})
+
+        self.customers[2].userrole_set.remove(manager.userrole)
+        self.assertEqual(get_scope_for(manager).customer_ids, {self.customers[0].pk})
+
+        manager.userrole.role = 'user'
+        manager.userrole.save()
+        self.assertFalse(get_scope_for(manager).can_manage)
+
+        self.customers[0].delete()
+        self.assertEqual(get_scope_for(manager).customer_ids, set())
+
+
+class UserListQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customers = [make_customer(f'Customer {i}') for i in range(4)]
+        cls.admin = make_user('admin', role='admin', is_staff=True)
+        cls.manager = make_user('manager', role='manager', customers=cls.customers[:2])
+
+    def setUp(self):
+        cache.clear()
+
+    def add_users(self, count, customers):
+        for i in range(count):
+            make_user(f'user-{customers[0].pk}-{i}', customers=customers)
+
+    def test_query_budget_does_not_grow_with_rows(self):
+        self.client.force_login(self.admin)
+        self.client.get(reverse('user-list'))
+        self.add_users(5, self.customers[:2])
+        # session, auth user, count, page of users + roles, their customers
+        with self.assertNumQueries(5):
+            self.client.get(reverse('user-list'))
+        self.add_users(40, self.customers[1:3])
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('user-list'))
+        self.assertContains(response, 'Customer 2')
+
+    def test_manager_sees_each_assigned_user_once(self):
+        self.add_users(3, self.customers[:2])
+        self.add_users(2, self.customers[2:])
+        self.client.force_login(self.manager)
+        response = self.client.get(reverse('user-list'))
+        usernames = [user.username for user in response.context['users']]
+        self.assertEqual(len(usernames), len(set(usernames)))
+        self.assertEqual(len(usernames), 4)  # three assigned users and the manager
+
+    def test_pagination(self):
+        self.add_users(7, self.customers[:1])
+        self.client.force_login(self.admin)
+        with self.settings(USER_LIST_PAGE_SIZE=5):
+            response = self.client.get(reverse('user-list'), {'page': 3})
+        # 13 users: admin, manager, four customer owners and the seven above
+        self.assertEqual(len(response.context['users']), 3)
+
+
+class AssetImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = make_customer('Acme')
+        cls.other = make_customer('Other')
+        cls.member = make_user('member', customers=[cls.customer])
+
+    def setUp(self):
+        # The IP index is held per process; ids are reused between tests
+        cache.clear()
+
+    def run_import(self, text, fmt, **kwargs):
+        return import_assets(io.StringIO(text), fmt, **kwargs)
+
+    def test_csv_upserts_on_customer_and_name(self):
+        Asset(customer=self.customer, name='web-1', asset_type='server', ip_address='10.0.0.1').save()
+        result = self.run_import(
+            'name,asset_type,ip_address,business_criticality,configuration\n'
+            'web-1,network,10.0.0.9,high,"location=HQ; backup=daily"\n'
+            'web-2,server,10.0.0.2,,\n',
+            'csv', default_customer_id=self.customer.pk,
+        )
+        self.assertEqual((result.imported, result.failed), (2, 0))
+        web1 = Asset.objects.get(customer=self.customer, name='web-1')
+        self.assertEqual((web1.asset_type, web1.ip_address, web1.business_criticality),
+                         ('network', '10.0.0.9', 'high'))
+        self.assertEqual(web1.configuration, {'location': 'HQ', 'backup': 'daily'})
+        self.assertEqual(web1.ip_key, ip_key('10.0.0.9'))
+        self.assertEqual(Asset.objects.count(), 2)
+
+    def test_json_and_ndjson_streams(self):
+        rows = [
+            {'customer': self.customer.pk, 'name': f'host-{i}', 'asset_type': 'storage',
+             'ip_address': f'10.1.0.{i}', 'configuration': {'rack': str(i)}}
+            for i in range(5)
+        ]
+        result = read_json(io.StringIO(json.dumps(rows)), chunk_size=7)
+        self.assertEqual([data for _, data in result], rows)
+        result = self.run_import(json.dumps(rows), 'json', batch_size=2)
+        self.assertEqual(result.imported, 5)
+        result = self.run_import('\n'.join(json.dumps(row) for row in rows) + '\n{oops\n', 'ndjson')
+        self.assertEqual((result.imported, result.failed), (5, 1))
+        self.assertEqual(Asset.objects.get(name='host-3').configuration, {'rack': '3'})
+
+    def test_invalid_rows_are_reported_with_form_rules(self):
+        result = self.run_import(
+            'customer,name,asset_type,ip_address,configuration,patch_cycle\n'
+            f'{self.customer.pk},ok,server,10.0.0.1,,\n'
+            f'{self.customer.pk},bad-ip,server,999.1.1.1,,\n'
+            f'{self.customer.pk},bad-type,printer,10.0.0.2,,\n'
+            f'{self.customer.pk},bad-config,server,10.0.0.3,novalue,\n'
+            f'{self.other.pk},not-mine,server,10.0.0.4,,\n'
+            f'{self.customer.pk},bad-cycle,server,10.0.0.5,,0\n',
+            'csv', customer_ids=[self.customer.pk],
+        )
+        self.assertEqual((result.imported, result.failed), (1, 5))
+        errors = dict(result.errors)
+        self.assertEqual(sorted(errors), [3, 4, 5, 6, 7])
+        self.assertTrue(any('ip_address' in message for message in errors[3]))
+        self.assertTrue(any('asset_type' in message for message in errors[4]))
+        self.assertTrue(any('key=value' in message for message in errors[5]))
+        self.assertTrue(any('not available' in message for message in errors[6]))
+        self.assertTrue(any('patch_cycle' in message for message in errors[7]))
+
+    def test_unreadable_input_is_a_format_error(self):
+        result = self.run_import(
+            '{"name": "list", "asset_type": "server", "ip_address": "10.0.0.1", "configuration": ["x"]}\n'
+            '{"name": "number", "asset_type": "server", "ip_address": "10.0.0.2", "configuration": 5}\n'
+            '{"name": "ok", "asset_type": "server", "ip_address": "10.0.0.3", "configuration": "rack=1"}\n',
+            'ndjson', default_customer_id=self.customer.pk,
+        )
+        self.assertEqual((result.imported, result.failed), (1, 2))
+        self.assertIn('configuration: Must be an object or key=value pairs', result.errors[0][1])
+
+        latin1 = 'name,asset_type,ip_address\ncaf\xe9,server,10.0.0.4\n'.encode('latin-1')
+        with self.assertRaisesMessage(ImportFormatError, 'not UTF-8'):
+            import_assets(text_stream(io.BytesIO(latin1)), 'csv', default_customer_id=self.customer.pk)
+        with self.assertRaisesMessage(ImportFormatError, 'Invalid CSV after line 1'):
+            self.run_import('name,asset_type\n' + 'x' * 200000 + ',server\n', 'csv', default_customer_id=self.customer.pk)
+
+        self.client.force_login(self.member)
+        upload = SimpleUploadedFile('assets.csv', latin1)
+        response = self.client.post(reverse('asset-import'), {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response.context['form'], 'file', 'The file is not UTF-8 text')
+
+    def test_batches_send_one_signal_and_no_post_save(self):
+        text = ''.join(f'{{"name": "h{i}", "asset_type": "server", "ip_address": "10.2.0.{i}"}}\n' for i in range(10))
+        with mock.patch('assets.signals.assets_bulk_saved.send') as bulk_saved, \
+                mock.patch('django.db.models.signals.post_save.send') as post_save_send:
+            self.run_import(text, 'ndjson', default_customer_id=self.customer.pk, batch_size=4)
+        self.assertEqual(bulk_saved.call_count, 3)
+        self.assertFalse(any(call.kwargs.get('sender') is Asset for call in post_save_send.call_args_list))
+
+    def test_shared_addresses_are_imported_with_warnings(self):
+        Asset(customer=self.customer, name='web-1', asset_type='server', ip_address='10.0.0.1').save()
+        Asset(customer=self.other, name='web-9', asset_type='server', ip_address='10.0.0.2').save()
+        result = self.run_import(
+            'name,asset_type,ip_address\n'
+            'web-1,server,10.0.0.1\n'
+            'web-2,server,10.0.0.1\n'
+            'web-3,server,10.0.0.2\n'
+            'web-4,server,10.0.0.3\n'
+            'web-5,server,10.0.0.3\n',
+            'csv', default_customer_id=self.customer.pk, batch_size=2,
+        )
+        self.assertEqual((result.imported, result.warned), (5, 2))
+        self.assertEqual(result.warnings, [
+            (3, ['ip_address: 10.0.0.1 is also the address of 1 existing asset',
+                 'ip_address: 10.0.0.1 is also the address of web-1 (row 2)']),
+            (6, ['ip_address: 10.0.0.3 is also the address of web-4 (row 5)']),
+        ])
+
+    def test_upload_view_is_scoped(self):
+        self.client.force_login(self.member)
+        upload = SimpleUploadedFile(
+            'assets.csv',
+            f'customer,name,asset_type,ip_address\n{self.customer.pk},a,server,10.0.0.1\n'
+            f'{self.other.pk},b,server,10.0.0.2\n'.encode(),
+        )
+        response = self.client.post(reverse('asset-import'), {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['result'].imported, 1)
+        self.assertEqual(list(Asset.objects.values_list('name', flat=True)), ['a'])
+
+
+class AssetExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = make_customer('Acme')
+        cls.other = make_customer('Other')
+        cls.member = make_user('member', customers=[cls.customer])
+        for i in range(450):
+            Asset(customer=cls.customer, name=f'host-{i}', asset_type='server',
+                  ip_address=f'10.0.{i // 256}.{i % 256}', configuration={'n': str(i)}).save()
+        Asset(customer=cls.other, name='foreign', asset_type='server', ip_address='10.9.9.9').save()
+
+    def setUp(self):
+        self.client.force_login(self.member)
+
+    def export(self, **params):
+        response = self.client.get(reverse('customer-export', args=[self.customer.pk]), params)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_formats(self):
+        _, body = self.export(format='ndjson')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(rows), 450)
+        self.assertEqual(rows[3]['configuration'], {'n': '3'})
+
+        _, body = self.export(format='json')
+        self.assertEqual([row['name'] for row in json.loads(body)], [row['name'] for row in rows])
+
+        _, body = self.export(format='csv')
+        records = list(csv.DictReader(io.StringIO(body.decode())))
+        self.assertEqual(len(records), 450)
+        self.assertEqual(json.loads(records[0]['configuration']), {'n': '0'})
+
+    def test_gzip_and_since(self):
+        since = timezone.now()
+        asset = Asset.objects.get(name='host-7')
+        asset.business_criticality = 'high'
+        asset.save()
+        # A poll is not a change
+        Asset.objects.filter(name='host-8').update(last_checked=since + timedelta(days=1))
+        response, body = self.export(format='json', gzip='1', since=since.isoformat())
+        self.assertTrue(response['Content-Disposition'].endswith('.json.gz"'))
+        self.assertEqual([row['name'] for row in json.loads(gzip.decompress(body))], ['host-7'])
+
+    def test_invalid_and_naive_since(self):
+        for value in ['yesterday', '2026-13-01T00:00']:
+            with self.subTest(since=value):
+                response = self.client.get(reverse('customer-export', args=[self.customer.pk]), {'since': value})
+                self.assertEqual(response.status_code, 400)
+                with self.assertRaisesMessage(CommandError, 'ISO 8601'):
+                    call_command('export_assets', since=value, stdout=io.StringIO())
+
+        # Without an offset: in the current time zone, with no naive-datetime warning
+        since = timezone.localtime() - timedelta(hours=1)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', RuntimeWarning)
+            _, body = self.export(format='ndjson', since=since.replace(tzinfo=None).isoformat())
+        self.assertEqual(len(body.splitlines()), 450)
+
+    def test_export_is_scoped(self):
+        response = self.client.get(reverse('customer-export', args=[self.other.pk]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_empty_json_export_is_valid(self):
+        self.assertEqual(json.loads(b''.join(export_assets(self.other.pk + 100, 'json'))), [])
+
+
+@unittest.skipUnless(shutil.which('git'), 'git is not installed')
+class GitExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = make_customer('Acme')
+        for i in range(3):
+            Asset(customer=cls.customer, name=f'host-{i}', asset_type='server', ip_address=f'10.0.0.{i}').save()
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.remote = Path(self.tmp.name) / 'remote.git'
+        subprocess.run(['git', 'init', '--quiet', '--bare', str(self.remote)], check=True)
+        self.exporter = GitExporter(self.remote, Path(self.tmp.name) / 'state')
+
+    def remote_git(self, *args):
+        return subprocess.run(['git', '--git-dir', str(self.remote), *args],
+                              check=True, capture_output=True).stdout.decode()
+
+    def test_only_changed_files_are_committed(self):
+        first = self.exporter.export()
+        self.assertEqual((first.written, first.deleted), (4, 0))
+        self.assertEqual(self.remote_git('rev-parse', 'main').strip(), first.commit)
+
+        again = self.exporter.export()
+        self.assertFalse(again.changed)
+        self.assertEqual(again.unchanged, 4)
+        self.assertEqual(self.remote_git('rev-list', '--count', 'main').strip(), '1')
+
+        asset = Asset.objects.get(name='host-1')
+        asset.business_criticality = 'critical'
+        asset.save()
+        Asset.objects.filter(name='host-2').delete()
+        third = self.exporter.export()
+        self.assertEqual((third.written, third.deleted, third.unchanged), (1, 1, 2))
+        changed = self.remote_git('diff', '--name-status', first.commit, third.commit).split('\n')
+        self.assertIn(f'M\tcustomers/{self.customer.pk}/assets/{asset.pk}.json', changed)
+        payload = json.loads(self.remote_git('show', f'main:customers/{self.customer.pk}/assets/{asset.pk}.json'))
+        self.assertEqual(payload['business_criticality'], 'critical')
+
+    def test_failures_stop_fast_import(self):
+        first = self.exporter.export()
+        asset = Asset.objects.get(name='host-1')
+        asset.name = 'host-one'
+        asset.save()
+        streams = []
+        start_commit = self.exporter.start_commit
+
+        def track(*args):
+            streams.append(start_commit(*args))
+            return streams[-1]
+
+        def documents(customer_ids):
+            yield from original(customer_ids)
+            raise RuntimeError('query failed')
+
+        original = self.exporter.documents
+        with mock.patch.object(self.exporter, 'start_commit', track), \
+                mock.patch.object(self.exporter, 'documents', documents):
+            with self.assertRaisesMessage(RuntimeError, 'query failed'):
+                self.exporter.export()
+        self.assertIsNotNone(streams[0].process.returncode)
+        self.assertEqual(self.exporter.head(), first.commit)
+
+        # fast-import rejects a path with a newline and exits; the large
+        # payload after it meets the closed pipe
+        def broken(customer_ids):
+            yield 'customers/bad\nbogus', {'padding': 'x' * 1000000}
+
+        with mock.patch.object(self.exporter, 'documents', broken):
+            with self.assertRaisesMessage(GitExportError, 'git fast-import failed: fatal'):
+                self.exporter.export()
+        self.assertEqual(self.exporter.head(), first.commit)
+
+    def test_manifest_is_rebuilt_from_the_remote_tree(self):
+        self.exporter.export()
+        shutil.rmtree(self.exporter.state_dir)
+        result = GitExporter(self.remote, self.exporter.state_dir).export()
+        self.assertFalse(result.changed)
+        self.assertEqual(result.unchanged, 4)
+
+
+class UserProvisioningTests(TestCase):
+    def test_new_user_is_provisioned_once(self):
+        user = User.objects.create_user('alice', first_name='Alice', last_name='Smith')
+        self.assertEqual(user.userrole.role, 'user')
+        self.assertTrue(UserProfile.objects.filter(user=user).exists())
+        self.assertEqual(user.customer.display_name, 'Customer alice')
+        self.assertEqual(user.customer.contact_person, 'Alice Smith')
+
+        staff = User.objects.create_user('bob', is_staff=True)
+        self.assertTrue(UserRole.objects.filter(user=staff).exists())
+        self.assertFalse(Customer.objects.filter(user=staff).exists())
+
+    def test_provisioned_rows_are_loaded_from_the_database(self):
+        user = User.objects.create_user('alice')
+        self.assertIsNotNone(user.userrole.pk)
+        self.assertIsNotNone(user.userprofile.pk)
+        self.assertIsNotNone(user.customer.pk)
+        user.userrole.role = 'manager'
+        user.userrole.save()
+        user.customer.legal_name = 'Alice Ltd'
+        user.customer.save()
+        self.assertEqual(UserRole.objects.get(user=user).role, 'manager')
+        self.assertEqual(Customer.objects.filter(user=user).get().legal_name, 'Alice Ltd')
+
+        # Provisioning again leaves loaded relations alone
+        role = user.userrole
+        provision_user(user)
+        self.assertIs(user.userrole, role)
+
+    def test_ordinary_save_only_updates_the_user(self):
+        user = User.objects.create_user('alice')
+        user.last_login = timezone.now()
+        with self.assertNumQueries(1):
+            user.save()
+
+    def test_bulk_provisioning_has_fixed_query_count(self):
+        users = User.objects.bulk_create([User(username=f'user-{i}') for i in range(50)])
+        # Savepoint, the profile insert, then for roles and customers the
+        # existing rows, the insert and the new rows for the journal, release
+        with self.assertNumQueries(9):
+            provision_users(users)
+        self.assertEqual(UserRole.objects.filter(user__in=users).count(), 50)
+        self.assertEqual(Customer.objects.filter(user__in=users).count(), 50)
+
+        # Repeating is harmless
+        provision_users(users)
+        self.assertEqual(UserProfile.objects.filter(user__in=users).count(), 50)
+
+    def test_user_create_view_creates_one_role(self):
+        admin = make_user('admin', role='admin', is_staff=True)
+        self.client.force_login(admin)
+        response = self.client.post(reverse('user-create'), {
+            'username': 'carol',
+            'password1': 'a-long-Passphrase-1',
+            'password2': 'a-long-Passphrase-1',
+        })
+        self.assertRedirects(response, reverse('user-list'))
+        self.assertEqual(UserRole.objects.filter(user__username='carol').count(), 1)
+
+
+class DirectorySyncTests(TestCase):
+    def sync(self, server, source='entra', directory_class=EntraDirectory):
+        return DirectorySync(source, directory_class(server.base_url, token='test-token')).run()
+
+    def test_entra_initial_listing_then_delta(self):
+        with FakeDirectoryServer(load_recording('entra_delta.json')) as server:
+            first = self.sync(server)
+            self.assertTrue(first.full)
+            self.assertEqual((first.created, first.updated, first.disabled), (3, 0, 0))
+            alice = User.objects.get(username='alice@contoso.com')
+            self.assertEqual((alice.first_name, alice.last_name, alice.userrole.role), ('Alice', 'Smith', 'user'))
+            self.assertFalse(alice.has_usable_password())
+            self.assertEqual(User.objects.get(username='bob@contoso.com').email, '')
+            self.assertFalse(User.objects.filter(username='carol@contoso.com').exists())
+            self.assertEqual(DirectorySyncState.objects.get(source='entra').token,
+                             f'{server.base_url}/v1.0/users/delta?$deltatoken=round-2')
+
+            second = self.sync(server)
+            self.assertFalse(second.full)
+            self.assertEqual((second.created, second.updated, second.disabled), (1, 1, 2))
+            alice.refresh_from_db()
+            self.assertEqual((alice.email, alice.last_name), ('alice@contoso.com', 'Smith-Jones'))
+            self.assertEqual(
+                set(User.objects.filter(is_active=False).values_list('username', flat=True)),
+                {'bob@contoso.com', 'dave@contoso.com'},
+            )
+            self.assertTrue(User.objects.get(username='erin@contoso.com').is_active)
+
+    def test_expired_delta_token_falls_back_to_full_listing(self):
+        with FakeDirectoryServer(load_recording('entra_delta.json')) as server:
+            DirectorySyncState.objects.create(
+                source='entra', token=f'{server.base_url}/v1.0/users/delta?$deltatoken=expired')
+            result = self.sync(server)
+        self.assertTrue(result.full)
+        self.assertEqual(result.created, 3)
+
+    def test_google_listing_adopts_local_users_and_disables_missing_ones(self):
+        recording = load_recording('google_users.json')
+        existing = User.objects.create_user('alice@example.com')
+        with FakeDirectoryServer(recording) as server:
+            first = self.sync(server, source='google', directory_class=GoogleDirectory)
+            self.assertEqual((first.created, first.updated), (1, 1))
+            self.assertEqual(DirectoryIdentity.objects.get(external_id='104375817491823749812').user, existing)
+            self.assertEqual(User.objects.get(pk=existing.pk).last_name, 'Smith')
+
+            recording[0]['body']['users'] = recording[0]['body']['users'][:1]
+            server.add(recording)
+            second = self.sync(server, source='google', directory_class=GoogleDirectory)
+        self.assertEqual((second.disabled, second.unchanged), (1, 1))
+        self.assertFalse(User.objects.get(username='bob@example.com').is_active)
+
+    def test_writes_are_batched(self):
+        with FakeDirectoryServer(entra_recording(300, page_size=100)) as server:
+            with CaptureQueriesContext(connection) as queries:
+                result = self.sync(server)
+        self.assertEqual(result.created, 300)
+        # A handful of bulk statements per table (SQLite caps parameters per
+        # INSERT), not one per user
+        self.assertLess(len(queries), 30)
+
+
+class AssetGroupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = make_customer('Acme')
+        cls.other = make_customer('Globex')
+
+    def setUp(self):
+        # Rule versions live in the cache; ids are reused between tests
+        cache.clear()
+
+    def make_group(self, name, rules, match='all', customer=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            group = AssetGroup.objects.create(customer=customer or self.customer, name=name, match=match)
+            for field, value in rules:
+                GroupRule.objects.create(group=group, field=field, value=value)
+        return group
+
+    def make_asset(self, name, customer=None, **fields):
+        fields = {'asset_type': 'server', 'ip_address': '10.0.0.1', **fields}
+        asset = Asset(customer=customer or self.customer, name=name, **fields)
+        asset.save()
+        return asset
+
+    @override_settings(GROUP_MATCHER_LOCAL_TIMEOUT=5)
+    def test_per_process_cache_recompiles_after_a_timeout(self):
+        group = self.make_group('servers', [('asset_type', 'server')])
+        with mock.patch('assets.grouping.time.monotonic', return_value=1000):
+            matcher = get_matcher(self.customer.pk)
+            # Written by another process: no version bump reaches this one
+            GroupRule.objects.bulk_create([GroupRule(group=group, field='name', value='web-*')])
+            self.assertIs(get_matcher(self.customer.pk), matcher)
+        with mock.patch('assets.grouping.time.monotonic', return_value=1006):
+            fresh = get_matcher(self.customer.pk)
+        self.assertIsNot(fresh, matcher)
+        self.assertEqual(fresh.groups_for('server', 'normal', '10.0.0.1', 'db-1', {}), set())
+
+        with mock.patch('assets.grouping.versions_are_shared', return_value=True), \
+                mock.patch('assets.grouping.time.monotonic', return_value=2000):
+            matcher = get_matcher(self.customer.pk)
+        with mock.patch('assets.grouping.versions_are_shared', return_value=True), \
+                mock.patch('assets.grouping.time.monotonic', return_value=9000):
+            self.assertIs(get_matcher(self.customer.pk), matcher)
+
+    def test_matcher(self):
+        matcher = GroupMatcher([
+            (1, 'all', 'asset_type', 'server'),
+            (1, 'all', 'name', 'WEB-*'),
+            (2, 'any', 'ip_network', '10.1.0.0/16'),
+            (2, 'any', 'configuration', 'location=HQ'),
+            (3, 'all', 'name', '*-db'),
+            (4, 'all', 'name', '*sql*'),
+            (5, 'all', 'configuration', 'backup'),
+            (6, 'all', 'ip_network', '2001:db8::/32'),
+            (7, 'all', 'business_criticality', 'critical'),
+        ])
+        self.assertEqual(matcher.groups_for('server', 'normal', '10.1.2.3', 'web-01', {}), {1, 2})
+        self.assertEqual(matcher.groups_for('network', 'normal', '10.2.0.1', 'web-01', {'location': 'HQ'}), {2})
+        self.assertEqual(matcher.groups_for('server', 'critical', '10.2.0.1', 'mysql-db', {'backup': 'daily'}),
+                         {3, 4, 5, 7})
+        self.assertEqual(matcher.groups_for('storage', 'low', '2001:db8::1', 'nas', None), {6})
+
+    def test_membership_follows_asset_saves(self):
+        group = self.make_group('Web servers', [('asset_type', 'server'), ('name', 'web-*')])
+        asset = self.make_asset('web-01')
+        other_customer_asset = self.make_asset('web-01', customer=self.other)
+        self.assertEqual(list(group.assets.all()), [asset])
+
+        asset.asset_type = 'network'
+        asset.save()
+        self.assertFalse(group.assets.exists())
+        self.assertFalse(other_customer_asset.groups.exists())
+
+        asset.last_checked = timezone.now()
+        with self.assertNumQueries(1):
+            asset.save(update_fields=['last_checked'])
+
+    def test_rule_changes_regroup_existing_assets(self):
+        asset = self.make_asset('db-01', configuration={'location': 'HQ'})
+        group = self.make_group('HQ', [('configuration', 'location=HQ')])
+        self.assertEqual(list(asset.groups.all()), [group])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            group.rules.update(value='location=DC1')
+            # update() sends no signals; saving one rule triggers the rebuild
+            group.rules.first().save()
+        self.assertFalse(asset.groups.exists())
+
+    def test_bulk_import_updates_membership(self):
+        group = self.make_group('Critical', [('business_criticality', 'critical')], match='any')
+        rows = '\n'.join(json.dumps({
+            'customer': self.customer.pk, 'name': f'host-{i}', 'asset_type': 'server',
+            'ip_address': f'10.0.0.{i}', 'business_criticality': 'critical' if i % 2 else 'low',
+        }) for i in range(10))
+        import_assets(io.StringIO(rows), 'ndjson')
+        self.assertEqual(group.assets.count(), 5)
+
+    def test_rule_validation(self):
+        group = self.make_group('Invalid', [])
+        for field, value in (('asset_type', 'router'), ('ip_network', '10.0.0.0/33'), ('configuration', '=x')):
+            with self.subTest(field=field), self.assertRaises(ValidationError):
+                GroupRule(group=group, field=field, value=value).full_clean()
+
+
+class AssetConfigIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = make_customer('Acme')
+        cls.admin = make_user('admin', role='admin', is_staff=True)
+
+    def make_asset(self, name, configuration):
+        asset = Asset(customer=self.customer, name=name, asset_type='server',
+                      ip_address='10.0.0.1', configuration=configuration)
+        asset.save()
+        return asset
+
+    def entries(self, asset):
+        return dict(asset.config_entries.values_list('key', 'value'))
+
+    def test_entries_follow_saves(self):
+        asset = self.make_asset('web-01', {'location': 'HQ', 'port': 443, 'tls': True})
+        self.assertEqual(self.entries(asset), {'location': 'HQ', 'port': '443', 'tls': 'true'})
+
+        asset.configuration = {'location': 'DC1'}
+        asset.save()
+        self.assertEqual(self.entries(asset), {'location': 'DC1'})
+
+        asset.last_checked = timezone.now()
+        with self.assertNumQueries(1):
+            asset.save(update_fields=['last_checked'])
+
+    def test_bulk_import_indexes_configuration(self):
+        rows = '\n'.join(json.dumps({
+            'customer': self.customer.pk, 'name': f'host-{i}', 'asset_type': 'server',
+            'ip_address': f'10.0.0.{i}', 'configuration': f'location={"HQ" if i % 2 else "DC1"}',
+        }) for i in range(6))
+        import_assets(io.StringIO(rows), 'ndjson')
+        self.assertEqual(AssetConfigEntry.objects.filter(key='location', value='HQ').count(), 3)
+
+    def test_dashboard_and_export_filters(self):
+        hq = self.make_asset('hq-01', {'location': 'HQ', 'backup': 'daily'})
+        self.make_asset('hq-02', {'location': 'HQ', 'backup': 'none'})
+        self.make_asset('dc-01', {'location': 'DC1', 'backup': 'daily'})
+        self.client.force_login(self.admin)
+
+        for params in ({'config.location': 'HQ', 'config.backup': 'daily'},
+                       {'config': 'location=HQ, backup=daily'}):
+            with self.subTest(**params):
+                response = self.client.get(reverse('dashboard'), params)
+                self.assertEqual(list(response.context['assets']), [hq])
+                self.assertEqual(response.context['current_filters']['config'], 'location=HQ, backup=daily')
+
+        response = self.client.get(reverse('customer-export', args=[self.customer.pk]),
+                                   {'format': 'ndjson', 'config.location': 'HQ'})
+        names = [json.loads(line)['name'] for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(names, ['hq-01', 'hq-02'])
+
+    def test_backfill_command_rebuilds_entries(self):
+        asset = self.make_asset('web-01', {'location': 'HQ'})
+        Asset.objects.filter(pk=asset.pk).update(configuration={'location': 'DC2', 'rack': 'B4'})
+        call_command('backfill_config_index', stdout=io.StringIO())
+        self.assertEqual(self.entries(asset), {'location': 'DC2', 'rack': 'B4'})
+
+
+class PatchComplianceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.acme = make_customer('Acme')
+        cls.globex = make_customer('Globex')
+        cls.admin = make_user('admin', role='admin', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+        self.now = timezone.now()
+
+    def make_asset(self, name, customer=None, days_ago=None, patch_cycle=30, status=True):
+        asset = Asset(
+            customer=customer or self.acme, name=name, asset_type='server', ip_address='10.0.0.1',
+            patch_cycle=patch_cycle, status=status,
+            last_patched=None if days_ago is None else self.now - timedelta(days=days_ago),
+        )
+        asset.save()
+        return asset
+
+    def test_due_date_follows_last_patched_and_cycle(self):
+        asset = self.make_asset('web-01', days_ago=10, patch_cycle=14)
+        self.assertEqual(asset.patch_due_at, asset.last_patched + timedelta(days=14))
+        self.assertFalse(asset.patch_overdue)
+
+        asset.patch_cycle = 7
+        asset.save(update_fields=['patch_cycle'])
+        asset.refresh_from_db()
+        self.assertEqual(asset.patch_due_at, asset.last_patched + timedelta(days=7))
+        self.assertTrue(asset.patch_overdue)
+        self.assertTrue(self.make_asset('never').patch_overdue)
+
+    def test_compliance_per_customer(self):
+        self.make_asset('patched', days_ago=5)
+        self.make_asset('never-patched')
+        self.make_asset('retired', days_ago=400, status=False)
+        self.make_asset('overdue', customer=self.globex, days_ago=100)
+
+        compliance = customer_compliance()
+        self.assertEqual((compliance[self.acme.pk].total, compliance[self.acme.pk].percent), (2, 50.0))
+        self.assertEqual((compliance[self.globex.pk].overdue, compliance[self.globex.pk].percent), (1, 0.0))
+
+    def test_results_are_cached_until_assets_change_or_fall_due(self):
+        asset = self.make_asset('patched', days_ago=20)
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            customer_compliance()
+        timeout = cache_set.call_args.args[2]
+        self.assertLessEqual(timeout, 10 * 24 * 3600 + 1)
+
+        with self.assertNumQueries(0):
+            customer_compliance()
+
+        asset.last_checked = self.now
+        asset.save(update_fields=['last_checked'])
+        with self.assertNumQueries(0):
+            customer_compliance()
+
+        asset.last_patched = self.now - timedelta(days=40)
+        asset.save()
+        self.assertEqual(customer_compliance()[self.acme.pk].overdue, 1)
+
+    @override_settings(PATCH_COMPLIANCE_CACHE_TIMEOUT=3600, PATCH_COMPLIANCE_LOCAL_CACHE_TIMEOUT=5)
+    def test_per_process_cache_keeps_results_briefly(self):
+        # Another process's imports and edits never bump a LocMemCache's version
+        self.make_asset('patched', days_ago=20)
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            customer_compliance()
+        self.assertEqual(cache_set.call_args.args[2], 5)
+        cache.clear()
+        with mock.patch('assets.compliance.versions_are_shared', return_value=True), \
+                mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            customer_compliance()
+        self.assertEqual(cache_set.call_args.args[2], 3600)
+
+    def test_bulk_paths_keep_due_dates(self):
+        asset = self.make_asset('web-01', days_ago=20)
+        self.assertEqual(customer_compliance()[self.acme.pk].overdue, 0)
+
+        row = {'customer': self.acme.pk, 'name': 'web-01', 'asset_type': 'server',
+               'ip_address': '10.0.0.1', 'patch_cycle': 14}
+        import_assets(io.StringIO(json.dumps(row)), 'ndjson')
+        asset.refresh_from_db()
+        self.assertEqual(asset.patch_due_at, asset.last_patched + timedelta(days=14))
+        self.assertEqual(customer_compliance()[self.acme.pk].overdue, 1)
+
+        mark_patched(Asset.objects.filter(pk=asset.pk), when=self.now)
+        asset.refresh_from_db()
+        self.assertEqual(asset.patch_due_at, self.now + timedelta(days=14))
+        self.assertEqual(customer_compliance()[self.acme.pk].overdue, 0)
+
+    def test_dashboard_shows_compliance_and_filters_overdue(self):
+        self.make_asset('patched', days_ago=5)
+        overdue = self.make_asset('overdue', days_ago=100)
+        self.make_asset('other', customer=self.globex, days_ago=5)
+        self.client.force_login(self.admin)
+
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['compliance_total'].percent, 66.7)
+        self.assertEqual([customer for customer, _ in response.context['compliance_rows']], [self.acme, self.globex])
+
+        response = self.client.get(reverse('dashboard'), {'patch': 'overdue'})
+        self.assertEqual(list(response.context['assets']), [overdue])
+
+
+class CustomerAssetStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.acme = make_customer('Acme')
+        cls.globex = make_customer('Globex')
+        cls.admin = make_user('admin', role='admin', is_staff=True)
+
+    def make_asset(self, name, customer=None, **fields):
+        asset = Asset(customer=customer or self.acme, name=name, ip_address='10.0.0.1',
+                      **{'asset_type': 'server', **fields})
+        asset.save()
+        return asset
+
+    def cells(self):
+        return {
+            row[:-1]: row[-1]
+            for row in CustomerAssetStats.objects.filter(count__gt=0).values_list(
+                'customer_id', 'asset_type', 'business_criticality', 'status', 'count')
+        }
+
+    def assertStatsMatchAssets(self):
+        self.assertEqual(rebuild_stats(), 0)
+
+    def test_saves_and_deletes_adjust_counts(self):
+        web = self.make_asset('web-01')
+        self.make_asset('web-02')
+        self.make_asset('switch', asset_type='network', business_criticality='critical')
+        self.assertEqual(self.cells(), {
+            (self.acme.pk, 'server', 'normal', True): 2,
+            (self.acme.pk, 'network', 'critical', True): 1,
+        })
+
+        web.status = False
+        web.customer = self.globex
+        web.save()
+        reloaded = Asset.objects.get(name='web-02')
+        reloaded.business_criticality = 'high'
+        reloaded.save(update_fields=['business_criticality'])
+        Asset.objects.get(name='switch').delete()
+        self.assertEqual(self.cells(), {
+            (self.acme.pk, 'server', 'high', True): 1,
+            (self.globex.pk, 'server', 'normal', False): 1,
+        })
+        self.assertStatsMatchAssets()
+
+    def test_saves_of_other_fields_do_not_touch_stats(self):
+        asset = self.make_asset('web-01')
+        asset.configuration = {'location': 'HQ'}
+        with CaptureQueriesContext(connection) as queries:
+            asset.save(update_fields=['configuration'])
+            asset.save()
+        self.assertFalse([q for q in queries.captured_queries if 'customerassetstats' in q['sql']])
+
+    def test_instances_without_loaded_values_are_read_once(self):
+        asset = self.make_asset('web-01')
+        Asset(pk=asset.pk, customer=self.acme, name='web-01', asset_type='storage', ip_address='10.0.0.1').save()
+        Asset.objects.only('pk', 'name').get(pk=asset.pk).delete()
+        self.assertEqual(self.cells(), {})
+        self.assertStatsMatchAssets()
+
+    def test_imports_apply_batch_deltas(self):
+        self.make_asset('web-01')
+        rows = '\n'.join(json.dumps({
+            'customer': self.acme.pk, 'name': name, 'asset_type': asset_type, 'ip_address': '10.0.0.2',
+        }) for name, asset_type in [('web-01', 'storage'), ('web-02', 'server'), ('web-03', 'server')])
+        import_assets(io.StringIO(rows), 'ndjson')
+        self.assertEqual(self.cells(), {
+            (self.acme.pk, 'server', 'normal', True): 2,
+            (self.acme.pk, 'storage', 'normal', True): 1,
+        })
+        self.assertStatsMatchAssets()
+
+    def test_rebuild_corrects_drift(self):
+        self.make_asset('web-01')
+        self.make_asset('nas', customer=self.globex, asset_type='storage')
+        Asset.objects.filter(name='web-01').update(asset_type='network')
+        CustomerAssetStats.objects.filter(customer=self.globex).update(count=5)
+
+        out = io.StringIO()
+        call_command('rebuild_stats', '--customer', str(self.acme.pk), stdout=out)
+        self.assertIn('Corrected 2 stats cells', out.getvalue())
+        self.assertEqual(customer_totals()[self.globex.pk].total, 5)
+        self.assertEqual(rebuild_stats(), 1)
+        self.assertStatsMatchAssets()
+
+    def test_views_show_totals_from_stats(self):
+        self.make_asset('web-01')
+        self.make_asset('web-02', status=False)
+        self.make_asset('nas', customer=self.globex, asset_type='storage', business_criticality='critical')
+        self.client.force_login(self.admin)
+
+        totals = self.client.get(reverse('dashboard')).context['asset_totals']
+        self.assertEqual((totals.total, totals.active, totals.by_type['server']), (3, 2, 2))
+        self.assertEqual(totals.by_criticality['critical'], 1)
+
+        response = self.client.get(reverse('customer-list'))
+        totals = {customer.display_name: customer.asset_totals for customer in response.context['customers']}
+        self.assertEqual((totals['Acme'].total, totals['Acme'].inactive), (2, 1))
+        self.assertEqual(totals['Globex'].types[2], ('storage', 'Storage System', 1))
+        self.assertContains(response, 'Critical: 1')
+
+
+class AssetPollerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = make_customer('Acme')
+
+    def setUp(self):
+        listener = socket.create_server(('127.0.0.1', 0))
+        self.addCleanup(listener.close)
+        self.open_port = listener.getsockname()[1]
+        closed = socket.create_server(('127.0.0.1', 0))
+        self.closed_port = closed.getsockname()[1]
+        closed.close()
+
+    def make_asset(self, name, ports=None, **fields):
+        asset = Asset(customer=self.customer, name=name, asset_type='server', ip_address='127.0.0.1',
+                      configuration={'poll_ports': ports} if ports else {}, **fields)
+        asset.save()
+        return asset
+
+    def test_connects_record_last_checked_and_last_seen(self):
+        up = self.make_asset('up', ports=[self.closed_port, self.open_port])
+        down = self.make_asset('down')
+        unmonitored = self.make_asset('unmonitored', monitoring_status=False)
+        earlier = timezone.now() - timedelta(days=1)
+        Asset.objects.filter(pk=down.pk).update(last_seen=earlier)
+
+        result = Poller(ports=[self.closed_port], timeout=5).run()
+        self.assertEqual((result.checked, result.seen, result.unreachable), (2, 1, 1))
+        up.refresh_from_db()
+        down.refresh_from_db()
+        self.assertTrue(up.reachable)
+        self.assertEqual(up.last_seen, up.last_checked)
+        self.assertIs(down.reachable, False)
+        self.assertEqual(down.last_seen, earlier)
+        self.assertGreater(down.last_checked, earlier)
+        self.assertEqual(Asset.objects.get(pk=unmonitored.pk).last_checked, unmonitored.last_checked)
+
+    def test_ports_entered_as_text(self):
+        # The asset form stores configuration values as strings
+        up = self.make_asset('up', ports=f'{self.closed_port} {self.open_port}')
+        result = Poller(ports=[self.closed_port], timeout=5).run()
+        self.assertEqual(result.seen, 1)
+        up.refresh_from_db()
+        self.assertTrue(up.reachable)
+
+        with self.assertLogs('assets.poller', 'WARNING') as logs:
+            self.assertEqual(poll_ports({'poll_ports': ['22', 'ssh', 70000, True, 443]}, [80], 7), [22, 443])
+            self.assertEqual(poll_ports({'poll_ports': 'ssh'}, [80], 7), [80])
+        self.assertEqual(len(logs.output), 4)
+        self.assertIn("'ssh' of asset 7", logs.output[0])
+        self.assertEqual(poll_ports({'poll_ports': 22}, [80]), [22])
+        self.assertEqual(poll_ports({}, [80]), [80])
+
+    def test_results_are_written_in_batches(self):
+        for i in range(20):
+            self.make_asset(f'host-{i}', ports=[self.open_port])
+        # Two chunk reads, the final empty read, and one bulk_update and one
+        # history append per chunk
+        with self.assertNumQueries(7):
+            result = Poller(timeout=5, chunk_size=10, batch_size=10).run()
+        self.assertEqual(result.seen, 20)
+
+    def test_hosts_that_do_not_answer_time_out(self):
+        self.make_asset('blackhole')
+
+        async def hang(poller, host, port):
+            await asyncio.sleep(60)
+
+        started = time.monotonic()
+        with mock.patch.object(Poller, 'connect', hang):
+            result = Poller(ports=[self.open_port], timeout=0.2).run()
+        self.assertEqual(result.unreachable, 1)
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_concurrency_is_bounded(self):
+        for i in range(20):
+            self.make_asset(f'host-{i}')
+        active = []
+        peak = []
+
+        async def connect(poller, host, port):
+            active.append(port)
+            peak.append(len(active))
+            await asyncio.sleep(0.01)
+            active.pop()
+
+        with mock.patch.object(Poller, 'connect', connect):
+            result = Poller(ports=[self.open_port], concurrency=3, timeout=5).run()
+        self.assertEqual(result.seen, 20)
+        self.assertEqual(max(peak), 3)
+
+    def test_edits_and_imports_leave_poll_times_alone(self):
+        asset = self.make_asset('web-01')
+        checked = asset.last_checked
+        asset.patch_cycle = 14
+        asset.save()
+        row = {'customer': self.customer.pk, 'name': 'web-01', 'asset_type': 'server', 'ip_address': '10.0.0.9'}
+        import_assets(io.StringIO(json.dumps(row)), 'ndjson')
+        self.assertEqual(Asset.objects.get(pk=asset.pk).last_checked, checked)
+
+    def test_command(self):
+        self.make_asset('up')
+        out = io.StringIO()
+        call_command('poll_assets', '--port', str(self.open_port), '--timeout', '5', stdout=out)
+        self.assertIn('Checked 1 assets: 1 reachable, 0 unreachable', out.getvalue())
+
+
+class CheckHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.acme = make_customer('Acme')
+        cls.globex = make_customer('Globex')
+        cls.asset = Asset(customer=cls.acme, name='web-01', asset_type='server', ip_address='10.0.0.1')
+        cls.asset.save()
+        cls.user = make_user('acme-user', customers=[cls.acme])
+
+    def setUp(self):
+        # An hour boundary, with a week of room behind it
+        self.hour = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=1)
+
+    def record_hour(self, hour, down_every=None):
+        """A check a minute for an hour, latency 10-19ms, optionally with misses."""
+        for minute in range(60):
+            latency = None if down_every and minute % down_every == 0 else 10 + minute % 10
+            history.record_checks([(self.asset.pk, hour + timedelta(minutes=minute), latency)])
+
+    def test_checks_are_appended_to_one_chunk_per_hour(self):
+        self.record_hour(self.hour)
+        self.record_hour(self.hour + timedelta(hours=1))
+        chunks = CheckChunk.objects.filter(asset=self.asset, resolution=history.RAW)
+        self.assertEqual([chunk.count for chunk in chunks], [60, 60])
+        self.assertEqual(len(bytes(chunks[0].data)), 60 * history.RAW_POINT.size)
+
+    def test_rollup_and_range_queries_by_tier(self):
+        self.record_hour(self.hour, down_every=6)
+        self.record_hour(self.hour + timedelta(hours=1))
+        now = self.hour + timedelta(hours=2, minutes=2)
+
+        self.assertEqual(history.rollup(now), 1)  # The second hour is too recent
+        hourly = history.unpack_buckets(CheckChunk.objects.get(resolution=history.HOURLY).data)
+        self.assertEqual([(bucket.checks, bucket.up) for bucket in hourly], [(60, 50)])
+        self.assertEqual((hourly[0].latency_min, hourly[0].latency_max), (10.0, 19.0))
+
+        resolution, points = history.history(self.asset.pk, self.hour, now, now)
+        self.assertEqual((resolution, len(points)), (history.RAW, 120))
+        self.assertEqual(sum(point.up for point in points), 110)
+
+        # The coarser tiers add the hour that is not rolled up yet
+        resolution, points = history.history(self.asset.pk, self.hour - timedelta(days=2), now, now)
+        self.assertEqual(resolution, history.FIVE_MINUTES)
+        self.assertEqual((len(points), sum(point.checks for point in points)), (24, 120))
+        resolution, points = history.history(self.asset.pk, self.hour - timedelta(days=20), now, now)
+        self.assertEqual([(resolution, point.checks) for point in points], [(history.HOURLY, 60)] * 2)
+
+    def test_bucket_counts_past_16_bits(self):
+        hour = int(self.hour.timestamp())
+        points = [(hour + i % 3600, 12.5) for i in range(70000)]
+        [bucket] = history.unpack_buckets(history.pack_buckets(history.downsample(points, history.HOURLY)))
+        self.assertEqual((bucket.checks, bucket.up, bucket.latency_avg), (70000, 70000, 12.5))
+
+    def test_locking_fallback_matches_upsert(self):
+        start = history.chunk_start(int(self.hour.timestamp()), history.RAW)
+        first = history.pack_raw([(start, 10.0)])
+        rows = [
+            (self.asset.pk, history.RAW, start, 1, history.pack_raw([(start + 60, None)])),
+            (self.asset.pk, history.RAW, start + 3600, 1, history.pack_raw([(start + 3600, 12.0)])),
+            (self.asset.pk, history.RAW, start, 1, history.pack_raw([(start + 120, 11.0)])),
+        ]
+        history.append_points([(self.asset.pk, history.RAW, start, 1, first)])
+        history.append_points(rows)
+        expected = list(CheckChunk.objects.order_by('start').values_list('start', 'count', 'data'))
+        CheckChunk.objects.all().delete()
+
+        # What other databases run
+        history.extend_chunks([(self.asset.pk, history.RAW, start, 1, first)])
+        history.extend_chunks(rows)
+        chunks = list(CheckChunk.objects.order_by('start').values_list('start', 'count', 'data'))
+        self.assertEqual([(s, c, bytes(d)) for s, c, d in chunks], [(s, c, bytes(d)) for s, c, d in expected])
+        self.assertEqual(chunks[0][1], 3)
+
+    def test_prune_keeps_raw_checks_until_rolled_up(self):
+        self.record_hour(self.hour)
+        later = self.hour + timedelta(days=5)
+        self.assertEqual(history.prune(later), 0)
+        self.assertEqual(history.maintain_history(later), (1, 1))
+        self.assertEqual(
+            sorted(CheckChunk.objects.values_list('resolution', flat=True)), [history.FIVE_MINUTES, history.HOURLY],
+        )
+        with self.settings(CHECK_HISTORY_RETENTION_DAYS={'5m': 1}):
+            self.assertEqual(history.prune(later), 1)
+
+    def test_history_view(self):
+        self.record_hour(self.hour)
+        self.client.force_login(self.user)
+        url = reverse('asset-history', args=[self.asset.pk])
+        end = (self.hour + timedelta(hours=1)).isoformat()
+        response = self.client.get(url, {'start': self.hour.isoformat(), 'end': end, 'resolution': '5m'})
+        data = response.json()
+        self.assertEqual((data['resolution'], len(data['points'])), ('5m', 12))
+        self.assertEqual(data['points'][0][1:], [5, 5, 10.0, 12.0, 14.0])
+
+        self.assertEqual(self.client.get(url, {'hours': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'resolution': '1m'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('asset-detail', args=[self.asset.pk])).status_code, 200)
+
+        other = Asset(customer=self.globex, name='db-01', asset_type='server', ip_address='10.0.0.2')
+        other.save()
+        self.assertEqual(self.client.get(reverse('asset-history', args=[other.pk])).status_code, 404)
+
+
+class LogIngestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.acme = make_customer('Acme')
+        cls.globex = make_customer('Globex')
+        cls.asset = Asset(customer=cls.acme, name='web-01', asset_type='server', ip_address='127.0.0.1')
+        cls.asset.save()
+
+    def setUp(self):
+        # The IP index is held per process; ids are reused between tests
+        cache.clear()
+
+    def ingestor(self, **kwargs):
+        return Ingestor(resolver=AssetResolver(refresh_interval=0), **kwargs)
+
+    def configure(self, **configuration):
+        self.asset.configuration = configuration
+        self.asset.save()
+
+    def test_syslog_and_ndjson_lines(self):
+        ingestor = self.ingestor()
+        ingestor.ingest([
+            '<34>1 2026-10-11T22:14:15.003Z web-01 sshd 4321 ID47 [origin ip="127.0.0.1"] Failed password for root',
+            '<13>Oct 11 22:14:15 web-01 cron[99]: job started',
+            '{"msg": "request done", "level": "warn", "time": 1760220855, "status": 502}',
+            'no header at all',
+            '',
+        ], source_ip='127.0.0.1')
+        self.assertEqual(ingestor.stats.written, 4)
+        events = list(LogEvent.objects.filter(asset=self.asset).order_by('pk'))
+        self.assertEqual(
+            [(event.severity, event.facility, event.hostname, event.app, event.message) for event in events],
+            [
+                (2, 4, 'web-01', 'sshd', 'Failed password for root'),
+                (5, 1, 'web-01', 'cron', 'job started'),
+                (4, None, '', '', 'request done'),
+                (None, None, '', '', 'no header at all'),
+            ],
+        )
+        self.assertEqual(events[0].timestamp.isoformat(), '2026-10-11T22:14:15.003000+00:00')
+        self.assertEqual((events[1].timestamp.month, events[1].timestamp.day), (10, 11))
+        self.assertEqual(events[2].fields, {'status': 502})
+
+    def test_asset_settings_filter_and_map_fields(self):
+        self.configure(log_min_severity='warning', log_exclude=['^health', '(unclosed'], log_message_field='text')
+        with self.assertLogs('assets.ingest', 'WARNING'):
+            ingestor = self.ingestor()
+            ingestor.resolver.refresh()
+        ingestor.ingest([
+            '{"text": "disk full", "severity": 2}',
+            '{"text": "health check ok", "severity": 3}',
+            '{"text": "user logged in", "severity": "info"}',
+        ], source_ip='127.0.0.1')
+        self.assertEqual((ingestor.stats.written, ingestor.stats.filtered), (1, 2))
+        self.assertEqual(LogEvent.objects.get().message, 'disk full')
+
+        self.configure(log_enabled='false')
+        ingestor = self.ingestor()
+        ingestor.ingest(['<13>Oct 11 22:14:15 web-01 cron: ignored'], source_ip='127.0.0.1')
+        self.assertEqual(ingestor.stats.filtered, 1)
+
+        self.configure(log_format='ndjson')
+        ingestor = self.ingestor()
+        ingestor.ingest(['<13>Oct 11 22:14:15 web-01 cron: not json'], source_ip='127.0.0.1')
+        self.assertEqual(ingestor.stats.malformed, 1)
+
+    def test_unmatched_and_shared_addresses_are_counted(self):
+        shared = Asset(customer=self.acme, name='lb-01', asset_type='network', ip_address='10.0.0.9')
+        shared.save()
+        Asset(customer=self.globex, name='lb-01', asset_type='network', ip_address='10.0.0.9').save()
+        ingestor = self.ingestor()
+        ingestor.ingest(['hello'], source_ip='10.0.0.8')
+        ingestor.ingest(['hello'], source_ip='10.0.0.9')
+        self.assertEqual((ingestor.stats.unmatched, ingestor.stats.ambiguous, ingestor.stats.written), (1, 1, 0))
+        # Scoped to one customer, the address is that customer's asset
+        resolver = AssetResolver(customer_ids=[self.acme.pk])
+        resolver.refresh()
+        self.assertEqual(resolver.get('10.0.0.9').asset_id, shared.pk)
+
+    def test_index_follows_asset_changes(self):
+        # As with a shared cache: the version bumps of these saves reach it
+        resolver = AssetResolver(refresh_interval=0, watch_database=False)
+        resolver.refresh()
+        self.assertEqual(resolver.get('::ffff:127.0.0.1').asset_id, self.asset.pk)
+        self.assertIsNone(resolver.get('10.1.1.1'))
+
+        self.asset.ip_address = '10.1.1.1'
+        self.asset.save()
+        resolver.refresh()
+        self.assertIsNone(resolver.get('127.0.0.1'))
+        self.assertEqual(resolver.get('10.1.1.1').asset_id, self.asset.pk)
+
+        # Saves that do not touch the index leave it alone
+        with mock.patch.object(IPIndex, 'load') as load:
+            self.asset.notes = 'moved'
+            self.asset.save()
+            resolver.refresh()
+        load.assert_not_called()
+
+        Asset(customer=self.globex, name='other', asset_type='server', ip_address='10.1.1.1').save()
+        resolver.refresh()
+        self.assertIs(resolver.get('10.1.1.1'), AMBIGUOUS)
+
+    def test_per_process_cache_falls_back_to_the_database(self):
+        resolver = AssetResolver(refresh_interval=0)
+        self.assertTrue(resolver.watch_database)  # LocMemCache in tests
+        resolver.refresh()
+        self.assertIsNone(resolver.get('10.1.1.1'))
+        # Written by another process: no bump reaches this one
+        Asset.objects.filter(pk=self.asset.pk).update(
+            ip_address='10.1.1.1', ip_key=ip_key('10.1.1.1'),
+            configuration={'log_format': 'ndjson'}, updated_at=timezone.now() + timedelta(seconds=1),
+        )
+        resolver.refresh()
+        target = resolver.get('10.1.1.1')
+        self.assertEqual(target.asset_id, self.asset.pk)
+        self.assertEqual(target.settings.format, 'ndjson')
+
+    def test_udp_and_tcp_listeners(self):
+        ingestor = self.ingestor()
+        udp = UDPSource(ingestor, '127.0.0.1', 0)
+        tcp = TCPSource(ingestor, '127.0.0.1', 0)
+        for source in (udp, tcp):
+            source.start()
+            self.addCleanup(source.close)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+            sender.sendto(b'<11>Oct 11 22:14:15 web-01 app: over udp\n', udp.address)
+        with socket.create_connection(tcp.address) as sender:
+            sender.sendall(b'<11>Oct 11 22:14:15 web-01 app: over tcp\n{"message": "also tcp"}\n')
+        deadline = time.monotonic() + 5
+        while ingestor.stats.received < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        ingestor.drain()
+        self.assertEqual(
+            sorted(LogEvent.objects.values_list('message', flat=True)), ['also tcp', 'over tcp', 'over udp'],
+        )
+
+    def test_full_queue_drops_only_unblocked_lines(self):
+        ingestor = self.ingestor(queue_size=2)
+        self.assertTrue(ingestor.submit('127.0.0.1', 'one', block=False))
+        self.assertTrue(ingestor.submit('127.0.0.1', 'two', block=False))
+        self.assertFalse(ingestor.submit('127.0.0.1', 'three', block=False))
+        with self.assertRaises(queue.Full):
+            # A blocking submit waits for room instead
+            ingestor.queue.put(('127.0.0.1', 'four', timezone.now()), timeout=0.05)
+        with self.assertLogs('assets.ingest', 'WARNING'):
+            ingestor.drain()
+        self.assertEqual((ingestor.stats.received, ingestor.stats.dropped, ingestor.stats.written), (2, 1, 2))
+
+    def test_events_are_written_in_batches(self):
+        resolver = AssetResolver(refresh_interval=0, watch_database=False)
+        ingestor = Ingestor(resolver=resolver, batch_size=50)
+        resolver.refresh()
+        # One insert per batch
+        with self.assertNumQueries(2):
+            ingestor.ingest([f'line {i}' for i in range(100)], source_ip='127.0.0.1')
+        self.assertEqual(LogEvent.objects.count(), 100)
+
+    @mock.patch('assets.ingest.time.sleep')
+    def test_failed_writes_are_retried_then_counted(self, sleep):
+        ingestor = self.ingestor(batch_size=10, write_attempts=3, retry_delay=0.5)
+        locked = OperationalError('database is locked')
+        with mock.patch('assets.ingest.write_events', side_effect=[locked, locked, None]):
+            ingestor.ingest([f'line {i}' for i in range(10)], source_ip='127.0.0.1')
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [0.5, 1.0])
+        self.assertEqual((ingestor.stats.written, ingestor.stats.failed), (10, 0))
+
+        with mock.patch('assets.ingest.write_events', side_effect=locked), \
+                self.assertLogs('assets.ingest', 'ERROR'):
+            ingestor.ingest([f'lost {i}' for i in range(10)], source_ip='127.0.0.1')
+        self.assertEqual((ingestor.stats.failed, ingestor.pending), (10, []))
+        # Ingestion goes on
+        ingestor.ingest(['after'], source_ip='127.0.0.1')
+        self.assertEqual(ingestor.stats.written, 11)
+
+    def test_command_reads_files(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False) as log:
+            log.write('<14>Oct 11 22:14:15 127.0.0.1 nginx: from the host field\n')
+            log.write('<14>Oct 11 22:14:15 somewhere nginx: unknown host\n')
+        self.addCleanup(Path(log.name).unlink)
+        out = io.StringIO()
+        call_command('ingest_logs', file=[log.name], stdout=out)
+        self.assertIn('1 written', out.getvalue())
+        self.assertIn('1 unmatched', out.getvalue())
+        call_command('ingest_logs', file=[log.name], source_ip='127.0.0.1', stdout=out)
+        self.assertEqual(LogEvent.objects.filter(asset=self.asset).count(), 3)
+
+        self.client.force_login(make_user('acme-user', customers=[self.acme]))
+        response = self.client.get(reverse('asset-detail', args=[self.asset.pk]))
+        self.assertContains(response, 'from the host field')
+
+
+class IPIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.acme = make_customer('Acme')
+        cls.globex = make_customer('Globex')
+        cls.assets = {}
+        for customer, name, ip_address in [
+            (cls.acme, 'gw', '10.0.0.1'),
+            (cls.acme, 'web', '10.0.0.20'),
+            (cls.globex, 'web', '10.0.0.20'),
+            (cls.globex, 'db', '10.0.1.5'),
+            (cls.acme, 'v6', '2001:db8::10'),
+            (cls.globex, 'lo', '::1'),
+        ]:
+            asset = Asset(customer=customer, name=name, asset_type='server', ip_address=ip_address)
+            asset.save()
+            cls.assets[customer.display_name, name] = asset.pk
+
+    def setUp(self):
+        # The IP index is held per process; ids are reused between tests
+        cache.clear()
+
+    def names(self, hits):
+        names = {pk: key for key, pk in self.assets.items()}
+        return [names[hit.asset_id] for hit in hits]
+
+    def test_exact_and_network_lookups(self):
+        index = IPIndex.load()
+        self.assertEqual(len(index), 6)
+        self.assertEqual(self.names(index.lookup('10.0.0.20')), [('Acme', 'web'), ('Globex', 'web')])
+        self.assertEqual(self.names(index.lookup('10.0.0.20', [self.globex.pk])), [('Globex', 'web')])
+        self.assertEqual(index.lookup('10.0.0.21'), [])
+        self.assertEqual(str(index.lookup('::ffff:10.0.0.1')[0].address), '10.0.0.1')
+        with self.assertRaises(ValueError):
+            index.lookup('not an address')
+
+        self.assertEqual(
+            self.names(index.in_network('10.0.0.0/16')),
+            [('Acme', 'gw'), ('Acme', 'web'), ('Globex', 'web'), ('Globex', 'db')],
+        )
+        self.assertEqual(
+            self.names(index.in_network('10.0.0.0/16', [self.globex.pk, self.acme.pk], limit=3)),
+            [('Acme', 'gw'), ('Acme', 'web'), ('Globex', 'web')],
+        )
+        # Everything, in address order: IPv6 below the IPv4-mapped range first
+        self.assertEqual(
+            self.names(index.in_network('::/0'))[::5], [('Globex', 'lo'), ('Acme', 'v6')],
+        )
+
+    def test_longest_prefix(self):
+        index = IPIndex.load()
+        network, hits = index.longest_prefix('10.0.0.7')
+        self.assertEqual((str(network), self.names(hits)), ('10.0.0.0/29', [('Acme', 'gw')]))
+        network, hits = index.longest_prefix('10.0.1.4', [self.acme.pk])
+        self.assertEqual((str(network), self.names(hits)), ('10.0.0.0/23', [('Acme', 'gw'), ('Acme', 'web')]))
+        network, hits = index.longest_prefix('2001:db8::10')
+        self.assertEqual((str(network), self.names(hits)), ('2001:db8::10/128', [('Acme', 'v6')]))
+        self.assertEqual(index.longest_prefix('::2', [self.acme.pk])[0].prefixlen, 2)
+        self.assertEqual(IPIndex().longest_prefix('10.0.0.1'), (None, []))
+
+    @mock.patch('assets.ipindex.versions_are_shared', return_value=True)
+    def test_rebuilt_after_address_changes(self, shared):
+        index = get_ip_index()
+        self.assertIs(get_ip_index(), index)
+        asset = Asset.objects.get(pk=self.assets['Acme', 'gw'])
+        asset.notes = 'edge router'
+        asset.save()
+        self.assertIs(get_ip_index(), index)
+
+        asset.ip_address = '192.168.0.1'
+        asset.save()
+        self.assertIsNot(get_ip_index(), index)
+        self.assertEqual(self.names(get_ip_index().lookup('192.168.0.1')), [('Acme', 'gw')])
+
+        index = get_ip_index()
+        asset.delete()
+        self.assertEqual(get_ip_index().lookup('192.168.0.1'), [])
+
+    def test_per_process_cache_follows_the_database(self):
+        # Writes from other processes, whose version bumps never arrive
+        index = get_ip_index()
+        self.assertIs(get_ip_index(), index)
+        Asset.objects.filter(pk=self.assets['Acme', 'gw']).update(
+            ip_address='192.168.0.1', ip_key=ip_key('192.168.0.1'), updated_at=timezone.now(),
+        )
+        self.assertEqual(self.names(get_ip_index().lookup('192.168.0.1')), [('Acme', 'gw')])
+        Asset.objects.filter(pk=self.assets['Acme', 'gw']).delete()
+        self.assertEqual(get_ip_index().lookup('192.168.0.1'), [])
+
+
+class AssetApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.acme = make_customer('Acme')
+        cls.globex = make_customer('Globex')
+        cls.user = make_user('acme-user', customers=[cls.acme])
+        cls.admin = make_user('admin', role='admin')
+        for i in range(5):
+            Asset(customer=cls.acme, name=f'acme-{i}', asset_type='server', ip_address=f'10.0.0.{i}',
+                  configuration={'location': 'HQ' if i % 2 else 'DC'}).save()
+        Asset(customer=cls.globex, name='globex-0', asset_type='network', ip_address='10.1.0.1').save()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def get(self, url, params=None, **headers):
+        return self.client.get(url, params or {}, headers=headers)
+
+    def test_list_is_scoped_paginated_and_sparse(self):
+        url = reverse('api-asset-list')
+        response = self.get(url, {'fields': 'name,ip_address', 'page_size': 2, 'sort': 'name'})
+        data = response.json()
+        self.assertEqual(data['results'], [
+            {'name': 'acme-0', 'ip_address': '10.0.0.0'}, {'name': 'acme-1', 'ip_address': '10.0.0.1'},
+        ])
+        self.assertIsNone(data['previous'])
+        names = [row['name'] for row in data['results']]
+        while data['next']:
+            data = self.client.get(data['next']).json()
+            names += [row['name'] for row in data['results']]
+        self.assertEqual(names, [f'acme-{i}' for i in range(5)])
+
+        data = self.get(url, {'config.location': 'HQ', 'fields': 'name'}).json()
+        self.assertEqual(data['results'], [{'name': 'acme-1'}, {'name': 'acme-3'}])
+        data = self.get(url, {'customer': self.globex.pk}).json()
+        self.assertEqual(data['results'], [])
+        row = self.get(url, {'page_size': 1}).json()['results'][0]
+        self.assertEqual(list(row), ASSET_FIELDS)
+
+        self.assertEqual(self.get(url, {'fields': 'name,password'}).status_code, 400)
+        self.assertEqual(self.get(url, {'sort': 'ip_key'}).status_code, 400)
+        self.assertEqual(self.get(url, {'cursor': 'garbage'}).status_code, 400)
+        self.assertEqual(self.get(url, {'updated_since': 'yesterday'}).status_code, 400)
+
+    def test_next_links_cover_bulk_imports_for_every_sort(self):
+        # Rows written by one bulk import share timestamps down to the
+        # millisecond, which a rounded cursor would skip or repeat
+        cache.clear()
+        import_assets(io.StringIO('name,asset_type,ip_address\n' + ''.join(
+            f'bulk-{i:03d},server,10.2.{i // 250}.{i % 250}\n' for i in range(150)
+        )), 'csv', default_customer_id=self.acme.pk)
+        expected = set(Asset.objects.filter(customer=self.acme).values_list('pk', flat=True))
+        for sort in AssetListApiView.sort_options:
+            with self.subTest(sort=sort):
+                data = self.get(reverse('api-asset-list'), {'sort': sort, 'page_size': 20, 'fields': 'id'}).json()
+                ids = [row['id'] for row in data['results']]
+                while data['next'] and len(ids) <= len(expected):
+                    data = self.client.get(data['next']).json()
+                    ids += [row['id'] for row in data['results']]
+                self.assertEqual(len(ids), len(expected))
+                self.assertEqual(set(ids), expected)
+
+    def test_list_reads_one_page_in_one_query(self):
+        self.get(reverse('api-asset-list'))  # Caches the scope
+        # Session, user, the page's validators and its rows
+        with self.assertNumQueries(4):
+            response = self.get(reverse('api-asset-list'), {'fields': 'name'})
+        self.assertEqual(len(response.json()['results']), 5)
+
+    def test_conditional_requests(self):
+        url = reverse('api-asset-list')
+        response = self.get(url, {'fields': 'name'})
+        etag = response.headers['ETag']
+        self.assertEqual(self.get(url, {'fields': 'name'}, if_none_match=etag).status_code, 304)
+        # Another representation has another tag
+        self.assertEqual(self.get(url, {'fields': 'id'}, if_none_match=etag).status_code, 200)
+
+        asset = Asset.objects.get(name='acme-2')
+        detail = reverse('api-asset-detail', args=[asset.pk])
+        response = self.get(detail)
+        self.assertEqual(response.json()['name'], 'acme-2')
+        detail_etag = response.headers['ETag']
+        # Session, user and the validators
+        with self.assertNumQueries(3):
+            self.assertEqual(self.get(detail, if_none_match=detail_etag).status_code, 304)
+        self.assertEqual(self.get(detail, if_modified_since=response.headers['Last-Modified']).status_code, 304)
+
+        # A poll moves last_checked only
+        later = timezone.now() + timedelta(minutes=5)
+        Asset.objects.bulk_update([Asset(pk=asset.pk, last_checked=later)], ['last_checked'])
+        self.assertEqual(self.get(detail, if_none_match=detail_etag).status_code, 200)
+        self.assertEqual(self.get(url, {'fields': 'name'}, if_none_match=etag).status_code, 200)
+
+        response = self.get(detail)
+        asset.refresh_from_db()
+        asset.business_criticality = 'high'
+        asset.save()
+        response = self.get(detail, if_none_match=response.headers['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['business_criticality'], 'high')
+
+    def test_new_page_changes_the_etag(self):
+        params = {'customer': self.acme.pk, 'sort': '-name', 'page_size': 5, 'fields': 'name'}
+        response = self.get(reverse('api-asset-list'), params)
+        self.assertIsNone(response.json()['next'])
+        self.assertNotIn('Last-Modified', response.headers)
+        # Sorts after the whole page, so the page's rows do not change
+        Asset(customer=self.acme, name='acme', asset_type='server', ip_address='10.0.0.9').save()
+        response = self.get(reverse('api-asset-list'), params, if_none_match=response.headers['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.json()['next'])
+
+    def test_updated_since(self):
+        asset = Asset.objects.get(name='acme-3')
+        since = timezone.now()
+        asset.status = False
+        asset.save()
+        data = self.get(reverse('api-asset-list'), {'updated_since': since.isoformat(), 'fields': 'name,status'}).json()
+        self.assertEqual(data['results'], [{'name': 'acme-3', 'status': False}])
+
+    def test_detail_and_customers_are_scoped(self):
+        other = Asset.objects.get(name='globex-0')
+        self.assertEqual(self.get(reverse('api-asset-detail', args=[other.pk])).status_code, 404)
+        data = self.get(reverse('api-customer-list'), {'fields': 'id,display_name'}).json()
+        self.assertEqual(data['results'], [{'id': self.acme.pk, 'display_name': 'Acme'}])
+        self.assertEqual(self.get(reverse('api-customer-detail', args=[self.globex.pk])).status_code, 404)
+
+        # Managers list every customer, as on the customer pages
+        manager = make_user('manager', role='manager', customers=[self.acme])
+        self.client.force_login(manager)
+        self.assertEqual(len(self.get(reverse('api-customer-list')).json()['results']), 2)
+        self.assertEqual(len(self.client.get(reverse('customer-list')).context['customers']), 2)
+
+        self.client.force_login(self.admin)
+        self.assertEqual(self.get(reverse('api-asset-detail', args=[other.pk])).json()['customer'], self.globex.pk)
+        self.assertEqual(len(self.get(reverse('api-customer-list')).json()['results']), 2)
+
+        self.client.logout()
+        response = self.get(reverse('api-asset-list'))
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('error', response.json())
+
+
+@override_settings(JOURNAL_ASYNC=False)
+class ChangeJournalTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = make_customer('Acme')
+        cls.other = make_customer('Globex')
+        cls.admin = make_user('admin', role='admin')
+
+    def setUp(self):
+        cache.clear()
+
+    def history(self, obj):
+        return list(object_history(type(obj), obj.pk).order_by('changed_at', 'id'))
+
+    def test_view_changes_are_recorded_with_their_author(self):
+        asset = Asset(customer=self.customer, name='web-1', asset_type='server', ip_address='10.0.0.1')
+        asset.save()
+        self.client.force_login(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('asset-update', args=[asset.pk]), {
+                'customer': self.customer.pk, 'name': 'web-1', 'asset_type': 'server', 'ip_address': '10.0.0.2',
+                'status': 'on', 'business_criticality': 'high', 'patch_cycle': 30, 'configuration': 'location=HQ',
+            })
+        self.assertEqual(response.status_code, 302)
+        entry, = self.history(asset)
+        self.assertEqual((entry.action, entry.actor_id, entry.actor_name, entry.customer_id),
+                         ('update', self.admin.pk, 'admin', self.customer.pk))
+        self.assertEqual(entry.changes, {
+            'ip_address': ['10.0.0.1', '10.0.0.2'],
+            'business_criticality': ['normal', 'high'],
+            'configuration': [{}, {'location': 'HQ'}],
+        })
+        response = self.client.get(reverse('asset-detail', args=[asset.pk]))
+        self.assertContains(response, '10.0.0.1 &rarr; 10.0.0.2')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('asset-delete', args=[asset.pk]))
+        self.assertEqual([entry.action for entry in self.history(asset)], ['update', 'delete'])
+        self.assertEqual(self.history(asset)[-1].changes['name'], ['web-1', None])
+
+    def test_polls_and_rollbacks_leave_no_entries(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            asset = Asset(customer=self.customer, name='db-1', asset_type='server', ip_address='10.0.0.1')
+            asset.save()
+        created, = self.history(asset)
+        self.assertEqual(created.action, 'create')
+        self.assertEqual(created.changes['name'], [None, 'db-1'])
+        self.assertEqual(created.actor_name, '')
+
+        asset.last_checked = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(1):
+            asset.save(update_fields=['last_checked'])
+        # Nothing is written before the commit
+        with self.captureOnCommitCallbacks():
+            asset.name = 'db-2'
+            asset.save()
+        self.assertEqual(len(self.history(asset)), 1)
+
+    def test_deferred_instances_and_role_assignments(self):
+        asset = Asset(customer=self.customer, name='nas', asset_type='storage', ip_address='10.0.0.5')
+        asset.save()
+        with self.captureOnCommitCallbacks(execute=True), acting_as(self.admin):
+            deferred = Asset.objects.only('pk').get(pk=asset.pk)
+            deferred.patch_cycle = 90
+            deferred.save(update_fields=['patch_cycle'])
+        self.assertEqual(self.history(asset)[-1].changes, {'patch_cycle': [30, 90]})
+
+        user = make_user('member', customers=[self.customer])
+        role = user.userrole
+        acme, globex = self.customer.pk, self.other.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            role.customers.add(self.other)
+            self.other.userrole_set.remove(role)
+            role.customers.add(self.customer)  # Already assigned
+            role.role = 'manager'
+            role.save()
+            self.customer.delete()
+        changes = [entry.changes for entry in self.history(role)]
+        self.assertEqual(changes, [
+            {'customers': [[acme], [acme, globex]]},
+            {'customers': [[acme, globex], [acme]]},
+            {'role': ['user', 'manager']},
+            {'customers': [[acme], []]},
+        ])
+        # The customer and its cascaded assets, under the customer
+        self.assertEqual(
+            sorted((entry.object_type, entry.action) for entry in customer_history(acme) if entry.action == 'delete'),
+            [('asset', 'delete'), ('customer', 'delete')],
+        )
+
+    def test_provisioning_and_patch_runs_are_recorded(self):
+        user, = User.objects.bulk_create([User(username='alice')])
+        with self.captureOnCommitCallbacks(execute=True), acting_as(self.admin):
+            provision_users([user])
+            provision_users([user])  # Already provisioned: nothing new
+        role, = self.history(UserRole.objects.get(user=user))
+        self.assertEqual((role.action, role.actor_name, role.changes),
+                         ('create', 'admin', {'user': [None, user.pk], 'role': [None, 'user']}))
+        customer = Customer.objects.get(user=user)
+        created, = self.history(customer)
+        self.assertEqual((created.action, created.customer_id), ('create', customer.pk))
+        self.assertEqual(created.changes['display_name'], [None, 'Customer alice'])
+
+        asset = Asset(customer=customer, name='web-1', asset_type='server', ip_address='10.0.0.1')
+        asset.save()
+        first, second = timezone.now() - timedelta(days=1), timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            mark_patched(Asset.objects.filter(pk=asset.pk), when=first)
+            mark_patched(Asset.objects.filter(pk=asset.pk), when=second)
+            mark_patched(Asset.objects.filter(pk=asset.pk), when=second)
+        encode = DjangoJSONEncoder().default
+        self.assertEqual([entry.changes for entry in self.history(asset)], [
+            {'last_patched': [None, encode(first)]},
+            {'last_patched': [encode(first), encode(second)]},
+        ])
+
+    def test_bulk_import_is_recorded(self):
+        Asset(customer=self.customer, name='web-1', asset_type='server', ip_address='10.0.0.1').save()
+        with self.captureOnCommitCallbacks(execute=True):
+            import_assets(io.StringIO(
+                'name,asset_type,ip_address\n'
+                'web-1,server,10.0.0.9\n'
+                'web-2,server,10.0.0.2\n'
+            ), 'csv', default_customer_id=self.customer.pk)
+        entries = {
+            (entry.object_id, entry.action): entry.changes
+            for entry in customer_history(self.customer.pk, start=timezone.now() - timedelta(minutes=1))
+        }
+        web1, web2 = Asset.objects.filter(name__in=['web-1', 'web-2']).order_by('name')
+        self.assertEqual(entries[(web1.pk, 'update')], {'ip_address': ['10.0.0.1', '10.0.0.9']})
+        self.assertEqual(entries[(web2.pk, 'create')]['ip_address'], [None, '10.0.0.2'])
+        self.assertFalse(customer_history(self.customer.pk, end=timezone.now() - timedelta(minutes=1)).exists())
+
+    def test_compaction_folds_old_entries_into_snapshots(self):
+        asset = Asset(customer=self.customer, name='fw', asset_type='network', ip_address='10.0.0.1')
+        gone = Asset(customer=self.customer, name='old', asset_type='network', ip_address='10.0.0.2')
+        with self.captureOnCommitCallbacks(execute=True):
+            asset.save()
+            gone.save()
+            for address in ['10.0.0.3', '10.0.0.4']:
+                asset.ip_address = address
+                asset.save()
+            gone_pk = gone.pk
+            gone.delete()
+        cutoff = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            asset.status = False
+            asset.save()
+
+        self.assertEqual(compact(cutoff), (2, 3))
+        snapshot, latest = self.history(asset)
+        self.assertEqual(snapshot.action, 'snapshot')
+        self.assertEqual((snapshot.changes['ip_address'], snapshot.changes['status']), ('10.0.0.4', True))
+        self.assertEqual(latest.changes, {'status': [True, False]})
+        deleted, = object_history(Asset, gone_pk)
+        self.assertEqual(deleted.action, 'delete')
+        # Repeating changes nothing
+        self.assertEqual(compact(cutoff), (0, 0))
+
+    def test_writer_batches_and_overflows_to_the_caller(self):
+        batches = queue.Queue()
+        writer = JournalWriter(batch_size=3, queue_size=4, flush_interval=0.05, write=batches.put)
+        with self.assertLogs('assets.journal', 'WARNING'):
+            writer.submit(list(range(10)))
+        writer.flush()
+        written = []
+        while not batches.empty():
+            batch = batches.get()
+            written.extend(batch)
+        self.assertEqual(sorted(written), list(range(10)))
+        # The thread starts after the first four are queued
+        self.assertEqual(writer.overflowed, 6)
+
+
+class InventorySnapshotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = make_customer('Acme')
+        cls.assets = []
+        for i, address in enumerate(['10.0.0.1', '10.0.0.2', '2001:db8::1', '10.0.0.4']):
+            asset = Asset(customer=cls.customer, name=f'host-{i}', asset_type='server', ip_address=address,
+                          configuration={'rack': str(i)})
+            asset.save()
+            cls.assets.append(asset)
+        Asset(customer=make_customer('Globex'), name='other', asset_type='network', ip_address='10.9.9.9').save()
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        settings = override_settings(INVENTORY_SNAPSHOT_DIR=self.dir)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_snapshot_round_trip(self):
+        patched = timezone.now().replace(microsecond=123456)
+        Asset.objects.filter(pk=self.assets[0].pk).update(
+            business_criticality='critical', last_patched=patched, monitoring_status=False,
+        )
+        snapshot = take_snapshot(self.customer.pk)
+        self.assertEqual(snapshot.asset_count, 4)
+        self.assertEqual(snapshot.size, (self.dir / snapshot.path).stat().st_size)
+        with open_snapshot(snapshot) as data:
+            self.assertEqual(list(data.ids), [asset.pk for asset in self.assets])
+            first, *_, ipv6, last = data.rows()
+            self.assertEqual(first, {
+                'id': self.assets[0].pk, 'name': 'host-0', 'asset_type': 'server', 'ip_address': '10.0.0.1',
+                'status': True, 'monitoring_status': False, 'business_criticality': 'critical', 'patch_cycle': 30,
+                'last_patched': patched, 'configuration': {'rack': '0'},
+            })
+            self.assertEqual((ipv6['ip_address'], last['ip_address']), ('2001:db8::1', '10.0.0.4'))
+            self.assertEqual(data.get(self.assets[3].pk)['last_patched'], None)
+            self.assertIsNone(data.get(0))
+
+        (self.dir / 'junk.snap').write_bytes(b'not a snapshot')
+        with self.assertRaises(SnapshotError):
+            Snapshot(self.dir / 'junk.snap')
+
+    def test_diff_between_dates(self):
+        first = take_snapshot(self.customer.pk, timezone.now() - timedelta(days=2))
+        changed = Asset.objects.get(pk=self.assets[1].pk)
+        changed.ip_address = '10.0.1.2'
+        changed.configuration = {'rack': '1', 'row': 'B'}
+        changed.save()
+        Asset.objects.filter(pk=self.assets[2].pk).delete()
+        added = Asset(customer=self.customer, name='new', asset_type='storage', ip_address='10.0.0.5')
+        added.save()
+        second = take_snapshot(self.customer.pk)
+
+        self.assertEqual(snapshot_at(self.customer.pk, timezone.now() - timedelta(days=1)), first)
+        self.assertIsNone(snapshot_at(self.customer.pk, timezone.now() - timedelta(days=3)))
+        with open_snapshot(first) as old, open_snapshot(second) as new:
+            diff = diff_snapshots(old, new)
+            self.assertEqual((diff.added, diff.removed), ([added.pk], [self.assets[2].pk]))
+            self.assertEqual(diff.changed, {changed.pk: {
+                'ip_address': ('10.0.0.2', '10.0.1.2'),
+                'configuration': ({'rack': '1'}, {'rack': '1', 'row': 'B'}),
+            }})
+            self.assertFalse(diff_snapshots(new, new))
+
+        out = io.StringIO()
+        call_command('diff_inventory', str(self.customer.pk), (timezone.now() - timedelta(days=1)).date().isoformat(),
+                     stdout=out)
+        self.assertIn('1 added, 1 removed, 1 changed', out.getvalue())
+
+    def test_command_snapshots_every_customer_and_prunes(self):
+        old = take_snapshot(self.customer.pk, timezone.now() - timedelta(days=30))
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('snapshot_inventory', retention_days=7, stdout=io.StringIO())
+        self.assertEqual(InventorySnapshot.objects.count(), 2)
+        self.assertFalse(InventorySnapshot.objects.filter(pk=old.pk).exists())
+        self.assertFalse((self.dir / old.path).exists())
+
+
+class InstrumentationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = make_customer('Acme')
+        for i in range(3):
+            Asset(customer=cls.customer, name=f'host-{i}', asset_type='server', ip_address=f'10.0.0.{i}').save()
+        cls.admin = make_user('admin', role='admin')
+        cls.member = make_user('member', customers=[cls.customer])
+
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.addCleanup(registry.reset)
+
+    def test_views_are_measured(self):
+        self.client.force_login(self.member)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('dashboard'))
+        self.assertEqual(registry.snapshot()['dashboard'].histograms['queries'].sum, len(queries))
+        self.client.get(reverse('dashboard'))
+        self.client.get('/no-such-page/')
+        stats = registry.snapshot()
+        dashboard = stats['dashboard']
+        self.assertEqual(dashboard.requests, 2)
+        self.assertEqual(dashboard.histograms['queries'].count, 2)
+        self.assertGreater(dashboard.histograms['template_seconds'].sum, 0)
+        self.assertGreaterEqual(
+            dashboard.histograms['request_seconds'].sum,
+            dashboard.histograms['sql_seconds'].sum + dashboard.histograms['template_seconds'].sum,
+        )
+        self.assertEqual(stats['<unresolved>'].requests, 1)
+
+        with override_settings(INSTRUMENTATION_SAMPLE_RATE=0):
+            client = Client()  # Middleware reads the rate when it is loaded
+            client.force_login(self.member)
+            client.get(reverse('dashboard'))
+        dashboard = registry.snapshot()['dashboard']
+        self.assertEqual((dashboard.requests, dashboard.histograms['queries'].count), (3, 2))
+
+    def test_metrics_endpoint(self):
+        self.client.force_login(self.member)
+        self.client.get(reverse('dashboard'))
+        # No address is trusted by default, loopback included
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        with override_settings(METRICS_ALLOWED_IPS=['127.0.0.1']):
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        text = response.content.decode()
+        self.assertIn('asset_manager_requests_total{view="dashboard"} 1\n', text)
+        self.assertIn('# TYPE asset_manager_queries histogram\n', text)
+        self.assertIn('asset_manager_request_seconds_bucket{view="dashboard",le="+Inf"} 1\n', text)
+        self.assertRegex(text, r'asset_manager_queries_count\{view="dashboard"\} 1\n')
+
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='192.0.2.1').status_code, 403)
+        self.client.force_login(self.admin)
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='192.0.2.1').status_code, 200)
+
+    def test_performance_page_is_for_admins(self):
+        self.client.force_login(self.member)
+        self.client.get(reverse('dashboard'))
+        self.assertEqual(self.client.get(reverse('performance')).status_code, 403)
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('performance'))
+        self.assertContains(response, '<code>dashboard</code>')
+        self.client.post(reverse('performance'))
+        self.assertNotIn('dashboard', registry.snapshot())
+
+    def test_histogram_quantiles(self):
+        histogram = Histogram((1, 2, 5, 10))
+        self.assertIsNone(histogram.quantile(0.5))
+        for value in [0.5, 1.5, 1.5, 3, 4, 20]:
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [1, 2, 2, 0, 1])
+        self.assertEqual(histogram.quantile(0.5), 2)
+        # Rank 4.5 is 1.5 into the two values between 2 and 5
+        self.assertEqual(histogram.quantile(0.75), 2 + 3 * 1.5 / 2)
+        self.assertEqual(histogram.quantile(1), 10)
+
+
+class BenchmarkDataTests(TestCase):
+    def test_seed_benchmark_data(self):
+        out = io.StringIO()
+        call_command('seed_benchmark_data', customers=5, assets=200, users=30, password='secret', stdout=out)
+        self.assertIn('Created 5 customers, 200 assets and 30 users', out.getvalue())
+        self.assertEqual(Asset.objects.count(), 200)
+        self.assertEqual(sum(CustomerAssetStats.objects.values_list('count', flat=True)), 200)
+        self.assertEqual(AssetConfigEntry.objects.values('asset').distinct().count(), 200)
+        self.assertTrue(Asset.objects.filter(ip_address__contains=':').exists())
+
+        roles = UserRole.objects.filter(user__username__startswith='bench-user-')
+        self.assertEqual(roles.count(), 30)
+        self.assertFalse(roles.filter(role='user', customers=None).exists())
+        self.assertTrue(Client().login(username='bench-user-0', password='secret'))
+
+        with self.assertRaisesMessage(CommandError, 'already exist'):
+            call_command('seed_benchmark_data', customers=1, assets=1, users=1, stdout=out)
+
+    # Each registered benchmark at a size that runs in moments
+    tiny = {
+        'git_export': {'assets': 20, 'customers': 2},
+        'directory_sync': {'identities': 20},
+        'asset_groups': {'assets': 50, 'customers': 2, 'rules': 5},
+        'patch_compliance': {'assets': 50, 'customers': 2},
+        'customer_stats': {'assets': 50, 'customers': 2},
+        'poll_assets': {'assets': 10, 'concurrency': 10},
+        'check_history': {'assets': 20, 'history_assets': 2, 'days': 1, 'interval': 3600},
+        'log_ingest': {'assets': 20, 'lines': 30},
+        'ip_index': {'assets': 50, 'customers': 5, 'lookups': 100},
+        'api': {'assets': 50, 'customers': 2, 'requests': 3},
+        'journal': {'assets': 20, 'customers': 2, 'saves': 10},
+        'inventory_snapshots': {'assets': 200, 'changes': 20},
+        'instrumentation': {'assets': 20, 'customers': 2, 'requests': 3},
+        'urls': {'assets': 50, 'customers': 2, 'users': 5, 'requests': 1},
+    }
+
+    def test_every_benchmark_runs(self):
+        self.assertEqual(set(self.tiny), set(BENCHMARKS))
+        # The journal's writer thread would lock the benchmark out of the database
+        with mock.patch.dict(BENCHMARKS, {'probe': lambda: {'async': settings.JOURNAL_ASYNC}}):
+            self.assertEqual(run_benchmark('probe'), {'async': False})
+        for name, options in self.tiny.items():
+            # Each on an empty database, as the command runs them
+            with self.subTest(benchmark=name), transaction.atomic():
+                cache.clear()
+                results = run_benchmark(name, **options)
+                self.assertIsInstance(results, dict)
+                transaction.set_rollback(True)
+
+    def test_url_cases_cover_named_urls(self):
+        cases = list(url_cases({'asset': 1, 'api-asset': 1, 'customer': 2, 'api-customer': 2, 'user': 3}))
+        labels = {label for label, _, _ in cases}
+        self.assertIn('asset-detail', labels)
+        self.assertIn('dashboard?search=asset-00001', labels)
+        self.assertNotIn('root', labels)
+        paths = dict((label, path) for label, path, _ in cases)
+        self.assertEqual(paths['api-customer-detail'], '/api/customers/2/')
+        self.assertEqual(percentile([5, 1, 4, 2, 3], 50), 3)
+        self.assertEqual(percentile([5, 1, 4, 2, 3], 99), 5)
+
+
+class DashboardFragmentCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.acme = make_customer('Acme')
+        cls.globex = make_customer('Globex')
+        cls.admin = make_user('admin', role='admin', is_staff=True)
+        cls.manager = make_user('manager', role='manager', customers=[cls.acme], is_staff=True)
+        cls.asset = Asset(customer=cls.acme, name='web-1', asset_type='server', ip_address='10.0.0.1')
+        cls.asset.save()
+
+    def setUp(self):
+        cache.clear()
+
+    def dashboard(self):
+        return self.client.get(reverse('dashboard')).content.decode()
+
+    def test_rows_are_cached_until_the_asset_changes(self):
+        self.client.force_login(self.admin)
+        self.assertIn('web-1', self.dashboard())
+        # Writes that bypass every invalidation path show the cached row
+        Asset.objects.filter(pk=self.asset.pk).update(name='web-2')
+        self.assertIn('web-1', self.dashboard())
+
+        asset = Asset.objects.get(pk=self.asset.pk)
+        asset.save()
+        self.assertIn('web-2', self.dashboard())
+
+        checked_at = timezone.now() - timedelta(days=3)
+        Poller().write([(asset.pk, None, checked_at)], {asset.pk: None})
+        self.assertIn(checked_at.strftime('%Y-%m-%d %H:%M'), self.dashboard())
+
+        self.acme.display_name = 'Acme Corp'
+        self.acme.save()
+        self.assertIn('<td>Acme Corp</td>', self.dashboard())
+
+        Asset.objects.filter(pk=asset.pk).update(name='web-3')
+        mark_patched(Asset.objects.filter(pk=asset.pk))
+        self.assertIn('web-3', self.dashboard())
+
+    def test_rows_follow_timestamps_written_by_other_processes(self):
+        # Another process's version bumps never reach a per-process cache,
+        # so these writes bump nothing here
+        self.client.force_login(self.admin)
+        self.dashboard()
+        checked_at = timezone.now() - timedelta(days=2)
+        Asset.objects.filter(pk=self.asset.pk).update(last_checked=checked_at, last_seen=checked_at)
+        self.assertIn(checked_at.strftime('%Y-%m-%d %H:%M'), self.dashboard())
+        Asset.objects.filter(pk=self.asset.pk).update(name='web-9', updated_at=timezone.now())
+        self.assertIn('web-9', self.dashboard())
+
+    def test_customer_dropdown_is_cached_per_tenant(self):
+        self.client.force_login(self.admin)
+        self.dashboard()
+        with CaptureQueriesContext(connection) as cached:
+            html = self.dashboard()
+        self.assertIn('Globex', html)
+        self.assertFalse([query for query in cached.captured_queries if 'FROM "assets_customer"' in query['sql']])
+
+        self.client.force_login(self.manager)
+        html = self.dashboard()
+        self.assertIn('Acme', html)
+        self.assertNotIn('Globex', html)
+
+        self.globex.display_name = 'Globex Corp'
+        self.globex.save()
+        self.client.force_login(self.admin)
+        self.assertIn('Globex Corp', self.dashboard())
+
+        # Provisioning bulk-creates customers without post_save
+        user, = User.objects.bulk_create([User(username='initech')])
+        provision_user(user)
+        self.assertIn('Customer initech', self.dashboard())
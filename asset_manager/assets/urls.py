@@ -1,9 +1,11 @@
 from django.urls import path
 from django.views.generic.base import RedirectView
+from .api import AssetDetailApiView, AssetListApiView, CustomerDetailApiView, CustomerListApiView
 from .views import (
-    AssetListView, AssetCreateView, AssetUpdateView, AssetDeleteView,
-    CustomerListView, CustomerCreateView, CustomerUpdateView, CustomerDeleteView,
-    UserListView, UserCreateView, UserUpdateView, UserRoleUpdateView  # Add these
+    AssetListView, AssetCreateView, AssetDetailView, AssetHistoryView, AssetUpdateView, AssetDeleteView, AssetImportView,
+    CustomerListView, CustomerCreateView, CustomerUpdateView, CustomerDeleteView, AssetExportView,
+    UserListView, UserCreateView, UserUpdateView, UserRoleUpdateView,  # Add these
+    MetricsView, PerformanceView,
 )
 
 urlpatterns = [
@@ -12,18 +14,32 @@ urlpatterns = [
     
     # Asset URLs
     path('asset/new/', AssetCreateView.as_view(), name='asset-create'),
+    path('asset/<int:pk>/', AssetDetailView.as_view(), name='asset-detail'),
+    path('asset/<int:pk>/history/', AssetHistoryView.as_view(), name='asset-history'),
     path('asset/<int:pk>/update/', AssetUpdateView.as_view(), name='asset-update'),
     path('asset/<int:pk>/delete/', AssetDeleteView.as_view(), name='asset-delete'),
+    path('asset/import/', AssetImportView.as_view(), name='asset-import'),
     
     # Customer URLs
     path('customers/', CustomerListView.as_view(), name='customer-list'),
     path('customer/new/', CustomerCreateView.as_view(), name='customer-create'),
     path('customer/<int:pk>/update/', CustomerUpdateView.as_view(), name='customer-update'),
     path('customer/<int:pk>/delete/', CustomerDeleteView.as_view(), name='customer-delete'),
+    path('customer/<int:pk>/export/', AssetExportView.as_view(), name='customer-export'),
     
     # User management URLs
     path('users/', UserListView.as_view(), name='user-list'),
     path('user/new/', UserCreateView.as_view(), name='user-create'),
     path('user/<int:pk>/update/', UserUpdateView.as_view(), name='user-update'),
     path('user/<int:pk>/role/', UserRoleUpdateView.as_view(), name='user-role'),
+
+    # JSON API (read-only)
+    path('api/assets/', AssetListApiView.as_view(), name='api-asset-list'),
+    path('api/assets/<int:pk>/', AssetDetailApiView.as_view(), name='api-asset-detail'),
+    path('api/customers/', CustomerListApiView.as_view(), name='api-customer-list'),
+    path('api/customers/<int:pk>/', CustomerDetailApiView.as_view(), name='api-customer-detail'),
+
+    # Instrumentation (see assets.instrumentation)
+    path('performance/', PerformanceView.as_view(), name='performance'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
\ No newline at end of file
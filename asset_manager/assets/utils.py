@@ -0,0 +1,8 @@
+# Keeps IN (...) lists below SQLite's bound parameter limit
+LOOKUP_CHUNK_SIZE = 1000
+
+
+def chunked(items, size=LOOKUP_CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
@@ -0,0 +1,66 @@
+import time
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+# Version counters live in the shared cache so every process sees a bump.
+# A counter that is missing (never set, or evicted) restarts from the clock
+# rather than from 1, so it cannot come back to a value some process still
+# holds data for.
+
+
+def versions_are_shared():
+    """
+    Whether other processes see the bumps: not with a per-process cache
+    (the default LocMemCache), where a long-running process that must
+    follow the web processes' writes has to watch the database instead.
+    """
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def version_key(name):
+    return f'version:{name}'
+
+
+def get_version(name):
+    key = version_key(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def get_versions(names):
+    keys = {version_key(name): name for name in names}
+    found = cache.get_many(keys)
+    versions = {keys[key]: value for key, value in found.items()}
+    for name in keys.values():
+        if name not in versions:
+            versions[name] = get_version(name)
+    return versions
+
+
+def _bump(keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), None)
+
+
+def bump_versions(names):
+    """Invalidate everything cached under ``names``, now and again on commit."""
+    keys = [version_key(name) for name in names]
+    if not keys:
+        return
+    _bump(keys)
+    # Readers inside other transactions may have rebuilt their data from
+    # rows this transaction is still changing
+    transaction.on_commit(lambda: _bump(keys))
+
+
+def bump_version(name):
+    bump_versions([name])
@@ -1,51 +1,125 @@
-from django.views.generic import ListView, CreateView, UpdateView, DeleteView
+import math
+from datetime import timedelta
+
+from django.views.generic import ListView, CreateView, DetailView, UpdateView, DeleteView, FormView, TemplateView, View
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.models import User
 from django.urls import reverse_lazy
 from django.contrib import messages
-from django.db.models import Q
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Exists, OuterRef, Prefetch, Q
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from .models import Asset, Customer, UserRole
-from .forms import AssetForm, CustomerForm, UserCreateForm, UserRoleForm
-
-class AssetListView(LoginRequiredMixin, ListView):
+from .compliance import Compliance, customer_compliance
+from .config_index import filter_by_config, parse_config_filters
+from .history import TIER_NAMES, history
+from .fragments import annotate_row_versions, customer_options_key, fragment_timeout
+from .forms import AssetForm, AssetImportForm, CustomerForm, UserCreateForm, UserRoleForm, parse_configuration
+from .exporters import CONTENT_TYPES, EXPORT_FORMATS, export_assets, parse_since
+from .importers import ImportFormatError, import_assets, text_stream
+from .instrumentation import prometheus_text, registry
+from .journal import object_history
+from .pagination import InvalidCursor, KeysetPaginator
+from .scope import TenantScopeMixin, get_scope
+from .search import filter_assets, search_assets
+from .stats import AssetTotals, asset_totals, customer_totals
+
+class AssetListView(LoginRequiredMixin, TenantScopeMixin, ListView):
     model = Asset
     template_name = 'assets/dashboard.html'
     context_object_name = 'assets'
+    sort_options = ['name', '-name', '-last_checked', 'business_criticality', '-business_criticality']
+    default_sort = '-last_checked'
+
+    def get_sort(self):
+        sort = self.request.GET.get('sort', self.default_sort)
+        return sort if sort in self.sort_options else self.default_sort
+
+    def get_keyset_ordering(self):
+        # Filtering on one criticality leaves only the pk to order by in a
+        # criticality sort; seeking on it keeps the page on the equality index
+        sort = self.get_sort()
+        if sort.lstrip('-') == 'business_criticality' and self.request.GET.get('criticality'):
+            return sort.replace('business_criticality', 'id')
+        return sort
+
+    def is_ranked_search(self):
+        # Searches are ordered by relevance unless a sort column was picked
+        return (bool(self.request.GET.get('search', '').strip()) and
+                self.request.GET.get('sort', 'relevance') == 'relevance')
+
+    def get_paginate_by(self, queryset):
+        page_size = getattr(settings, 'ASSET_LIST_PAGE_SIZE', 50)
+        max_page_size = getattr(settings, 'ASSET_LIST_MAX_PAGE_SIZE', 500)
+        try:
+            page_size = int(self.request.GET.get('page_size', page_size))
+        except ValueError:
+            pass
+        return max(1, min(page_size, max_page_size))
+
+    def paginate_queryset(self, queryset, page_size):
+        # ?page=N keeps classic offset paging for direct jumps; everything
+        # else seeks on (sort column, pk) so deep pages cost the same as page 1.
+        # Ranked search results are already bounded, so they use offsets too.
+        if self.page_kwarg in self.request.GET or self.is_ranked_search():
+            return super().paginate_queryset(queryset, page_size)
+        paginator = KeysetPaginator(queryset, self.get_keyset_ordering(), page_size)
+        try:
+            page = paginator.page(self.request.GET.get('cursor'))
+        except InvalidCursor:
+            raise Http404('Invalid cursor')
+        return (paginator, page, page.object_list, page.has_other_pages())
 
     def get_queryset(self):
-        queryset = Asset.objects.select_related('customer')
-        
-        if hasattr(self.request.user, 'userrole') and self.request.user.userrole.role == 'admin':
-            pass
-        elif hasattr(self.request.user, 'userrole'):
-            queryset = queryset.filter(customer__in=self.request.user.userrole.customers.all())
-        else:
-            queryset = Asset.objects.none()
+        queryset = self.scope.restrict(Asset.objects.select_related('customer'))
 
         # Get filter parameters
-        search = self.request.GET.get('search', '')
+        search = self.request.GET.get('search', '').strip()
         asset_type = self.request.GET.get('asset_type', '')
         criticality = self.request.GET.get('criticality', '')
         status = self.request.GET.get('status', '')
         customer = self.request.GET.get('customer', '')
-        sort = self.request.GET.get('sort', '-last_checked')
 
         # Apply filters
-        if search:
-            queryset = queryset.filter(
-                Q(name__icontains=search) |
-                Q(ip_address__icontains=search)
-            )
         if asset_type:
             queryset = queryset.filter(asset_type=asset_type)
         if criticality:
             queryset = queryset.filter(business_criticality=criticality)
         if status:
-            queryset = queryset.filter(status=status == 'active')
-        if customer and self.request.user.userrole.role in ['admin', 'manager']:
+            # SQLite renders status=True as a bare "WHERE status", which no
+            # index can serve; IN compares it like any other column
+            queryset = queryset.filter(status__in=[status == 'active'])
+        if customer and self.scope.can_manage:
             queryset = queryset.filter(customer_id=customer)
-
-        return queryset.order_by(sort)
+        queryset = filter_by_config(queryset, self.get_config_filters())
+        patch = self.request.GET.get('patch', '')
+        if patch == 'overdue':
+            queryset = queryset.filter(Q(patch_due_at__isnull=True) | Q(patch_due_at__lte=timezone.now()))
+        elif patch == 'compliant':
+            queryset = queryset.filter(patch_due_at__gt=timezone.now())
+
+        # Ranked search goes last: it orders and bounds whatever the filters
+        # left. With an explicit sort the match is just another filter.
+        if search:
+            if self.is_ranked_search():
+                return search_assets(queryset, search)
+            queryset = filter_assets(queryset, search)
+
+        sort = self.get_keyset_ordering()
+        return queryset.order_by(sort, '-pk' if sort.startswith('-') else 'pk')
+
+    def get_config_filters(self):
+        """``config.<key>=<value>`` parameters plus the "key=value, ..." filter box."""
+        filters = parse_config_filters(self.request.GET)
+        try:
+            filters += parse_configuration(self.request.GET.get('config', '')).items()
+        except ValidationError:
+            pass
+        return filters
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -56,17 +130,47 @@ class AssetListView(LoginRequiredMixin, ListView):
             'asset_type': self.request.GET.get('asset_type', ''),
             'criticality': self.request.GET.get('criticality', ''),
             'status': self.request.GET.get('status', ''),
-            'sort': self.request.GET.get('sort', '-last_checked')
+            'config': ', '.join(f'{key}={value}' for key, value in self.get_config_filters()),
+            'patch': self.request.GET.get('patch', ''),
+            'sort': 'relevance' if self.is_ranked_search() else self.get_sort()
         }
-        if hasattr(self.request.user, 'userrole') and self.request.user.userrole.role in ['admin', 'manager']:
-            if self.request.user.userrole.role == 'admin':
+        context['keyset_pagination'] = isinstance(context['paginator'], KeysetPaginator)
+        # Rows and dropdowns come from the fragment cache while their
+        # versions hold (see assets.fragments)
+        context['assets'] = context['object_list'] = list(context['object_list'])
+        annotate_row_versions(context['assets'])
+        context['fragment_timeout'] = fragment_timeout()
+        if self.scope.can_manage:
+            context['customer_options_key'] = customer_options_key(self.scope)
+            if self.scope.is_admin:
                 context['customers'] = Customer.objects.all()
             else:
-                context['customers'] = self.request.user.userrole.customers.all()
+                context['customers'] = self.scope.assigned_customers()
             context['current_filters']['customer'] = self.request.GET.get('customer', '')
+        context.update(self.get_compliance_context())
+        context['asset_totals'] = asset_totals(None if self.scope.is_admin else self.scope.customer_ids)
         return context
 
-class AssetCreateView(LoginRequiredMixin, CreateView):
+    def get_compliance_context(self):
+        compliance = customer_compliance()
+        if not self.scope.is_admin:
+            compliance = {pk: stats for pk, stats in compliance.items() if pk in self.scope.customer_ids}
+        rows = []
+        if len(compliance) > 1:
+            # Worst first; the dashboard only has room for a few, so only
+            # their names are loaded
+            worst = sorted(compliance, key=lambda pk: (compliance[pk].percent, pk))[:10]
+            customers = Customer.objects.filter(pk__in=worst).only('pk', 'display_name')
+            rows = sorted(
+                ((customer, compliance[customer.pk]) for customer in customers),
+                key=lambda row: (row[1].percent, row[0].display_name),
+            )
+        return {
+            'compliance_total': sum(compliance.values(), Compliance()),
+            'compliance_rows': rows,
+        }
+
+class AssetCreateView(LoginRequiredMixin, TenantScopeMixin, CreateView):
     model = Asset
     form_class = AssetForm
     template_name = 'assets/asset_form.html'
@@ -74,9 +178,9 @@ class AssetCreateView(LoginRequiredMixin, CreateView):
 
     def get_form(self, form_class=None):
         form = super().get_form(form_class)
-        if self.request.user.userrole.role != 'admin':
+        if not self.scope.is_admin:
             # Non-admin users can only see their assigned customers
-            form.fields['customer'].queryset = self.request.user.userrole.customers.all()
+            form.fields['customer'].queryset = self.scope.assigned_customers()
         return form
 
     def form_valid(self, form):
@@ -85,7 +189,7 @@ class AssetCreateView(LoginRequiredMixin, CreateView):
             form.instance.customer = self.request.user.customer
         return super().form_valid(form)
 
-class AssetUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class AssetUpdateView(LoginRequiredMixin, TenantScopeMixin, UserPassesTestMixin, UpdateView):
     model = Asset
     form_class = AssetForm
     template_name = 'assets/asset_form.html'
@@ -94,17 +198,71 @@ class AssetUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     def test_func(self):
         asset = self.get_object()
         # Allow access if user is admin or asset's customer is in user's assigned customers
-        return (self.request.user.userrole.role == 'admin' or 
-                asset.customer in self.request.user.userrole.customers.all())
+        return self.scope.is_admin or asset.customer_id in self.scope.customer_ids
 
     def get_form(self, form_class=None):
         form = super().get_form(form_class)
-        if self.request.user.userrole.role != 'admin':
+        if not self.scope.is_admin:
             # Non-admin users can only see their assigned customers
-            form.fields['customer'].queryset = self.request.user.userrole.customers.all()
+            form.fields['customer'].queryset = self.scope.assigned_customers()
         return form
 
-class AssetDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
+class AssetDetailView(LoginRequiredMixin, TenantScopeMixin, DetailView):
+    model = Asset
+    template_name = 'assets/asset_detail.html'
+
+    recent_log_events = 20
+    recent_changes = 20
+
+    def get_queryset(self):
+        return self.scope.restrict(Asset.objects.select_related('customer'))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['log_events'] = self.object.log_events.defer('fields')[:self.recent_log_events]
+        context['changes'] = object_history(Asset, self.object.pk)[:self.recent_changes]
+        return context
+
+class AssetHistoryView(LoginRequiredMixin, TenantScopeMixin, View):
+    """
+    An asset's check history as JSON for the detail page chart: ``start``
+    and ``end`` (ISO 8601) or the last ``hours``, optionally at a fixed
+    ``resolution`` (raw, 5m or 1h).
+    """
+    max_range = timedelta(days=400)
+
+    def get(self, request, pk):
+        asset = get_object_or_404(self.scope.restrict(Asset.objects.only('pk', 'customer_id')), pk=pk)
+        now = timezone.now()
+        try:
+            end = parse_datetime(request.GET['end']) if request.GET.get('end') else now
+            start = (parse_datetime(request.GET['start']) if request.GET.get('start')
+                     else end - timedelta(hours=float(request.GET.get('hours', 24))))
+        except ValueError:
+            start = end = None
+        if start is None or end is None or timezone.is_naive(start) or timezone.is_naive(end):
+            return HttpResponseBadRequest('start and end must be ISO 8601 datetimes with a timezone')
+        if not start < end or end - start > self.max_range:
+            return HttpResponseBadRequest('start must be before end, at most 400 days apart')
+        resolutions = {name: resolution for resolution, name in TIER_NAMES.items()}
+        resolution = request.GET.get('resolution')
+        if resolution and resolution not in resolutions:
+            return HttpResponseBadRequest(f'resolution must be one of {", ".join(resolutions)}')
+
+        resolution, buckets = history(asset.pk, start, end, now, resolution=resolutions.get(resolution))
+        return JsonResponse({
+            'resolution': TIER_NAMES[resolution],
+            'start': start,
+            'end': end,
+            'fields': ['time', 'checks', 'up', 'latency_min', 'latency_avg', 'latency_max'],
+            'points': [
+                [bucket.start, bucket.checks, bucket.up,
+                 *(None if math.isnan(value) else round(value, 1) for value in bucket[3:])]
+                for bucket in buckets
+            ],
+        })
+
+class AssetDeleteView(LoginRequiredMixin, TenantScopeMixin, UserPassesTestMixin, DeleteView):
     model = Asset
     success_url = reverse_lazy('dashboard')
     template_name = 'assets/asset_confirm_delete.html'
@@ -112,13 +270,71 @@ class AssetDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     def test_func(self):
         asset = self.get_object()
         # Allow access if user is admin or asset's customer is in user's assigned customers
-        return (self.request.user.userrole.role == 'admin' or 
-                asset.customer in self.request.user.userrole.customers.all())
+        return self.scope.is_admin or asset.customer_id in self.scope.customer_ids
 
     def delete(self, request, *args, **kwargs):
         messages.success(request, 'Asset successfully deleted.')
         return super().delete(request, *args, **kwargs)
 
+class AssetImportView(LoginRequiredMixin, TenantScopeMixin, FormView):
+    form_class = AssetImportForm
+    template_name = 'assets/asset_import.html'
+    max_reported_errors = 100
+
+    def get_form(self, form_class=None):
+        form = super().get_form(form_class)
+        if not self.scope.is_admin:
+            form.fields['customer'].queryset = self.scope.assigned_customers()
+        return form
+
+    def form_valid(self, form):
+        customer = form.cleaned_data['customer']
+        try:
+            result = import_assets(
+                text_stream(form.cleaned_data['file']),
+                form.cleaned_data['format'],
+                customer_ids=None if self.scope.is_admin else self.scope.customer_ids,
+                default_customer_id=customer.pk if customer else None,
+                max_errors=self.max_reported_errors,
+            )
+        except ImportFormatError as e:
+            form.add_error('file', str(e))
+            return self.form_invalid(form)
+
+        if result.imported:
+            messages.success(self.request, f'Imported {result.imported} assets from {result.rows} rows.')
+        if result.failed:
+            messages.warning(self.request, f'{result.failed} rows were rejected.')
+        if result.warned:
+            messages.warning(self.request, f'{result.warned} imported assets share an IP address with another asset.')
+        return self.render_to_response(self.get_context_data(form=form, result=result))
+
+class AssetExportView(LoginRequiredMixin, TenantScopeMixin, View):
+    """Stream a customer's assets as NDJSON, a JSON array or CSV, optionally gzipped."""
+
+    def get(self, request, pk):
+        customer = get_object_or_404(self.scope.restrict(Customer.objects.all(), field='pk'), pk=pk)
+
+        fmt = request.GET.get('format', 'json')
+        if fmt not in EXPORT_FORMATS:
+            return HttpResponseBadRequest(f'format must be one of {", ".join(EXPORT_FORMATS)}')
+        since = None
+        if request.GET.get('since'):
+            try:
+                since = parse_since(request.GET['since'])
+            except ValueError:
+                return HttpResponseBadRequest('since must be an ISO 8601 datetime')
+        compress = request.GET.get('gzip') in ('1', 'true')
+        config = parse_config_filters(request.GET)
+
+        response = StreamingHttpResponse(
+            export_assets(customer.pk, fmt, since=since, compress=compress, config=config),
+            content_type=CONTENT_TYPES[fmt],
+        )
+        filename = f'customer-{customer.pk}-assets.{fmt}' + ('.gz' if compress else '')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
 def dashboard(request):
     # Ensure user profile exists
     UserProfile.objects.get_or_create(user=request.user)
@@ -131,108 +347,117 @@ def dashboard(request):
     return render(request, 'assets/dashboard.html', context)
 
 # Add these new view classes:
-class CustomerListView(LoginRequiredMixin, ListView):
+class CustomerListView(LoginRequiredMixin, TenantScopeMixin, ListView):
     model = Customer
     template_name = 'assets/customer_list.html'
     context_object_name = 'customers'
 
     def get_queryset(self):
-        # Show all customers to admin and manager
-        if hasattr(self.request.user, 'userrole') and self.request.user.userrole.role in ['admin', 'manager']:
-            return Customer.objects.all()
-        # Show assigned customers to regular users
-        elif hasattr(self.request.user, 'userrole'):
-            return self.request.user.userrole.customers.all()
-        return Customer.objects.none()
+        # All customers for admins and managers, the assigned ones otherwise
+        return self.scope.visible_customers()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        customers = context['customers']
+        # Managers list every customer, so every customer's totals are needed
+        totals = customer_totals(None if self.scope.can_manage else [customer.pk for customer in customers])
+        for customer in customers:
+            customer.asset_totals = totals.get(customer.pk, AssetTotals())
+        return context
 
 # Update CustomerCreateView
-class CustomerCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
+class CustomerCreateView(LoginRequiredMixin, TenantScopeMixin, UserPassesTestMixin, CreateView):
     model = Customer
     form_class = CustomerForm
     template_name = 'assets/customer_form.html'
     success_url = reverse_lazy('customer-list')
 
     def test_func(self):
-        return hasattr(self.request.user, 'userrole') and self.request.user.userrole.role in ['admin', 'manager']
+        return self.scope.can_manage
 
 # Update CustomerUpdateView
-class CustomerUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class CustomerUpdateView(LoginRequiredMixin, TenantScopeMixin, UserPassesTestMixin, UpdateView):
     model = Customer
     form_class = CustomerForm
     template_name = 'assets/customer_form.html'
     success_url = reverse_lazy('customer-list')
 
     def test_func(self):
-        return hasattr(self.request.user, 'userrole') and self.request.user.userrole.role in ['admin', 'manager']
+        return self.scope.can_manage
 
     def get_queryset(self):
-        if self.request.user.userrole.role == 'admin':
+        if self.scope.is_admin:
             return Customer.objects.all()
-        return self.request.user.userrole.customers.all()
+        return self.scope.assigned_customers()
 
 # Update CustomerDeleteView
-class CustomerDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
+class CustomerDeleteView(LoginRequiredMixin, TenantScopeMixin, UserPassesTestMixin, DeleteView):
     model = Customer
     success_url = reverse_lazy('customer-list')
     template_name = 'assets/customer_confirm_delete.html'
 
     def test_func(self):
-        return hasattr(self.request.user, 'userrole') and self.request.user.userrole.role in ['admin', 'manager']
+        return self.scope.can_manage
 
     def get_queryset(self):
-        if self.request.user.userrole.role == 'admin':
+        if self.scope.is_admin:
             return Customer.objects.all()
-        return self.request.user.userrole.customers.all()
+        return self.scope.assigned_customers()
 
 # Add after existing views
-class UserListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class UserListView(LoginRequiredMixin, TenantScopeMixin, UserPassesTestMixin, ListView):
     model = User
     template_name = 'assets/user_list.html'
     context_object_name = 'users'
 
     def test_func(self):
-        return (hasattr(self.request.user, 'userrole') and 
-                self.request.user.userrole.role in ['admin', 'manager'])
+        return self.scope.can_manage
+
+    def get_paginate_by(self, queryset):
+        return getattr(settings, 'USER_LIST_PAGE_SIZE', 100)
 
     def get_queryset(self):
-        if self.request.user.userrole.role == 'admin':
-            return User.objects.all()
+        # One query for the page of users with their roles, one for all of
+        # their customers, however many rows the page has
+        queryset = User.objects.select_related('userrole').prefetch_related(
+            Prefetch('userrole__customers', queryset=Customer.objects.only('pk', 'display_name'))
+        ).order_by('username')
+        if self.scope.is_admin:
+            return queryset
         # Managers can only see users assigned to their customers
-        return User.objects.filter(
-            userrole__customers__in=self.request.user.userrole.customers.all()
-        ).distinct()
+        return queryset.filter(Exists(
+            UserRole.customers.through.objects.filter(
+                userrole__user=OuterRef('pk'),
+                customer_id__in=self.scope.customer_ids,
+            )
+        ))
 
-class UserCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
+class UserCreateView(LoginRequiredMixin, TenantScopeMixin, UserPassesTestMixin, CreateView):
     model = User
     form_class = UserCreateForm
     template_name = 'assets/user_form.html'
     success_url = reverse_lazy('user-list')
 
     def test_func(self):
-        return self.request.user.userrole.role in ['admin', 'manager']
-
-    def form_valid(self, form):
-        response = super().form_valid(form)
-        UserRole.objects.create(user=self.object, role='user')
-        return response
+        return self.scope.can_manage
 
-class UserUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class UserUpdateView(LoginRequiredMixin, TenantScopeMixin, UserPassesTestMixin, UpdateView):
     model = User
     template_name = 'assets/user_form.html'
     fields = ['username', 'email', 'first_name', 'last_name']
     success_url = reverse_lazy('user-list')
 
     def test_func(self):
-        return self.request.user.userrole.role in ['admin', 'manager']
+        return self.scope.can_manage
 
-class UserRoleUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class UserRoleUpdateView(LoginRequiredMixin, TenantScopeMixin, UserPassesTestMixin, UpdateView):
     model = UserRole
     form_class = UserRoleForm
     template_name = 'assets/user_role_form.html'
     success_url = reverse_lazy('user-list')
 
     def test_func(self):
-        return self.request.user.userrole.role in ['admin', 'manager']
+        return self.scope.can_manage
 
     def get_object(self, queryset=None):
         user = User.objects.get(pk=self.kwargs['pk'])
@@ -243,8 +468,64 @@ class UserRoleUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         return role
 
     def get_queryset(self):
-        if self.request.user.userrole.role == 'admin':
+        if self.scope.is_admin:
             return UserRole.objects.all()
-        return UserRole.objects.filter(
-            customers__in=self.request.user.userrole.customers.all()
-        ).distinct()
+        return UserRole.objects.filter(Exists(
+            UserRole.customers.through.objects.filter(
+                userrole=OuterRef('pk'),
+                customer_id__in=self.scope.customer_ids,
+            )
+        ))
+
+class PerformanceView(LoginRequiredMixin, TenantScopeMixin, UserPassesTestMixin, TemplateView):
+    """Per-view latency, query and template figures of this process (see assets.instrumentation)."""
+    template_name = 'assets/performance.html'
+
+    def test_func(self):
+        return self.scope.is_admin
+
+    def post(self, request):
+        registry.reset()
+        messages.success(request, 'Performance figures reset')
+        return self.get(request)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        def ms(seconds):
+            return None if seconds is None else seconds * 1000
+
+        rows = []
+        for view, stats in registry.snapshot().items():
+            latency = stats.histograms['request_seconds']
+            queries = stats.histograms['queries']
+            rows.append({
+                'view': view,
+                'requests': stats.requests,
+                'sampled': latency.count,
+                'total_seconds': latency.sum,
+                'mean_ms': ms(latency.mean),
+                'p50_ms': ms(latency.quantile(0.5)),
+                'p95_ms': ms(latency.quantile(0.95)),
+                'p99_ms': ms(latency.quantile(0.99)),
+                'mean_queries': queries.mean,
+                'p95_queries': queries.quantile(0.95),
+                'mean_sql_ms': ms(stats.histograms['sql_seconds'].mean),
+                'mean_template_ms': ms(stats.histograms['template_seconds'].mean),
+            })
+        # Where the time goes first
+        context['rows'] = sorted(rows, key=lambda row: -row['total_seconds'])
+        context['sample_rate'] = getattr(settings, 'INSTRUMENTATION_SAMPLE_RATE', 1.0)
+        return context
+
+class MetricsView(View):
+    """The instrumentation histograms for Prometheus, to admins and METRICS_ALLOWED_IPS."""
+
+    def get(self, request):
+        allowed = request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', [])
+        if not allowed and request.user.is_authenticated:
+            allowed = get_scope(request).is_admin
+        if not allowed:
+            return HttpResponseForbidden('Forbidden', content_type='text/plain')
+        return HttpResponse(
+            prometheus_text(registry.snapshot()), content_type='text/plain; version=0.0.4; charset=utf-8',
+        )